@@ -1,4 +1,7 @@
-from shared.models.env import EnvSettings
+import logging
+from contextlib import asynccontextmanager
+
+from shared.models.env import get_settings
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 # import sys
@@ -15,16 +18,73 @@ from routes.storage_routes import router as storage_router
 from routes.user_routes import router as users_router
 # from routes.visa_routes import router as visas_router
 from routes.access_request_routes import router as access_request_routes
+from routes.metrics_routes import router as metrics_router
+from routes.job_routes import router as jobs_router
+
+from repositories.CouchbaseConnectionPool import CouchbaseConnectionPool
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.CouchbaseIndexRegistry import CouchbaseIndexRegistry
+from repositories.StorageClientPool import StorageClientPool
+from repositories.PassportBrokerClient import PassportBrokerClient
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from services.ServiceContainer import ServiceContainer
+from services.JobServices import JobServices, get_job_services
+from services.StorageEventServices import StorageEventServices
+from services.UploadSweeperServices import UploadSweeperServices
 
-from starlette.middleware.base import BaseHTTPMiddleware
+from middlewares.AuthMiddleware import AuthenticationMiddleware
 
-from middlewares.AuthMiddleware import authentication_middleware
 
+settings = get_settings()
 
-settings = EnvSettings()
+logger = logging.getLogger(__name__)
 
 is_prod = settings.BACKEND_ENV == "prod"
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    CouchbaseConnectionPool.open(settings)
+    BlockingIOHandler.open(settings)
+    PassportBrokerClient.open(settings)
+    await CouchbaseKVRepository.connect(settings)
+    ServiceContainer.open()
+    JobServices.open(settings)
+
+    if settings.COUCHBASE_RECONCILE_INDEXES:
+        try:
+            indexRegistry = CouchbaseIndexRegistry()
+            await indexRegistry.ensure_collections()
+            await indexRegistry.reconcile()
+        except Exception as e:
+            logger.warning(f"Index reconciliation skipped: {e}")
+
+        try:
+            await CouchbaseIndexRegistry().reconcile_search()
+        except Exception as e:
+            logger.warning(f"Search index reconciliation skipped: {e}")
+
+    try:
+        await get_job_services().resume()
+    except Exception as e:
+        logger.warning(f"Unfinished jobs not resumed: {e}")
+
+    UploadSweeperServices.open(settings)
+    StorageEventServices.open(settings)
+
+    yield
+
+    await StorageEventServices.close()
+    await UploadSweeperServices.close()
+    await JobServices.close()
+    ServiceContainer.close()
+    StorageClientPool.close()
+    BlockingIOHandler.close()
+    await PassportBrokerClient.close()
+    await CouchbaseKVRepository.close()
+    await CouchbaseConnectionPool.close()
+
+
 app = FastAPI(
     title="Lakehouse API",
     version="1.0.0",
@@ -35,6 +95,7 @@ app = FastAPI(
         {"url": "/", "description": "Local Development"},
         {"url": "/api", "description": "Production via NGINX Reverse Proxy"},
     ],
+    lifespan=lifespan,
 )
 
 # app.add_middleware(
@@ -54,8 +115,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# app.middleware("http")(authentication_middleware)
-app.add_middleware(BaseHTTPMiddleware, dispatch=authentication_middleware)
+app.add_middleware(AuthenticationMiddleware)
 
 app.include_router(auth_router)
 app.include_router(catalog_router)
@@ -63,4 +123,6 @@ app.include_router(access_request_routes)
 app.include_router(credentials_router)
 app.include_router(storage_router)
 app.include_router(users_router)
+app.include_router(jobs_router)
+app.include_router(metrics_router)
 # app.include_router(visas_router)
\ No newline at end of file
@@ -1,72 +1,123 @@
-from fastapi import Request, status
+import re
+from typing import List, Optional, Pattern, Tuple
+
+from fastapi import HTTPException, status
 from fastapi.params import Depends
 from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from routes.auth_routes import auth_oauth2_scheme
-from shared.models.env import EnvSettings
+from shared.handlers.RequestContextHandler import RequestContextHandler
+from shared.models.authentication import TokenData
+from shared.models.env import get_settings
 
-settings = EnvSettings()
+settings = get_settings()
 
-async def authentication_middleware(request: Request, call_next):
-    from routes.conf import routes_access
-    from services.AuthServices import AuthServices
 
-    if request.method == "OPTIONS":
-        return await call_next(request)
-    
-    if any(request.url.path.startswith(path) for path in routes_access.no_auth_routes_list):
-        return await call_next(request)
+def compile_route_prefixes(routes: List[str]) -> Pattern:
+    """Single regex matching any path that starts with one of the given routes."""
+    if not routes:
+        return re.compile(r"(?!)")
 
-    exclude_paths = routes_access.no_auth_routes_list
+    # longest first, so overlapping prefixes resolve to the most specific one
+    alternatives = "|".join(re.escape(route) for route in sorted(routes, key=len, reverse=True))
 
-    admin_routes = routes_access.admin_routes_list
+    return re.compile(f"(?:{alternatives})")
 
-    if request.url.path in exclude_paths:
-        return await call_next(request)
 
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        return JSONResponse(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            content={"detail": "Authorization header missing or invalid"},
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+class AuthenticationMiddleware:
+    """
+    Pure ASGI authentication middleware.
+
+    Requests to the no-auth routes and CORS preflights pass through. Every other
+    request needs a valid Bearer token, admin routes additionally need the admin
+    role. The caller is stored in request.state (user, user_role, user_email)
+    and a request context is opened for the rest of the request (see
+    RequestContextHandler). Unlike BaseHTTPMiddleware, the downstream app runs
+    in the same task and its response is streamed through untouched.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        from routes.conf import routes_access
+
+        self.app = app
+
+        self.no_auth_routes = compile_route_prefixes(routes_access.no_auth_routes_list)
+        self.admin_routes = compile_route_prefixes(routes_access.admin_routes_list)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
 
-    token = auth_header.split(" ")[1]
-    token = token.strip()
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
 
-    authServices = AuthServices()
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
 
-    decoded_token = authServices.decode_jwt_token(token)
+        if self.no_auth_routes.match(path):
+            await self.app(scope, receive, send)
+            return
 
-    for route in admin_routes:
-        if route in request.url.path and decoded_token.user_role != "admin":
-            return JSONResponse(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                content={"detail": "Access denied: insufficient privileges"},
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+        response, token_data = self.__authenticate(headers=Headers(scope=scope), path=path)
 
-    user_id = decoded_token.user_id
+        if response is not None:
+            await response(scope, receive, send)
+            return
 
-    if not user_id:
+        state = scope.setdefault("state", {})
+        state["user"] = token_data.user_id
+        state["user_role"] = token_data.user_role
+        state["user_email"] = token_data.user_email
+
+        # memoizes passport/visa/user lookups for the rest of this request
+        context_token = RequestContextHandler.start(user_id=token_data.user_id)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            RequestContextHandler.reset(context_token)
+
+    def __unauthorized(self, detail: str, headers: dict = None) -> JSONResponse:
         return JSONResponse(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            content={"detail": "Invalid token"},
-            headers={"WWW-Authenticate": "Bearer"},
+            content={"detail": detail},
+            headers=headers or {"WWW-Authenticate": "Bearer"},
         )
 
-    request.state.user = user_id
-    request.state.user_role = decoded_token.user_role
-    request.state.user_email = decoded_token.user_email
+    def __authenticate(self, headers: Headers, path: str) -> Tuple[Optional[JSONResponse], Optional[TokenData]]:
+        from services.AuthServices import get_auth_services
+
+        auth_header = headers.get("Authorization")
+
+        if not auth_header or not auth_header.startswith("Bearer "):
+            return self.__unauthorized("Authorization header missing or invalid"), None
+
+        token = auth_header.split(" ")[1]
+        token = token.strip()
+
+        authServices = get_auth_services()
+
+        try:
+            decoded_token = authServices.decode_jwt_token(token)
+        except HTTPException as e:
+            return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers), None
+
+        if self.admin_routes.match(path) and decoded_token.user_role != "admin":
+            return self.__unauthorized("Access denied: insufficient privileges"), None
+
+        if not decoded_token.user_id:
+            return self.__unauthorized("Invalid token"), None
 
-    return await call_next(request)
+        return None, decoded_token
 
 
 async def get_user_id(token: str = Depends(auth_oauth2_scheme)):
-    from services.AuthServices import AuthServices
+    from services.AuthServices import get_auth_services
 
-    authServices = AuthServices()
+    authServices = get_auth_services()
 
     decoded_user = authServices.decode_jwt_token(token)
 
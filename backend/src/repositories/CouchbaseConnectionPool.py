@@ -0,0 +1,118 @@
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+
+from shared.models.env import EnvSettings, get_settings
+from shared.models.metrics import ConnectionPoolMetrics
+
+
+class CouchbaseConnectionPool:
+    """
+    Application-wide HTTP connection pool shared by every CouchbaseRepository.
+
+    The pool is opened on application startup and closed on shutdown (see the
+    lifespan handler in app.py). Outside of the app (scripts, shells) it is
+    opened lazily on first use.
+    """
+
+    _client: httpx.AsyncClient = None
+    _max_connections: int = 0
+    _max_keepalive_connections: int = 0
+
+    _in_flight: int = 0
+    _peak_in_flight: int = 0
+    _requests_total: int = 0
+    _errors_total: int = 0
+    _latency_total: float = 0.0
+
+    @classmethod
+    def open(cls, settings: EnvSettings = None) -> httpx.AsyncClient:
+        if cls._client is not None:
+            return cls._client
+
+        settings = settings if settings else get_settings()
+
+        cls._max_connections = settings.COUCHBASE_MAX_CONNECTIONS
+        cls._max_keepalive_connections = settings.COUCHBASE_MAX_KEEPALIVE_CONNECTIONS
+
+        limits = httpx.Limits(
+            max_connections=settings.COUCHBASE_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.COUCHBASE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.COUCHBASE_KEEPALIVE_EXPIRY_SECONDS,
+        )
+
+        timeout = httpx.Timeout(
+            settings.COUCHBASE_REQUEST_TIMEOUT_SECONDS,
+            pool=settings.COUCHBASE_POOL_TIMEOUT_SECONDS,
+        )
+
+        cls._client = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+        return cls._client
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._client is None:
+            return
+
+        await cls._client.aclose()
+        cls._client = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = None
+            return cls.open()
+        return cls._client
+
+    @classmethod
+    @asynccontextmanager
+    async def track(cls):
+        """Account one request against the pool usage metrics."""
+        cls._in_flight += 1
+        cls._peak_in_flight = max(cls._peak_in_flight, cls._in_flight)
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        except Exception:
+            cls._errors_total += 1
+            raise
+        finally:
+            cls._in_flight -= 1
+            cls._requests_total += 1
+            cls._latency_total += time.perf_counter() - started_at
+
+    @classmethod
+    def metrics(cls) -> ConnectionPoolMetrics:
+        open_connections = None
+        idle_connections = None
+
+        # httpx does not expose pool state publicly, so read it best-effort
+        transport = getattr(cls._client, "_transport", None)
+        pool = getattr(transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+
+        if connections is not None:
+            open_connections = len(connections)
+            idle_connections = len([conn for conn in connections if conn.is_idle()])
+
+        average_latency_ms = (
+            (cls._latency_total / cls._requests_total) * 1000
+            if cls._requests_total
+            else 0.0
+        )
+
+        return ConnectionPoolMetrics(
+            is_open=cls._client is not None and not cls._client.is_closed,
+            max_connections=cls._max_connections,
+            max_keepalive_connections=cls._max_keepalive_connections,
+            open_connections=open_connections,
+            idle_connections=idle_connections,
+            in_flight=cls._in_flight,
+            peak_in_flight=cls._peak_in_flight,
+            requests_total=cls._requests_total,
+            errors_total=cls._errors_total,
+            average_latency_ms=round(average_latency_ms, 3),
+        )
@@ -0,0 +1,281 @@
+import logging
+from typing import Dict, List, Tuple
+
+from repositories.CouchbaseRepository import CouchbaseRepository
+from shared.models.indexes import CouchbaseIndexDefinition, CouchbaseSearchIndexDefinition
+
+logger = logging.getLogger(__name__)
+
+
+# Secondary indexes covering the fields the services filter and order on.
+# Array index variables must match the variable names used by the queries
+# (see CouchbaseQueryBuilder.where_any calls in the services).
+INDEX_REGISTRY: List[CouchbaseIndexDefinition] = [
+    # catalogs.files: listings (access predicates + ORDER BY id), version lookups, searches and stats (covering)
+    CouchbaseIndexDefinition(
+        name="idx_files_listing_access", scope="catalogs", collection="files",
+        keys=["file_status", "public", "collection_id", "inserted_by", "id"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_collection_file", scope="catalogs", collection="files",
+        keys=["collection_id", "file_name", "file_category", "processing_level", "file_version"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_file_name", scope="catalogs", collection="files",
+        keys=["file_name"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_collection_name", scope="catalogs", collection="files",
+        keys=["collection_name", "processing_level", "file_version"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_inserted_by", scope="catalogs", collection="files",
+        keys=["inserted_by"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_status", scope="catalogs", collection="files",
+        keys=["file_status", "inserted_at"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_status_expiry", scope="catalogs", collection="files",
+        keys=["file_status", "expires_at"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_collection_id", scope="catalogs", collection="files",
+        keys=["collection_id", "id", "file_status"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_files_stats", scope="catalogs", collection="files",
+        keys=["file_status", "public", "collection_id", "inserted_by", "collection_name", "storage_type", "processing_level", "file_size", "file_version", "inserted_at"],
+    ),
+
+    # catalogs.collections: listings, duplicate-name check and ownership lookups
+    CouchbaseIndexDefinition(
+        name="idx_collections_listing", scope="catalogs", collection="collections",
+        keys=["status", "IFMISSINGORNULL(secret, false)", "id", "inserted_by", "collection_name"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_collections_name_storage", scope="catalogs", collection="collections",
+        keys=["collection_name", "storage_type", "location", "status"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_collections_inserted_by", scope="catalogs", collection="collections",
+        keys=["inserted_by"],
+    ),
+
+    # catalogs.jobs: unfinished background jobs, resumed on startup
+    CouchbaseIndexDefinition(
+        name="idx_jobs_status", scope="catalogs", collection="jobs",
+        keys=["status", "job_type", "created_at"],
+    ),
+
+    # users
+    CouchbaseIndexDefinition(
+        name="idx_info_email", scope="users", collection="info",
+        keys=["email"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_visa_user_uuid", scope="users", collection="visa",
+        keys=["user_uuid"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_visa_assertion_ids", scope="users", collection="visa",
+        keys=["DISTINCT ARRAY assertion.passportVisa.id FOR assertion IN passportVisaAssertions END"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_access_requests_collection", scope="users", collection="access_requests",
+        keys=["collection_id", "requested_at DESC"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_access_requests_owner", scope="users", collection="access_requests",
+        keys=["owner_id", "requested_at DESC"],
+    ),
+    CouchbaseIndexDefinition(
+        name="idx_access_requests_requested_by", scope="users", collection="access_requests",
+        keys=["requested_by", "requested_at DESC"],
+    ),
+
+    # credentials
+    CouchbaseIndexDefinition(
+        name="idx_cloud_visa_ids", scope="credentials", collection="cloud",
+        keys=["DISTINCT ARRAY id FOR id IN visa_uuids END"],
+    ),
+]
+
+# Full-text search indexes behind /catalog/search. Text fields are analyzed (lowercased words),
+# keyword fields are indexed as they are and only serve the access restrictions.
+SEARCH_INDEX_REGISTRY: List[CouchbaseSearchIndexDefinition] = [
+    CouchbaseSearchIndexDefinition(
+        name="fts_catalog_files", scope="catalogs", collection="files",
+        text_fields=["file_name", "file_description", "collection_name"],
+        keyword_fields=["collection_id", "file_status", "inserted_by"],
+        boolean_fields=["public"],
+    ),
+    CouchbaseSearchIndexDefinition(
+        name="fts_catalog_collections", scope="catalogs", collection="collections",
+        text_fields=["collection_name", "collection_description"],
+        keyword_fields=["status", "inserted_by"],
+        boolean_fields=["public", "secret"],
+    ),
+]
+
+# Collections created by the application itself when missing (the others come
+# from couchbase/scripts/initialize_couchbase.sh), as (scope, collection).
+COLLECTION_REGISTRY: List[Tuple[str, str]] = [
+    ("catalogs", "jobs"),
+    ("catalogs", "upload_sessions"),
+    ("catalogs", "file_versions"),
+    ("users", "collection_access"),
+]
+
+
+class CouchbaseIndexRegistry:
+    """
+    Reconciles the declared collections, secondary and full-text search indexes with the ones present in the bucket.
+
+    Missing indexes are created deferred and then built together per collection,
+    so a startup with many missing indexes triggers a single build per keyspace.
+    Existing indexes are never altered or dropped.
+    """
+
+    def __init__(self, indexes: List[CouchbaseIndexDefinition] = None, search_indexes: List[CouchbaseSearchIndexDefinition] = None) -> None:
+        self.indexes = indexes if indexes is not None else INDEX_REGISTRY
+        self.search_indexes = search_indexes if search_indexes is not None else SEARCH_INDEX_REGISTRY
+
+        self.couchbaseRepo = CouchbaseRepository(scope="system")
+
+    def __keyspace(self, scope: str, collection: str) -> str:
+        return f"`{self.couchbaseRepo.bucket}`.`{scope}`.`{collection}`"
+
+    async def __existing_indexes(self) -> set:
+        query = "SELECT idx.name, idx.scope_id, idx.keyspace_id FROM system:indexes AS idx WHERE idx.bucket_id = $1"
+
+        response = await self.couchbaseRepo.query(statement=query, args=[self.couchbaseRepo.bucket])
+
+        return {
+            (row.get("scope_id"), row.get("keyspace_id"), row.get("name"))
+            for row in response
+        }
+
+    async def ensure_collections(self, collections: List[Tuple[str, str]] = None) -> List[str]:
+        """Create the registered collections missing from the bucket. Returns the created ones as scope.collection."""
+        collections = collections if collections is not None else COLLECTION_REGISTRY
+
+        created = []
+
+        for scope, collection in collections:
+            scopeRepo = CouchbaseRepository(scope=scope)
+
+            scopes = await scopeRepo.list_collections()
+
+            existing = {item["name"] for item in scopes[0]["collections"]} if scopes else set()
+
+            if collection in existing:
+                continue
+
+            try:
+                await scopeRepo.create_collection(collection_name=collection)
+            except Exception as e:
+                logger.warning(f"Unable to create collection {scope}.{collection}: {e}")
+                continue
+
+            created.append(f"{scope}.{collection}")
+
+        return created
+
+    async def reconcile(self) -> List[str]:
+        """Create every declared index that does not exist yet. Returns the created index names."""
+        existing = await self.__existing_indexes()
+
+        pending: Dict[Tuple[str, str], List[str]] = {}
+
+        for index in self.indexes:
+            if (index.scope, index.collection, index.name) in existing:
+                continue
+
+            query = (
+                f"CREATE INDEX `{index.name}` ON {self.__keyspace(index.scope, index.collection)}"
+                f"({', '.join(index.keys)})"
+            )
+
+            if index.condition:
+                query += f" WHERE {index.condition}"
+
+            query += ' WITH {"defer_build": true}'
+
+            try:
+                await self.couchbaseRepo.query(query)
+            except Exception as e:
+                logger.warning(f"Unable to create index {index.name}: {e}")
+                continue
+
+            pending.setdefault((index.scope, index.collection), []).append(index.name)
+
+        for (scope, collection), names in pending.items():
+            index_names = ", ".join(f"`{name}`" for name in names)
+
+            try:
+                await self.couchbaseRepo.query(f"BUILD INDEX ON {self.__keyspace(scope, collection)}({index_names})")
+            except Exception as e:
+                logger.warning(f"Unable to build indexes {names} on {scope}.{collection}: {e}")
+
+        return [name for names in pending.values() for name in names]
+
+    def __search_index_definition(self, index: CouchbaseSearchIndexDefinition) -> dict:
+        def field_mapping(field: str, field_type: str, analyzer: str = None) -> dict:
+            mapping = {"name": field, "type": field_type, "index": True, "store": False, "include_in_all": False}
+
+            if analyzer:
+                mapping["analyzer"] = analyzer
+
+            return {"enabled": True, "dynamic": False, "fields": [mapping]}
+
+        properties = {
+            **{field: field_mapping(field, "text", "standard") for field in index.text_fields},
+            **{field: field_mapping(field, "text", "keyword") for field in index.keyword_fields},
+            **{field: field_mapping(field, "boolean") for field in index.boolean_fields},
+        }
+
+        return {
+            "type": "fulltext-index",
+            "name": index.name,
+            "sourceType": "gocbcore",
+            "sourceName": self.couchbaseRepo.bucket,
+            "planParams": {"indexPartitions": 1, "numReplicas": 0},
+            "params": {
+                "doc_config": {"mode": "scope.collection.type_field", "type_field": "type"},
+                "mapping": {
+                    "default_analyzer": "standard",
+                    "default_mapping": {"enabled": False, "dynamic": False},
+                    "types": {
+                        f"{index.scope}.{index.collection}": {"enabled": True, "dynamic": False, "properties": properties}
+                    },
+                },
+                "store": {"indexType": "scorch"},
+            },
+        }
+
+    async def reconcile_search(self) -> List[str]:
+        """Create every declared full-text search index that does not exist yet. Returns the created index names."""
+        created = []
+
+        existing: Dict[str, set] = {}
+
+        for index in self.search_indexes:
+            scopeRepo = CouchbaseRepository(scope=index.scope)
+
+            if index.scope not in existing:
+                existing[index.scope] = set(await scopeRepo.list_search_indexes())
+
+            if index.name in existing[index.scope]:
+                continue
+
+            try:
+                await scopeRepo.upsert_search_index(index_name=index.name, definition=self.__search_index_definition(index))
+            except Exception as e:
+                logger.warning(f"Unable to create search index {index.name}: {e}")
+                continue
+
+            created.append(index.name)
+
+        return created
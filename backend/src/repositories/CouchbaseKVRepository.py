@@ -0,0 +1,307 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from repositories.CouchbaseRepository import CouchbaseError, CouchbaseRepository, DocumentNotFoundError
+from shared.models.bulk_operations import BulkOperationResult
+from shared.models.env import EnvSettings, get_settings
+
+try:
+    import couchbase.subdocument as SD
+    from acouchbase.cluster import Cluster
+    from couchbase.auth import PasswordAuthenticator
+    from couchbase.exceptions import CasMismatchException, CouchbaseException, DocumentExistsException, DocumentNotFoundException
+    from couchbase.options import ClusterOptions, ClusterTimeoutOptions, ReplaceOptions
+except ImportError:  # the SDK is optional, by-key calls fall back to N1QL without it
+    Cluster = None
+
+logger = logging.getLogger(__name__)
+
+
+class CouchbaseKVRepository(CouchbaseRepository):
+    """
+    CouchbaseRepository whose by-key operations go through the data (KV) service.
+
+    Get/insert/upsert/delete by document key use the async Couchbase SDK instead
+    of the query service. Everything else (queries, collections, buckets) is
+    inherited unchanged. When the SDK is not installed, KV is disabled or the
+    cluster is unreachable, the N1QL implementation of the parent class is used.
+
+    SDK failures are raised as CouchbaseError, with the codes the query service
+    gives to the same failures (see __error), so callers behave the same either way.
+    A missing document, which has no query service code, is a DocumentNotFoundError.
+    """
+
+    _cluster = None
+    _bucket = None
+    _batch_concurrency: int = 32
+
+    @classmethod
+    async def connect(cls, settings: EnvSettings = None) -> bool:
+        if cls._bucket is not None:
+            return True
+
+        settings = settings if settings else get_settings()
+
+        if Cluster is None or not settings.COUCHBASE_KV_ENABLED:
+            return False
+
+        cls._batch_concurrency = settings.COUCHBASE_KV_BATCH_CONCURRENCY
+
+        timeout_options = ClusterTimeoutOptions(
+            kv_timeout=timedelta(seconds=settings.COUCHBASE_KV_TIMEOUT_SECONDS)
+        )
+
+        try:
+            cluster = await Cluster.connect(
+                f"couchbase://{settings.COUCHBASE_HOST}",
+                ClusterOptions(
+                    PasswordAuthenticator(settings.COUCHBASE_USER, settings.COUCHBASE_PASSWORD),
+                    timeout_options=timeout_options,
+                ),
+            )
+            bucket = cluster.bucket(settings.COUCHBASE_BUCKET)
+            await bucket.on_connect()
+        except CouchbaseException as e:
+            logger.warning(f"Couchbase KV connection failed, falling back to N1QL: {e}")
+            return False
+
+        cls._cluster = cluster
+        cls._bucket = bucket
+
+        return True
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._cluster is None:
+            return
+
+        await cls._cluster.close()
+        cls._cluster = None
+        cls._bucket = None
+
+    @classmethod
+    def is_available(cls) -> bool:
+        return cls._bucket is not None
+
+    def __error(self, e: Exception) -> Exception:
+        if not isinstance(e, CouchbaseException):
+            return e
+
+        if isinstance(e, DocumentNotFoundException):
+            return DocumentNotFoundError(f"Couchbase error: {e}")
+
+        if isinstance(e, CasMismatchException):
+            codes = [CouchbaseRepository.CAS_MISMATCH_CODE]
+        elif isinstance(e, DocumentExistsException):
+            codes = [CouchbaseRepository.DOCUMENT_EXISTS_CODE]
+        else:
+            codes = []
+
+        return CouchbaseError(f"Couchbase error: {e}", codes=codes)
+
+    def __collection(self, collection_name: str):
+        return CouchbaseKVRepository._bucket.scope(self.scope).collection(collection_name)
+
+    async def create_document(
+        self, collection_name: str, key: str, value: dict
+    ) -> dict:
+        if not self.is_available():
+            return await super().create_document(collection_name=collection_name, key=key, value=value)
+
+        try:
+            await self.__collection(collection_name).insert(key, value)
+        except CouchbaseException as e:
+            raise self.__error(e) from e
+
+        return dict(status="success", id=key)
+
+    async def delete_document(self, collection_name: str, document_key: str) -> dict:
+        if not self.is_available():
+            return await super().delete_document(collection_name=collection_name, document_key=document_key)
+
+        try:
+            await self.__collection(collection_name).remove(document_key)
+        except CouchbaseException as e:
+            raise self.__error(e) from e
+
+        return dict(status="success", id=document_key)
+
+    async def get_document_by_id(
+        self, collection_name: str, document_key: str
+    ) -> list[dict]:
+        if not self.is_available():
+            return await super().get_document_by_id(collection_name=collection_name, document_key=document_key)
+
+        try:
+            result = await self.__collection(collection_name).get(document_key)
+        except DocumentNotFoundException:
+            return []
+        except CouchbaseException as e:
+            raise self.__error(e) from e
+
+        return [{"id": document_key, collection_name: result.content_as[dict]}]
+
+    async def get_multi(self, collection_name: str, document_keys: list[str]) -> list[dict]:
+        if not self.is_available():
+            return await super().get_multi(collection_name=collection_name, document_keys=document_keys)
+
+        semaphore = asyncio.Semaphore(CouchbaseKVRepository._batch_concurrency)
+
+        async def get_one(key: str) -> list[dict]:
+            async with semaphore:
+                return await self.get_document_by_id(collection_name=collection_name, document_key=key)
+
+        responses = await asyncio.gather(*[get_one(key) for key in document_keys])
+
+        return [row for response in responses for row in response]
+
+    async def upsert_document(
+        self, collection_name: str, key: str, value: dict
+    ) -> dict:
+        if not self.is_available():
+            return await super().upsert_document(collection_name=collection_name, key=key, value=value)
+
+        try:
+            await self.__collection(collection_name).upsert(key, value)
+        except CouchbaseException as e:
+            raise self.__error(e) from e
+
+        return dict(status="success", id=key)
+
+    async def upsert_multi(self, collection_name: str, documents: dict[str, dict]) -> dict:
+        if not self.is_available():
+            return await super().upsert_multi(collection_name=collection_name, documents=documents)
+
+        semaphore = asyncio.Semaphore(CouchbaseKVRepository._batch_concurrency)
+
+        async def upsert_one(key: str, value: dict) -> None:
+            async with semaphore:
+                await self.upsert_document(collection_name=collection_name, key=key, value=value)
+
+        await asyncio.gather(*[upsert_one(key, value) for key, value in documents.items()])
+
+        return dict(status="success", ids=list(documents.keys()))
+
+    async def increment_counter(
+        self,
+        collection_name: str,
+        key: str,
+        field: str,
+        delta: int = 1,
+        minimum: int = 0,
+        initial: int = 0,
+        document: dict = None
+    ) -> int:
+        if not self.is_available():
+            return await super().increment_counter(
+                collection_name=collection_name, key=key, field=field, delta=delta, minimum=minimum, initial=initial, document=document
+            )
+
+        collection = self.__collection(collection_name)
+
+        for _ in range(CouchbaseKVRepository.MAX_COUNTER_ATTEMPTS):
+            try:
+                if not minimum:
+                    # sub-document increment, applied atomically by the data service
+                    result = await collection.mutate_in(key, [SD.increment(field, delta)])
+
+                    return result.content_as[int](0)
+
+                # there is no sub-document maximum, the document is compared and swapped
+                result = await collection.get(key)
+
+                value = result.content_as[dict]
+
+                value[field] = max(value.get(field, 0) + delta, minimum)
+
+                await collection.replace(key, value, ReplaceOptions(cas=result.cas))
+
+                return value[field]
+
+            except DocumentNotFoundException:
+                value = max(initial + delta, minimum)
+
+                try:
+                    await collection.insert(key, {**(document if document else {}), field: value})
+                except DocumentExistsException:
+                    continue
+
+                return value
+
+            except CasMismatchException:
+                continue
+
+            except CouchbaseException as e:
+                raise self.__error(e) from e
+
+        raise CouchbaseError(f"Couchbase error: too many concurrent updates of {key}")
+
+    async def __gather_chunk(self, operation, keys: list[str]) -> list:
+        """Run a by-key coroutine for each key (at most COUCHBASE_KV_BATCH_CONCURRENCY at once), exceptions included."""
+        semaphore = asyncio.Semaphore(CouchbaseKVRepository._batch_concurrency)
+
+        async def run_one(key: str):
+            async with semaphore:
+                return await operation(key)
+
+        return await asyncio.gather(*[run_one(key) for key in keys], return_exceptions=True)
+
+    async def upsert_many(self, collection_name: str, documents: dict[str, dict], chunk_size: int = None) -> BulkOperationResult:
+        if not self.is_available():
+            return await super().upsert_many(collection_name=collection_name, documents=documents, chunk_size=chunk_size)
+
+        result = BulkOperationResult()
+        collection = self.__collection(collection_name)
+
+        for keys in self.chunks(list(documents.keys()), chunk_size):
+            outcomes = await self.__gather_chunk(lambda key: collection.upsert(key, documents[key]), keys)
+
+            for key, outcome in zip(keys, outcomes):
+                if isinstance(outcome, BaseException):
+                    result.add_failed([key], self.__error(outcome))
+                else:
+                    result.add_succeeded([key])
+
+        return result.finish()
+
+    async def get_many(self, collection_name: str, document_keys: list[str], chunk_size: int = None) -> BulkOperationResult:
+        if not self.is_available():
+            return await super().get_many(collection_name=collection_name, document_keys=document_keys, chunk_size=chunk_size)
+
+        result = BulkOperationResult()
+        collection = self.__collection(collection_name)
+
+        for keys in self.chunks(list(dict.fromkeys(document_keys)), chunk_size):
+            outcomes = await self.__gather_chunk(collection.get, keys)
+
+            for key, outcome in zip(keys, outcomes):
+                if isinstance(outcome, DocumentNotFoundException):
+                    result.add_missing([key])
+                elif isinstance(outcome, BaseException):
+                    result.add_failed([key], self.__error(outcome))
+                else:
+                    result.results.append({"id": key, collection_name: outcome.content_as[dict]})
+                    result.add_succeeded([key])
+
+        return result.finish()
+
+    async def delete_many(self, collection_name: str, document_keys: list[str], chunk_size: int = None) -> BulkOperationResult:
+        if not self.is_available():
+            return await super().delete_many(collection_name=collection_name, document_keys=document_keys, chunk_size=chunk_size)
+
+        result = BulkOperationResult()
+        collection = self.__collection(collection_name)
+
+        for keys in self.chunks(list(dict.fromkeys(document_keys)), chunk_size):
+            outcomes = await self.__gather_chunk(collection.remove, keys)
+
+            for key, outcome in zip(keys, outcomes):
+                if isinstance(outcome, DocumentNotFoundException):
+                    result.add_missing([key])
+                elif isinstance(outcome, BaseException):
+                    result.add_failed([key], self.__error(outcome))
+                else:
+                    result.add_succeeded([key])
+
+        return result.finish()
@@ -1,28 +1,67 @@
-import json
-import httpx
+import hashlib
+import logging
+from typing import Iterator
+
+from repositories.CouchbaseConnectionPool import CouchbaseConnectionPool
+from shared.models.bulk_operations import BulkOperationResult
+from shared.models.env import get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class CouchbaseError(RuntimeError):
+    """Couchbase request failure, carrying the query service error codes when available."""
+
+    def __init__(self, message: str, codes: list[int] = None):
+        super().__init__(message)
+        self.codes = codes if codes else []
+
+
+class DocumentNotFoundError(CouchbaseError):
+    """By-key operation on a missing document (the query service has no error code for it)."""
 
-from shared.models.env import EnvSettings
 
 class CouchbaseRepository:
 
     BUCKET_PORT = 8091
     QUERY_PORT = 8093
+    SEARCH_PORT = 8094
+
+    MAX_EXPLAINED_STATEMENTS = 1000
+    MAX_PREPARED_STATEMENTS = 500
+
+    # query service codes for prepared statements that are unknown or need re-preparing
+    STALE_PREPARED_CODES = {4040, 4050, 4060, 4070, 4080, 4090}
+
+    # query service codes for writes lost to a concurrent one (CAS mismatch, duplicate key)
+    CAS_MISMATCH_CODE = 12009
+    DOCUMENT_EXISTS_CODE = 17012
+    WRITE_CONFLICT_CODES = {CAS_MISMATCH_CODE, DOCUMENT_EXISTS_CODE}
+
+    MAX_COUNTER_ATTEMPTS = 20
+
+    _explained_statements: set = set()
+    _prepared_statements: dict = {}
 
     def __init__(self, scope: str):
 
-        settings = EnvSettings()
+        settings = get_settings()
 
         self.host = settings.COUCHBASE_HOST
         self.user = settings.COUCHBASE_USER
         self.password = settings.COUCHBASE_PASSWORD
         self.bucket = settings.COUCHBASE_BUCKET
+        self.explain_queries = settings.COUCHBASE_EXPLAIN_QUERIES
+        self.bulk_chunk_size = settings.COUCHBASE_BULK_CHUNK_SIZE
 
         self.scope = scope
         self.auth = tuple([self.user, self.password])
         self.base_url = f"http://{self.host}"
 
     async def __request_handler__(self, url: str, method: str, **kwargs) -> dict:
-        async with httpx.AsyncClient() as client:
+        client = CouchbaseConnectionPool.get_client()
+
+        async with CouchbaseConnectionPool.track():
             response = await client.request(
                 method=method,
                 url=url, 
@@ -30,19 +69,98 @@ class CouchbaseRepository:
                 **kwargs
             )
 
-        response.raise_for_status()
+            try:
+                parsed_response = response.json()
+            except ValueError:
+                response.raise_for_status()
+                raise RuntimeError("Invalid JSON response from Couchbase")
 
-        try:
-            parsed_response = response.json()
-        except ValueError:
-            raise RuntimeError("Invalid JSON response from Couchbase")
+            if response.is_error or (parsed_response and parsed_response.get("status", None) != "success"):
+                errors = parsed_response.get("errors", []) if isinstance(parsed_response, dict) else []
+                errors = errors if isinstance(errors, list) else [errors]
 
-        if parsed_response and parsed_response.get("status", None) != "success":
-            error_msg = parsed_response.get("errors", {}).get("msg", "Unknown error")
-            raise RuntimeError(f"Couchbase error: {error_msg}")
+                error_msg = "; ".join(str(error.get("msg", error)) for error in errors) if errors else "Unknown error"
+                codes = [error.get("code") for error in errors if isinstance(error, dict) and error.get("code")]
+
+                raise CouchbaseError(f"Couchbase error: {error_msg}", codes=codes)
         
         return parsed_response
 
+    async def __search_request_handler(self, url: str, method: str, **kwargs) -> dict:
+        """Search service requests, which report failures through the HTTP status rather than a "status": "success" field."""
+        client = CouchbaseConnectionPool.get_client()
+
+        async with CouchbaseConnectionPool.track():
+            response = await client.request(
+                method=method,
+                url=url,
+                auth=self.auth,
+                **kwargs
+            )
+
+            try:
+                parsed_response = response.json()
+            except ValueError:
+                response.raise_for_status()
+                raise RuntimeError("Invalid JSON response from Couchbase")
+
+            if response.is_error:
+                error_msg = parsed_response.get("error", "Unknown error") if isinstance(parsed_response, dict) else "Unknown error"
+
+                raise CouchbaseError(f"Couchbase search error: {error_msg}")
+
+        return parsed_response
+
+    async def __prepare(self, statement: str) -> str:
+        name = f"lakehouse_{hashlib.sha1(statement.encode()).hexdigest()[:20]}"
+
+        await self.__request_handler__(
+            url=f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service",
+            method="POST",
+            json={"statement": f"PREPARE `{name}` FROM {statement}"}
+        )
+
+        prepared = CouchbaseRepository._prepared_statements
+
+        if len(prepared) >= CouchbaseRepository.MAX_PREPARED_STATEMENTS:
+            prepared.pop(next(iter(prepared)))
+
+        prepared[statement] = name
+
+        return name
+
+    async def __statement_handler(self, statement: str, args: list = None, prepare: bool = True) -> dict:
+        """
+        Run a N1QL statement with positional parameters ($1, $2, ...) sent apart from the text.
+        Parameterized statements are prepared once per statement shape and executed by name.
+        """
+        url = f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service"
+
+        if args is None or not prepare:
+            payload = {"statement": statement}
+
+            if args is not None:
+                payload["args"] = args
+
+            return await self.__request_handler__(url=url, method="POST", json=payload)
+
+        name = CouchbaseRepository._prepared_statements.get(statement)
+
+        if not name:
+            name = await self.__prepare(statement)
+
+        try:
+            return await self.__request_handler__(url=url, method="POST", json={"prepared": name, "args": args})
+        except CouchbaseError as e:
+            if not CouchbaseRepository.STALE_PREPARED_CODES.intersection(e.codes):
+                raise
+
+        CouchbaseRepository._prepared_statements.pop(statement, None)
+
+        name = await self.__prepare(statement)
+
+        return await self.__request_handler__(url=url, method="POST", json={"prepared": name, "args": args})
+
 
     async def create_collection(self, collection_name: str) -> dict:
         url = f"{self.base_url}:{CouchbaseRepository.BUCKET_PORT}/pools/default/buckets/{self.bucket}/scopes/{self.scope}/collections"
@@ -56,13 +174,9 @@ class CouchbaseRepository:
     async def create_document(
         self, collection_name: str, key: str, value: dict
     ) -> dict:
-        url = f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service"
-
-        query = f'INSERT INTO `{self.bucket}`.`{self.scope}`.`{collection_name}` (KEY, VALUE) VALUES ( "{key}",  {value} );'
+        query = f"INSERT INTO `{self.bucket}`.`{self.scope}`.`{collection_name}` (KEY, VALUE) VALUES ( $1, $2 );"
 
-        payload = {"statement": query}
-
-        response = await self.__request_handler__(url=url, method="POST", json=payload)
+        response = await self.__statement_handler(statement=query, args=[key, value])
 
         return response
 
@@ -94,13 +208,9 @@ class CouchbaseRepository:
         return response
     
     async def delete_document_2(self, collection_name: str, document_key: str) -> dict:
-        url = f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service"
-
-        query = f"DELETE FROM `{self.bucket}`.`{self.scope}`.`{collection_name}` WHERE META().id = '{document_key}'"
+        query = f"DELETE FROM `{self.bucket}`.`{self.scope}`.`{collection_name}` WHERE META().id = $1"
 
-        payload = {"statement": query}
-
-        response = await self.__request_handler__(url=url, method="POST", json=payload)
+        response = await self.__statement_handler(statement=query, args=[document_key])
 
         return response
 
@@ -116,13 +226,15 @@ class CouchbaseRepository:
     async def get_document_by_id(
         self, collection_name: str, document_key: str
     ) -> list[dict]:
-        url = f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service"
+        return await self.get_multi(collection_name=collection_name, document_keys=[document_key])
 
-        query = f"SELECT META().id, * FROM `{self.bucket}`.`{self.scope}`.`{collection_name}` USE KEYS {json.dumps([document_key])};"
+    async def get_multi(self, collection_name: str, document_keys: list[str]) -> list[dict]:
+        if not document_keys:
+            return []
 
-        payload = {"statement": query}
+        query = f"SELECT META().id, * FROM `{self.bucket}`.`{self.scope}`.`{collection_name}` USE KEYS $1;"
 
-        response = await self.__request_handler__(url=url, method="POST", json=payload)
+        response = await self.__statement_handler(statement=query, args=[document_keys])
 
         results = [dict(row) for row in response.get("results", [])]
 
@@ -154,12 +266,75 @@ class CouchbaseRepository:
 
         return scopes
 
-    async def query(self, statement: str):
-        url = f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service"
+    def __search_index_url(self, index_name: str = None) -> str:
+        url = f"{self.base_url}:{CouchbaseRepository.SEARCH_PORT}/api/bucket/{self.bucket}/scope/{self.scope}/index"
 
-        payload = {"statement": statement}
+        return f"{url}/{index_name}" if index_name else url
 
-        response = await self.__request_handler__(url=url, method="POST", json=payload)
+    async def list_search_indexes(self) -> list[str]:
+        """Names of the full-text search indexes of the scope."""
+        response = await self.__search_request_handler(url=self.__search_index_url(), method="GET")
+
+        index_defs = (response.get("indexDefs") or {}).get("indexDefs") or {}
+
+        # scoped indexes are listed as bucket.scope.name
+        return [name.rsplit(".", 1)[-1] for name in index_defs]
+
+    async def upsert_search_index(self, index_name: str, definition: dict) -> dict:
+        return await self.__search_request_handler(url=self.__search_index_url(index_name), method="PUT", json=definition)
+
+    async def search(self, index_name: str, request: dict) -> dict:
+        """
+        Run a full-text search request against an index of the scope.
+        Returns the raw response: total_hits, and hits with their document id and score.
+        """
+        return await self.__search_request_handler(url=f"{self.__search_index_url(index_name)}/query", method="POST", json=request)
+
+    def __uses_primary_scan(self, plan: any) -> bool:
+        if isinstance(plan, dict):
+            if str(plan.get("#operator", "")).startswith("PrimaryScan"):
+                return True
+            return any(self.__uses_primary_scan(value) for value in plan.values())
+
+        if isinstance(plan, list):
+            return any(self.__uses_primary_scan(item) for item in plan)
+
+        return False
+
+    async def explain(self, statement: str, args: list = None) -> dict:
+        response = await self.__statement_handler(statement=f"EXPLAIN {statement}", args=args, prepare=False)
+
+        results = response.get("results", [])
+
+        return results[0] if results else {}
+
+    async def __warn_on_primary_scan(self, statement: str, args: list = None) -> None:
+        """Log a warning the first time a SELECT statement is planned as a primary scan."""
+        explained = CouchbaseRepository._explained_statements
+
+        if statement in explained or len(explained) >= CouchbaseRepository.MAX_EXPLAINED_STATEMENTS:
+            return
+
+        if not statement.lstrip().upper().startswith("SELECT"):
+            return
+
+        explained.add(statement)
+
+        try:
+            plan = await self.explain(statement, args=args)
+        except Exception as e:
+            logger.warning(f"Unable to explain query '{statement}': {e}")
+            return
+
+        if self.__uses_primary_scan(plan):
+            logger.warning(f"Query falls back to a primary scan, consider adding an index: {statement}")
+
+    async def query(self, statement: str, args: list = None):
+        """Run a N1QL statement. Pass args for statements built with positional parameters."""
+        if self.explain_queries:
+            await self.__warn_on_primary_scan(statement, args=args)
+
+        response = await self.__statement_handler(statement=statement, args=args)
 
         results = [dict(row) for row in response.get("results", [])]
 
@@ -169,12 +344,222 @@ class CouchbaseRepository:
     async def upsert_document(
         self, collection_name: str, key: str, value: dict
     ) -> dict:
-        url = f"{self.base_url}:{CouchbaseRepository.QUERY_PORT}/query/service"
+        query = f"UPSERT INTO `{self.bucket}`.`{self.scope}`.`{collection_name}` (KEY, VALUE) VALUES ( $1, $2 );"
 
-        query = f'UPSERT INTO `{self.bucket}`.`{self.scope}`.`{collection_name}` (KEY, VALUE) VALUES ( "{key}",  {value} );'
+        response = await self.__statement_handler(statement=query, args=[key, value])
 
-        payload = {"statement": query}
+        return response
 
-        response = await self.__request_handler__(url=url, method="POST", json=payload)
+    async def upsert_multi(self, collection_name: str, documents: dict[str, dict]) -> dict:
+        if not documents:
+            return dict(status="success", ids=[])
+
+        args = []
+
+        for key, value in documents.items():
+            args.extend([key, value])
+
+        values = ", ".join(
+            f"VALUES ( ${index}, ${index + 1} )" for index in range(1, len(args), 2)
+        )
+
+        query = f"UPSERT INTO `{self.bucket}`.`{self.scope}`.`{collection_name}` (KEY, VALUE) {values};"
+
+        # the statement shape depends on the batch size, so it is not worth preparing
+        response = await self.__statement_handler(statement=query, args=args, prepare=False)
 
         return response
+
+    # bulk operations, one statement per chunk, failures are reported per key instead of raised
+    def chunks(self, keys: list, chunk_size: int = None) -> Iterator[list]:
+        chunk_size = chunk_size if chunk_size else self.bulk_chunk_size
+
+        for start in range(0, len(keys), chunk_size):
+            yield keys[start:start + chunk_size]
+
+    def __keyspace(self, collection_name: str) -> str:
+        return f"`{self.bucket}`.`{self.scope}`.`{collection_name}`"
+
+    async def upsert_many(self, collection_name: str, documents: dict[str, dict], chunk_size: int = None) -> BulkOperationResult:
+        result = BulkOperationResult()
+
+        for keys in self.chunks(list(documents.keys()), chunk_size):
+            try:
+                await self.upsert_multi(collection_name=collection_name, documents={key: documents[key] for key in keys})
+            except Exception as e:
+                logger.warning(f"Bulk upsert of {len(keys)} documents into {collection_name} failed: {e}")
+                result.add_failed(keys, e)
+                continue
+
+            result.add_succeeded(keys)
+
+        return result.finish()
+
+    async def get_many(self, collection_name: str, document_keys: list[str], chunk_size: int = None) -> BulkOperationResult:
+        result = BulkOperationResult()
+
+        for keys in self.chunks(list(dict.fromkeys(document_keys)), chunk_size):
+            try:
+                rows = await self.get_multi(collection_name=collection_name, document_keys=keys)
+            except Exception as e:
+                logger.warning(f"Bulk get of {len(keys)} documents from {collection_name} failed: {e}")
+                result.add_failed(keys, e)
+                continue
+
+            found = {row["id"] for row in rows}
+
+            result.results.extend(rows)
+            result.add_succeeded([key for key in keys if key in found])
+            result.add_missing([key for key in keys if key not in found])
+
+        return result.finish()
+
+    async def delete_many(self, collection_name: str, document_keys: list[str], chunk_size: int = None) -> BulkOperationResult:
+        result = BulkOperationResult()
+
+        query = f"DELETE FROM {self.__keyspace(collection_name)} USE KEYS $1 RETURNING RAW META().id;"
+
+        for keys in self.chunks(list(dict.fromkeys(document_keys)), chunk_size):
+            try:
+                response = await self.__statement_handler(statement=query, args=[keys])
+            except Exception as e:
+                logger.warning(f"Bulk delete of {len(keys)} documents from {collection_name} failed: {e}")
+                result.add_failed(keys, e)
+                continue
+
+            deleted = set(response.get("results", []))
+
+            result.add_succeeded([key for key in keys if key in deleted])
+            result.add_missing([key for key in keys if key not in deleted])
+
+        return result.finish()
+
+    async def increment_counter(
+        self,
+        collection_name: str,
+        key: str,
+        field: str,
+        delta: int = 1,
+        minimum: int = 0,
+        initial: int = 0,
+        document: dict = None
+    ) -> int:
+        """
+        Add delta to a numeric field of a document, raised to at least minimum, and return the new value.
+
+        A missing document is created with the field at initial + delta (plus the
+        given document fields). Writes lost to a concurrent update are retried, so
+        every caller gets a distinct value.
+        """
+        keyspace = self.__keyspace(collection_name)
+
+        statement = f"UPDATE {keyspace} USE KEYS $1 SET `{field}` = GREATEST(IFMISSINGORNULL(`{field}`, 0) + $2, $3) RETURNING RAW `{field}`;"
+
+        for _ in range(CouchbaseRepository.MAX_COUNTER_ATTEMPTS):
+            try:
+                response = await self.__statement_handler(statement=statement, args=[key, delta, minimum])
+
+                results = response.get("results", [])
+
+                if results:
+                    return results[0]
+
+                value = max(initial + delta, minimum)
+
+                await self.__statement_handler(
+                    statement=f"INSERT INTO {keyspace} (KEY, VALUE) VALUES ( $1, $2 );",
+                    args=[key, {**(document if document else {}), field: value}]
+                )
+
+                return value
+
+            except CouchbaseError as e:
+                if not CouchbaseRepository.WRITE_CONFLICT_CODES.intersection(e.codes):
+                    raise
+
+        raise CouchbaseError(f"Couchbase error: too many concurrent updates of {key}")
+
+    async def update_where(
+        self, collection_name: str, values: dict, where: str, args: list = None, chunk_size: int = None
+    ) -> BulkOperationResult:
+        """
+        Set the given fields on every document matching the WHERE clause.
+
+        The clause uses positional parameters ($1, $2, ...) bound to args. The
+        matching keys are selected first and updated chunk by chunk, each chunk
+        re-checking the clause, so documents that stopped matching meanwhile
+        are reported as missing instead of being overwritten.
+        """
+        result = BulkOperationResult()
+        args = list(args) if args else []
+
+        keyspace = self.__keyspace(collection_name)
+
+        rows = await self.query(f"SELECT META().id FROM {keyspace} WHERE {where};", args=args)
+
+        keys = [row["id"] for row in rows]
+
+        if not keys or not values:
+            return result.finish()
+
+        fields = list(values.keys())
+
+        assignments = ", ".join(
+            f"{'.'.join(f'`{part}`' for part in field.split('.'))} = ${len(args) + index}"
+            for index, field in enumerate(fields, start=1)
+        )
+
+        keys_placeholder = f"${len(args) + len(fields) + 1}"
+
+        statement = f"UPDATE {keyspace} USE KEYS {keys_placeholder} SET {assignments} WHERE {where} RETURNING RAW META().id;"
+
+        for chunk in self.chunks(keys, chunk_size):
+            try:
+                response = await self.__statement_handler(
+                    statement=statement, args=args + [values[field] for field in fields] + [chunk]
+                )
+            except Exception as e:
+                logger.warning(f"Bulk update of {len(chunk)} documents in {collection_name} failed: {e}")
+                result.add_failed(chunk, e)
+                continue
+
+            updated = set(response.get("results", []))
+
+            result.add_succeeded([key for key in chunk if key in updated])
+            result.add_missing([key for key in chunk if key not in updated])
+
+        return result.finish()
+
+    async def delete_where(self, collection_name: str, where: str, args: list = None, chunk_size: int = None) -> BulkOperationResult:
+        """
+        Remove every document matching the WHERE clause.
+
+        As in update_where, the matching keys are selected first and removed
+        chunk by chunk with the clause re-checked, so documents that stopped
+        matching meanwhile are reported as missing and kept.
+        """
+        result = BulkOperationResult()
+        args = list(args) if args else []
+
+        keyspace = self.__keyspace(collection_name)
+
+        rows = await self.query(f"SELECT META().id FROM {keyspace} WHERE {where};", args=args)
+
+        keys = [row["id"] for row in rows]
+
+        statement = f"DELETE FROM {keyspace} USE KEYS ${len(args) + 1} WHERE {where} RETURNING RAW META().id;"
+
+        for chunk in self.chunks(keys, chunk_size):
+            try:
+                response = await self.__statement_handler(statement=statement, args=args + [chunk])
+            except Exception as e:
+                logger.warning(f"Bulk delete of {len(chunk)} documents from {collection_name} failed: {e}")
+                result.add_failed(chunk, e)
+                continue
+
+            deleted = set(response.get("results", []))
+
+            result.add_succeeded([key for key in chunk if key in deleted])
+            result.add_missing([key for key in chunk if key not in deleted])
+
+        return result.finish()
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from fastapi import HTTPException, status
+
+from shared.models.env import EnvSettings, get_settings
+
+logger = logging.getLogger(__name__)
+
+
+class PassportBrokerClient:
+    """
+    Application-wide async client for the GA4GH passport broker admin API.
+
+    Connections are pooled (keep-alive) in a single httpx.AsyncClient opened on
+    application startup and closed on shutdown (see the lifespan handler in
+    app.py), or lazily on first use outside of the app. Transient failures
+    (connection errors, timeouts, 429/502/503/504) are retried with exponential
+    backoff; POST requests are only retried when the connection could not be
+    established, so a request is never sent twice. Visa definitions are cached
+    for PASSPORT_BROKER_VISA_CACHE_TTL_SECONDS and the cache is dropped on
+    every visa write made through this client.
+    """
+
+    VISAS_PATH = "/admin/ga4gh/passport/v1/visas"
+    USERS_PATH = "/admin/ga4gh/passport/v1/users"
+
+    RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+    _client: httpx.AsyncClient = None
+    _max_retries: int = 3
+    _retry_backoff_seconds: float = 0.2
+    _concurrency: int = 10
+    _visa_cache_ttl_seconds: float = 30.0
+
+    # visa id -> (cached at, visa), and (cached at, all visas)
+    _visa_cache: Dict[str, Tuple[float, dict]] = {}
+    _visa_list_cache: Optional[Tuple[float, List[dict]]] = None
+
+    @classmethod
+    def open(cls, settings: EnvSettings = None) -> httpx.AsyncClient:
+        if cls._client is not None:
+            return cls._client
+
+        settings = settings if settings else get_settings()
+
+        cls._max_retries = settings.PASSPORT_BROKER_MAX_RETRIES
+        cls._retry_backoff_seconds = settings.PASSPORT_BROKER_RETRY_BACKOFF_SECONDS
+        cls._concurrency = settings.PASSPORT_BROKER_CONCURRENCY
+        cls._visa_cache_ttl_seconds = settings.PASSPORT_BROKER_VISA_CACHE_TTL_SECONDS
+
+        limits = httpx.Limits(
+            max_connections=settings.PASSPORT_BROKER_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.PASSPORT_BROKER_MAX_CONNECTIONS,
+        )
+
+        cls._client = httpx.AsyncClient(
+            base_url=settings.PASSPORT_BROKER_SERVICE_URL or "",
+            limits=limits,
+            timeout=httpx.Timeout(settings.PASSPORT_BROKER_TIMEOUT_SECONDS),
+        )
+
+        return cls._client
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._client is None:
+            return
+
+        await cls._client.aclose()
+        cls._client = None
+
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = None
+            return cls.open()
+        return cls._client
+
+    @classmethod
+    def invalidate_visas(cls) -> None:
+        cls._visa_cache = {}
+        cls._visa_list_cache = None
+
+    @classmethod
+    async def request(cls, method: str, path: str, json: dict = None) -> httpx.Response:
+        client = cls.get_client()
+
+        attempt = 0
+
+        while True:
+            try:
+                response = await client.request(method, path, json=json)
+
+                if response.status_code not in cls.RETRY_STATUS_CODES or attempt >= cls._max_retries:
+                    return response
+
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                if attempt >= cls._max_retries:
+                    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Passport broker unavailable: {e}")
+
+            except httpx.TransportError as e:
+                # the request may have reached the broker, only repeat it when that is harmless
+                if method == "POST" or attempt >= cls._max_retries:
+                    raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"Passport broker unavailable: {e}")
+
+            backoff = cls._retry_backoff_seconds * (2 ** attempt)
+            attempt += 1
+
+            logger.warning(f"Passport broker {method} {path} failed, retry {attempt}/{cls._max_retries} in {backoff}s")
+
+            await asyncio.sleep(backoff)
+
+    @classmethod
+    def __cached(cls, cached_at: float) -> bool:
+        return time.monotonic() - cached_at < cls._visa_cache_ttl_seconds
+
+    @classmethod
+    async def get_visa(cls, visa_uuid: str) -> Optional[dict]:
+        cached = cls._visa_cache.get(visa_uuid)
+
+        if cached and cls.__cached(cached[0]):
+            return dict(cached[1])
+
+        response = await cls.request("GET", f"{cls.VISAS_PATH}/{visa_uuid}")
+
+        if not response.is_success:
+            return None
+
+        visa = response.json()
+
+        cls._visa_cache[visa_uuid] = (time.monotonic(), visa)
+
+        return dict(visa)
+
+    @classmethod
+    async def get_visas(cls, visa_uuids: List[str]) -> Dict[str, Optional[dict]]:
+        """Fetch several visas concurrently (at most PASSPORT_BROKER_CONCURRENCY in flight)."""
+        semaphore = asyncio.Semaphore(cls._concurrency)
+
+        async def get_one(visa_uuid: str) -> Optional[dict]:
+            async with semaphore:
+                return await cls.get_visa(visa_uuid)
+
+        unique_ids = list(dict.fromkeys(visa_uuids))
+
+        visas = await asyncio.gather(*[get_one(visa_uuid) for visa_uuid in unique_ids])
+
+        return dict(zip(unique_ids, visas))
+
+    @classmethod
+    async def list_visas(cls) -> List[dict]:
+        if cls._visa_list_cache and cls.__cached(cls._visa_list_cache[0]):
+            return [dict(visa) for visa in cls._visa_list_cache[1]]
+
+        response = await cls.request("GET", cls.VISAS_PATH)
+
+        if not response.is_success:
+            return []
+
+        visas = response.json()
+
+        cls._visa_list_cache = (time.monotonic(), visas)
+
+        return [dict(visa) for visa in visas]
+
+    @classmethod
+    async def create_visa(cls, visa: dict) -> bool:
+        response = await cls.request("POST", cls.VISAS_PATH, json=visa)
+        cls.invalidate_visas()
+        return response.is_success
+
+    @classmethod
+    async def update_visa(cls, visa_uuid: str, visa: dict) -> Optional[dict]:
+        response = await cls.request("PUT", f"{cls.VISAS_PATH}/{visa_uuid}", json=visa)
+        cls.invalidate_visas()
+        return response.json() if response.is_success else None
+
+    @classmethod
+    async def delete_visa(cls, visa_uuid: str) -> bool:
+        response = await cls.request("DELETE", f"{cls.VISAS_PATH}/{visa_uuid}")
+        cls.invalidate_visas()
+        return response.is_success
+
+    @classmethod
+    async def create_user(cls, user_uuid: str) -> bool:
+        response = await cls.request("POST", cls.USERS_PATH, json=dict(id=user_uuid))
+        return response.is_success
+
+    @classmethod
+    async def update_user_passport(cls, user_uuid: str, passport: dict) -> bool:
+        response = await cls.request("PUT", f"{cls.USERS_PATH}/{user_uuid}", json=passport)
+        return response.is_success
+
+    @classmethod
+    async def delete_user(cls, user_uuid: str) -> bool:
+        response = await cls.request("DELETE", f"{cls.USERS_PATH}/{user_uuid}")
+        return response.is_success
@@ -0,0 +1,178 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Tuple
+
+import boto3
+import requests
+from google.cloud import storage
+from requests.adapters import HTTPAdapter
+
+from shared.models.env import get_settings
+from shared.models.metrics import StorageClientPoolMetrics
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter applying a default timeout to the requests sent without one."""
+
+    def __init__(self, timeout: float, **kwargs) -> None:
+        self.timeout = timeout
+
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        return super().send(request, timeout=timeout if timeout is not None else self.timeout, **kwargs)
+
+
+class StorageClientPool:
+    """
+    Application-wide cache of initialized storage clients.
+
+    GCS and S3 clients are expensive to build (credential parsing, botocore
+    service models), so they are kept per credential id and reused across
+    requests, up to STORAGE_CLIENT_POOL_SIZE clients with least recently used
+    eviction. WebHDFS calls share a single pooled requests.Session, other
+    storage-side HTTP calls (GCS resumable sessions, SNS subscription
+    confirmations) another one. Requests sent through either session without
+    a timeout get STORAGE_HTTP_TIMEOUT_SECONDS. The pool is cleared whenever
+    credentials change (see CredentialServices.invalidate_cache) and on
+    application shutdown.
+    """
+
+    _clients: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+    _lock = threading.Lock()
+    _max_size: int = None
+    _hdfs_session: requests.Session = None
+    _http_session: requests.Session = None
+
+    _hits: int = 0
+    _misses: int = 0
+    _evictions: int = 0
+
+    @classmethod
+    def __max_size(cls) -> int:
+        if cls._max_size is None:
+            cls._max_size = get_settings().STORAGE_CLIENT_POOL_SIZE
+        return cls._max_size
+
+    @staticmethod
+    def __close_client(client: Any) -> None:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    @classmethod
+    def __get_or_create(cls, key: Tuple[str, str], factory: Callable[[], Any]) -> Any:
+        with cls._lock:
+            client = cls._clients.get(key)
+
+            if client is not None:
+                cls._clients.move_to_end(key)
+                cls._hits += 1
+                return client
+
+        # build outside of the lock, client construction can take a while
+        client = factory()
+
+        with cls._lock:
+            if key in cls._clients:
+                # another thread built the same client meanwhile, keep the first one
+                cls.__close_client(client)
+                cls._clients.move_to_end(key)
+                cls._hits += 1
+                return cls._clients[key]
+
+            cls._misses += 1
+            cls._clients[key] = client
+
+            while len(cls._clients) > cls.__max_size():
+                _, evicted = cls._clients.popitem(last=False)
+                cls._evictions += 1
+                cls.__close_client(evicted)
+
+        return client
+
+    @classmethod
+    def gcs_client(cls, credential_id: str, decoded_credential: dict) -> storage.Client:
+        return cls.__get_or_create(
+            ("gcs", credential_id),
+            lambda: storage.Client.from_service_account_info(info=decoded_credential),
+        )
+
+    @classmethod
+    def s3_client(cls, credential_id: str, decoded_credential: dict):
+        return cls.__get_or_create(
+            ("s3", credential_id),
+            lambda: boto3.client(
+                "s3",
+                aws_access_key_id=decoded_credential.get("access_key", ""),
+                aws_secret_access_key=decoded_credential.get("secret_access_key", ""),
+                region_name=decoded_credential.get("region", ""),
+            ),
+        )
+
+    @staticmethod
+    def __pooled_session() -> requests.Session:
+        settings = get_settings()
+
+        adapter = TimeoutHTTPAdapter(
+            timeout=settings.STORAGE_HTTP_TIMEOUT_SECONDS,
+            pool_connections=settings.WEBHDFS_POOL_CONNECTIONS,
+            pool_maxsize=settings.WEBHDFS_POOL_MAXSIZE,
+        )
+
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        return session
+
+    @classmethod
+    def hdfs_session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._hdfs_session is None:
+                cls._hdfs_session = cls.__pooled_session()
+
+            return cls._hdfs_session
+
+    @classmethod
+    def http_session(cls) -> requests.Session:
+        with cls._lock:
+            if cls._http_session is None:
+                cls._http_session = cls.__pooled_session()
+
+            return cls._http_session
+
+    @classmethod
+    def clear(cls) -> None:
+        """Close and drop every cached client. The HTTP sessions hold no credentials and are kept."""
+        with cls._lock:
+            clients = list(cls._clients.values())
+            cls._clients.clear()
+
+        for client in clients:
+            cls.__close_client(client)
+
+    @classmethod
+    def close(cls) -> None:
+        cls.clear()
+
+        with cls._lock:
+            for session in (cls._hdfs_session, cls._http_session):
+                if session is not None:
+                    session.close()
+
+            cls._hdfs_session = None
+            cls._http_session = None
+
+    @classmethod
+    def metrics(cls) -> StorageClientPoolMetrics:
+        with cls._lock:
+            return StorageClientPoolMetrics(
+                max_size=cls.__max_size(),
+                size=len(cls._clients),
+                hits=cls._hits,
+                misses=cls._misses,
+                evictions=cls._evictions,
+                hdfs_session_open=cls._hdfs_session is not None,
+            )
@@ -1,6 +1,6 @@
 from fastapi import Depends, APIRouter, Request
 from routes.auth_routes import auth_oauth2_scheme
-from services.AccessRequestServices import AccessRequestServices
+from services.AccessRequestServices import AccessRequestServices, get_access_request_services
 from shared.models.access_requests import AccessRequestModel, AccessRequestSearchPayload, AccessRequestSearchResponse, CouchbaseAccessRequestModel, GrantAccessRequestPayload, RevokeAccessRequestPayload
 
 
@@ -15,9 +15,9 @@ router = APIRouter(prefix="/access-request", tags=["Collection Access Request"])
 )
 async def create_access_request(
     payload: AccessRequestModel, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    accessRequestServices: AccessRequestServices = Depends(get_access_request_services)
 ) -> CouchbaseAccessRequestModel:
-    accessRequestServices = AccessRequestServices()
     response = await accessRequestServices.create_request(payload=payload)
     return response
 
@@ -31,10 +31,10 @@ async def create_access_request(
 async def grant_access_request(
     request: Request,
     payload: GrantAccessRequestPayload, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    accessRequestServices: AccessRequestServices = Depends(get_access_request_services)
 ) -> CouchbaseAccessRequestModel:
     user_id = request.state.user
-    accessRequestServices = AccessRequestServices()
     response = await accessRequestServices.grant_access(payload=payload, user_id=user_id)
     return response
 
@@ -48,10 +48,10 @@ async def grant_access_request(
 async def revoke_access_request(
     request: Request,
     payload: RevokeAccessRequestPayload, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    accessRequestServices: AccessRequestServices = Depends(get_access_request_services)
 ) -> CouchbaseAccessRequestModel:
     user_id = request.state.user
-    accessRequestServices = AccessRequestServices()
     response = await accessRequestServices.revoke_access(payload=payload, user_id=user_id)
     return response
 
@@ -64,9 +64,9 @@ async def revoke_access_request(
 )
 async def list_by_owner_and_collection(
     payload: AccessRequestSearchPayload, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    accessRequestServices: AccessRequestServices = Depends(get_access_request_services)
 ) -> AccessRequestSearchResponse:
-    accessRequestServices = AccessRequestServices()
     response = await accessRequestServices.search_by_owner_and_collections(payload=payload)
     return AccessRequestSearchResponse(access_requests=response)
 
@@ -79,11 +79,11 @@ async def list_by_owner_and_collection(
 async def delete_access_request(
     request: Request,
     access_request_uuid: str, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    accessRequestServices: AccessRequestServices = Depends(get_access_request_services)
 ) -> str:
     
     user_id= request.state.user
 
-    accessRequestServices = AccessRequestServices()
     response = await accessRequestServices.delete_access_request(user_id=user_id, document_id=access_request_uuid)
     return response
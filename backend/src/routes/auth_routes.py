@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from services.AuthServices import AuthServices
+from services.AuthServices import get_auth_services
 from shared.models.authentication import GetTokenPayload, TokenData, TokenResponse, UserTokenResponse #, RefreshTokenPayload
 
 from fastapi.openapi.models import OAuthFlows as OAuthFlowsModel
@@ -42,7 +42,7 @@ router = APIRouter(
 
 @router.post("/login", response_model=UserTokenResponse)
 async def login(payload: GetTokenPayload, response: Response):
-    authServices = AuthServices()
+    authServices = get_auth_services()
     tokens = await authServices.authenticate(email=payload.email, password=payload.password)
 
     if not tokens:
@@ -87,7 +87,7 @@ async def login(payload: GetTokenPayload, response: Response):
 
 @router.post("/refresh", response_model=UserTokenResponse)
 async def refresh(request: Request, response: Response):
-    authServices = AuthServices()
+    authServices = get_auth_services()
 
     timeHandler = TimeHandler()
 
@@ -120,13 +120,13 @@ async def refresh(request: Request, response: Response):
     include_in_schema=False
 )
 async def token(form_data: OAuth2PasswordRequestForm = Depends()):
-    authServices = AuthServices()
+    authServices = get_auth_services()
     token, _ = await authServices.authenticate(email=form_data.username, password=form_data.password)
     return TokenResponse(access_token=token, token_type="bearer")
 
 @router.post("/logout")
 async def logout(response: Response):
-    from services.AuthServices import AuthServices
-    authServices = AuthServices()
+    from services.AuthServices import get_auth_services
+    authServices = get_auth_services()
     authServices.clear_refresh_cookie(response)
     return {"message": "Logged out successfully"}
\ No newline at end of file
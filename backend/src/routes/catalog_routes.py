@@ -1,9 +1,13 @@
+from typing import List
+
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
 
-from services.CatalogServices import CatalogServices
+from services.CatalogServices import CatalogServices, get_catalog_services
 
 from routes.auth_routes import auth_oauth2_scheme
-from shared.models.catalog import CatalogFilterPayload, CouchbaseCatalogCollectionModel, CouchbaseCatalogFileModel, GetCollectionsCatalogResponse, GetFilesCatalogResponse, SetRecordStatusPayload
+from shared.models.catalog import CatalogFilterPayload, CatalogSearchResponse, CatalogStatsGroup, CatalogStatsResponse, CouchbaseCatalogCollectionModel, CouchbaseCatalogFileModel, GetCollectionsCatalogResponse, GetFilesCatalogResponse, SetRecordStatusPayload
+from shared.models.jobs import JobModel
+from shared.models.storage import Collections
 
 
 router = APIRouter(prefix="/catalog", tags=["Catalog"])
@@ -16,16 +20,16 @@ router = APIRouter(prefix="/catalog", tags=["Catalog"])
 async def get_files_catalog(
     request: Request,
     page_number: str = Query(None),
-    _: str = Depends(auth_oauth2_scheme)
+    page_token: str = Query(None),
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
 ) -> GetFilesCatalogResponse:
     try:
         user_id = request.state.user if request.state.user else None
 
         page = 1 if not page_number else int(page_number)
 
-        catalogServices = CatalogServices()
-
-        response = await catalogServices.list_files(user_id=user_id, page_number=page)
+        response = await catalogServices.list_files(user_id=user_id, page_number=page, page_token=page_token)
         
         return response
     
@@ -40,15 +44,16 @@ async def get_files_catalog(
 async def get_collections_catalog(
     request: Request,
     page_number: str = Query(None),
-    _: str = Depends(auth_oauth2_scheme)
+    page_token: str = Query(None),
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
 ) -> GetCollectionsCatalogResponse:
     try:
         user_id = request.state.user if request.state.user else None
 
         page = 1 if not page_number else int(page_number)
 
-        catalogServices = CatalogServices()
-        response = await catalogServices.list_collections(user_id=user_id, page_number=page)
+        response = await catalogServices.list_collections(user_id=user_id, page_number=page, page_token=page_token)
 
         return response
     
@@ -64,13 +69,12 @@ async def get_collections_catalog(
 async def get_catalog_file_record_by_id(
     request: Request, 
     record_uuid: str,
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
 ) -> CouchbaseCatalogFileModel:
 
     user_id = request.state.user if request.state.user else None
 
-    catalogServices = CatalogServices()
-
     response = await catalogServices.get_by_id(document_id=record_uuid, user_id=user_id, collection_name="files")
 
     return response
@@ -80,12 +84,10 @@ async def get_catalog_file_record_by_id(
     summary="List collection record by id",
     response_model=CouchbaseCatalogCollectionModel
 )
-async def get_catalog_collection_record_by_id(request: Request, record_uuid: str, _: str = Depends(auth_oauth2_scheme)) -> CouchbaseCatalogCollectionModel:
+async def get_catalog_collection_record_by_id(request: Request, record_uuid: str, _: str = Depends(auth_oauth2_scheme), catalogServices: CatalogServices = Depends(get_catalog_services)) -> CouchbaseCatalogCollectionModel:
 
     user_id = request.state.user if request.state.user else None
 
-    catalogServices = CatalogServices()
-
     response = await catalogServices.get_by_id(document_id=record_uuid, user_id=user_id, collection_name="collections")
 
     return response
@@ -106,18 +108,20 @@ async def get_catalog_collection_record_by_id(request: Request, record_uuid: str
 async def get_file_catalog_by_filters(
     request: Request,
     payload: CatalogFilterPayload, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
 ) -> GetFilesCatalogResponse:
     try:
         user_id = request.state.user if request.state.user else None
 
-        catalogServices = CatalogServices()
-
         page = payload.page_number if payload.page_number else 1
 
-        response = await catalogServices.get_by_filters(payload.filters, user_id=user_id, page_number=page, collection_name="files")
+        response = await catalogServices.get_by_filters(payload.filters, user_id=user_id, page_number=page, page_token=payload.page_token, collection_name="files")
 
         return response
+
+    except HTTPException:
+        raise
     
     except Exception as e:
         return HTTPException(status_code=500, detail=str(e))
@@ -137,17 +141,64 @@ async def get_file_catalog_by_filters(
 async def get_collection_catalog_by_filters(
     payload: CatalogFilterPayload, 
     request: Request, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
 ) -> GetCollectionsCatalogResponse:
     try:
         user_id = request.state.user if request.state.user else None
-        catalogServices = CatalogServices()
-        response = await catalogServices.get_by_filters(payload.filters, user_id=user_id, collection_name="collections")
+        page = payload.page_number if payload.page_number else 1
+        response = await catalogServices.get_by_filters(payload.filters, user_id=user_id, page_number=page, page_token=payload.page_token, collection_name="collections")
         return response
+
+    except HTTPException:
+        raise
     
     except Exception as e:
         return HTTPException(status_code=500, detail=str(e))
     
+@router.get(
+    path="/stats",
+    summary="File counts and sizes of the catalog",
+    description="Number of files, total size, latest version and last insertion of the files visible to the user, with an optional breakdown (`group_by`, repeatable) per collection, storage type, processing level and/or status. Results are cached for a short while, `computed_at` tells when they were computed.",
+    response_model=CatalogStatsResponse
+)
+async def get_catalog_stats(
+    request: Request,
+    group_by: List[CatalogStatsGroup] = Query(default=[]),
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
+) -> CatalogStatsResponse:
+
+    user_id = request.state.user if request.state.user else None
+
+    response = await catalogServices.get_stats(user_id=user_id, group_by=group_by)
+
+    return response
+
+
+@router.get(
+    path="/search",
+    summary="Full-text search of the catalog",
+    description="Search the file (name, description, collection name) or collection (name, description) records visible to the user for the words of `q`, ranked by relevance. Words match with small typos and the last word also matches as a prefix. Unlike the `*` operator of the filter searches, this uses the search index and does not scan the catalog.",
+    response_model=CatalogSearchResponse
+)
+async def search_catalog(
+    request: Request,
+    q: str = Query(min_length=1, max_length=256),
+    catalog: Collections = Query("files"),
+    page_number: int = Query(1, ge=1),
+    page_size: int = Query(None, ge=1, le=100),
+    _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services)
+) -> CatalogSearchResponse:
+
+    user_id = request.state.user if request.state.user else None
+
+    response = await catalogServices.search(text=q, user_id=user_id, collection_name=catalog, page_number=page_number, page_size=page_size)
+
+    return response
+
+
 @router.put(
     path="/set-file-status/{record_uuid}", 
     summary="Set the status of a catalog file record",
@@ -157,9 +208,9 @@ async def set_file_status(
     payload: SetRecordStatusPayload, 
     record_uuid: str, 
     _: str = Depends(auth_oauth2_scheme),
+    catalogServices: CatalogServices = Depends(get_catalog_services),
 ) -> CouchbaseCatalogFileModel:
     try:
-        catalogServices = CatalogServices()
         response = await catalogServices.set_record_status(document_id=record_uuid, new_status=payload.status, collection_name="files")
         return response
     except Exception as e:
@@ -169,17 +220,17 @@ async def set_file_status(
 @router.delete(
     path="/collections/delete/{collection_uuid}",
     summary="Delete collection records",
-    response_model=CouchbaseCatalogCollectionModel
+    description="Queues the deletion of the collection, its files and stored objects. Poll `/jobs/{job_uuid}` for its progress.",
+    status_code=202,
+    response_model=JobModel
 )
-async def delete_collection(collection_uuid: str, request: Request,  _: str = Depends(auth_oauth2_scheme)) -> CouchbaseCatalogCollectionModel:
+async def delete_collection(collection_uuid: str, request: Request,  _: str = Depends(auth_oauth2_scheme), catalogService: CatalogServices = Depends(get_catalog_services)) -> JobModel:
     
-    catalogService = CatalogServices()
-
     user_id = request.state.user if request.state.user else None
 
-    deleted_record = await catalogService.delete_collection_record(document_id=collection_uuid, user_id=user_id)
+    job = await catalogService.delete_collection_record(document_id=collection_uuid, user_id=user_id)
 
-    return deleted_record
+    return job
     
 
 
@@ -188,9 +239,7 @@ async def delete_collection(collection_uuid: str, request: Request,  _: str = De
     summary="Delete file records",
     response_model=CouchbaseCatalogFileModel
 )
-async def delete_file(file_uuid: str, request: Request,  _: str = Depends(auth_oauth2_scheme)) -> CouchbaseCatalogFileModel:
-
-    catalogService = CatalogServices()
+async def delete_file(file_uuid: str, request: Request,  _: str = Depends(auth_oauth2_scheme), catalogService: CatalogServices = Depends(get_catalog_services)) -> CouchbaseCatalogFileModel:
 
     user_id = request.state.user if request.state.user else None
 
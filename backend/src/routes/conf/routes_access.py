@@ -6,11 +6,13 @@ no_auth_routes_list=[
     "/user/create",
     "/user/password-recovery",
     "/user/password-change",
+    "/storage/events",
     "/docs",
     "/redoc",
     "/openapi.json"
 ]
 
 admin_routes_list = [
-  "/credentials"
+  "/credentials",
+  "/metrics"
 ]
\ No newline at end of file
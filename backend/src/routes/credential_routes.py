@@ -3,7 +3,7 @@ from typing import List
 import uuid6
 from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
 
-from services.CredentialServices import CredentialServices
+from services.CredentialServices import CredentialServices, get_credential_services
 from shared.models.storage import Storage
 from shared.models.credentials import CouchbaseCredentialModel, CreateCredentialsPayload, DeleteCredentialResponse
 from shared.handlers.FilesHandler import FilesHandler
@@ -19,9 +19,9 @@ router = APIRouter(prefix="/credentials", tags=["Credentials"])
     response_model=List[CouchbaseCredentialModel]
 )
 async def list_all_credentials(
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    credentialServices: CredentialServices = Depends(get_credential_services)
 ) -> List[CouchbaseCredentialModel]:
-    credentialServices = CredentialServices()
 
     response = await credentialServices.list_all_cloud()
     
@@ -34,11 +34,10 @@ async def list_all_credentials(
 )
 async def get_credential_by_id(
     credential_uuid: str, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    credentialServices: CredentialServices = Depends(get_credential_services)
 ) -> CouchbaseCredentialModel:
 
-    credentialServices = CredentialServices()
-
     response = await credentialServices.list_by_id(credential_id=credential_uuid)
     
     return response
@@ -89,11 +88,11 @@ async def get_credential_by_id(
 )
 async def upload_credentials(
     payload: CreateCredentialsPayload,
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    credentialServices: CredentialServices = Depends(get_credential_services)
 ) -> CouchbaseCredentialModel:
     
     try:
-        credentialServices = CredentialServices()
         response = await credentialServices.create_credentials(payload)
 
     except Exception as e:
@@ -220,11 +219,10 @@ async def upload_credentials_from_json(
     response_model=DeleteCredentialResponse
 )
 async def delete_by_id(
-    credential_uuid: str, _: str = Depends(auth_oauth2_scheme)
+    credential_uuid: str, _: str = Depends(auth_oauth2_scheme),
+    credentialServices: CredentialServices = Depends(get_credential_services)
 ) -> DeleteCredentialResponse:
 
-    credentialServices = CredentialServices()
-
     response = await credentialServices.delete_by_id(credential_uuid=credential_uuid)
 
     return DeleteCredentialResponse(deleted_credential_id=response)
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, Request
+
+from services.JobServices import JobServices, get_job_services
+from shared.models.jobs import JobModel
+
+from routes.auth_routes import auth_oauth2_scheme
+
+
+router = APIRouter(prefix="/jobs", tags=["Jobs"])
+
+
+@router.get(
+    path="/{job_uuid}",
+    summary="Status and progress of a background job",
+    response_model=JobModel
+)
+async def get_job(job_uuid: str, request: Request, _: str = Depends(auth_oauth2_scheme), jobServices: JobServices = Depends(get_job_services)) -> JobModel:
+
+    user_id = request.state.user if request.state.user else None
+    user_role = request.state.user_role if request.state.user_role else None
+
+    return await jobServices.get_by_id(job_id=job_uuid, user_id=user_id, user_role=user_role)
+
+
+@router.post(
+    path="/{job_uuid}/cancel",
+    summary="Cancel a pending or running job",
+    description="A running job is stopped by its worker right after the response. A cancelled job keeps the progress it made and can be started again with `/jobs/{job_uuid}/retry`.",
+    status_code=202,
+    response_model=JobModel
+)
+async def cancel_job(job_uuid: str, request: Request, _: str = Depends(auth_oauth2_scheme), jobServices: JobServices = Depends(get_job_services)) -> JobModel:
+
+    user_id = request.state.user if request.state.user else None
+    user_role = request.state.user_role if request.state.user_role else None
+
+    return await jobServices.cancel(job_id=job_uuid, user_id=user_id, user_role=user_role)
+
+
+@router.post(
+    path="/{job_uuid}/retry",
+    summary="Run a failed or cancelled job again",
+    status_code=202,
+    response_model=JobModel
+)
+async def retry_job(job_uuid: str, request: Request, _: str = Depends(auth_oauth2_scheme), jobServices: JobServices = Depends(get_job_services)) -> JobModel:
+
+    user_id = request.state.user if request.state.user else None
+    user_role = request.state.user_role if request.state.user_role else None
+
+    return await jobServices.retry(job_id=job_uuid, user_id=user_id, user_role=user_role)
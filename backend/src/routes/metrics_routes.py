@@ -0,0 +1,58 @@
+from fastapi import APIRouter, Depends
+
+from repositories.CouchbaseConnectionPool import CouchbaseConnectionPool
+from repositories.StorageClientPool import StorageClientPool
+from services.StorageEventServices import StorageEventServices
+from services.UploadSweeperServices import UploadSweeperServices
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from shared.models.metrics import BlockingIOMetrics, ConnectionPoolMetrics, StorageClientPoolMetrics, StorageEventMetrics, UploadSweeperMetrics
+
+from routes.auth_routes import auth_oauth2_scheme
+
+
+router = APIRouter(prefix="/metrics", tags=["Metrics"])
+
+
+@router.get(
+    path="/couchbase-pool",
+    summary="Usage metrics of the shared Couchbase connection pool",
+    response_model=ConnectionPoolMetrics
+)
+async def get_couchbase_pool_metrics(_: str = Depends(auth_oauth2_scheme)) -> ConnectionPoolMetrics:
+    return CouchbaseConnectionPool.metrics()
+
+
+@router.get(
+    path="/storage-clients",
+    summary="Usage metrics of the cached GCS/S3 storage clients",
+    response_model=StorageClientPoolMetrics
+)
+async def get_storage_client_pool_metrics(_: str = Depends(auth_oauth2_scheme)) -> StorageClientPoolMetrics:
+    return StorageClientPool.metrics()
+
+
+@router.get(
+    path="/blocking-io",
+    summary="Usage metrics of the thread pool running blocking storage, broker and mailing calls",
+    response_model=BlockingIOMetrics
+)
+async def get_blocking_io_metrics(_: str = Depends(auth_oauth2_scheme)) -> BlockingIOMetrics:
+    return BlockingIOHandler.metrics()
+
+
+@router.get(
+    path="/upload-sweeper",
+    summary="Runs and outcomes of the sweeper of abandoned uploads",
+    response_model=UploadSweeperMetrics
+)
+async def get_upload_sweeper_metrics(_: str = Depends(auth_oauth2_scheme)) -> UploadSweeperMetrics:
+    return UploadSweeperServices.metrics()
+
+
+@router.get(
+    path="/storage-events",
+    summary="Received, matched and queued storage notifications",
+    response_model=StorageEventMetrics
+)
+async def get_storage_event_metrics(_: str = Depends(auth_oauth2_scheme)) -> StorageEventMetrics:
+    return StorageEventServices.metrics()
@@ -1,16 +1,41 @@
+import json
+
 from fastapi import (
     APIRouter,
     Depends,
-    Request
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    status
 )
 
+from fastapi.responses import StreamingResponse
 from starlette.formparsers import MultiPartParser
 
 
-from services.CollectionServices import CollectionServices
-from services.CredentialServices import CredentialServices
-from services.FileServices import FileServices
-from shared.models.storage import CreateCollectionPayload, CreateCollectionResponse, DownloadFileRequestPayload, DownloadFileRequestResponse, GetStorageBucketListResponse, UploadFileRequestPayload, UploadFileRequestResponse
+from services.CollectionServices import CollectionServices, get_collection_services
+from services.CredentialServices import CredentialServices, get_credential_services
+from services.FileServices import FileServices, get_file_services
+from services.StorageEventServices import StorageEventServices, get_storage_event_services
+from shared.models.catalog import CouchbaseCatalogFileModel
+from shared.models.storage import (
+    CompleteUploadSessionPayload,
+    CreateCollectionPayload,
+    CreateCollectionResponse,
+    CreateUploadSessionPayload,
+    DownloadFileBatchRequestPayload,
+    DownloadFileBatchRequestResponse,
+    DownloadFileRequestPayload,
+    DownloadFileRequestResponse,
+    GetStorageBucketListResponse,
+    UploadFileBatchRequestPayload,
+    UploadFileBatchRequestResponse,
+    UploadFileRequestPayload,
+    UploadFileRequestResponse,
+    UploadSessionResponse
+)
+from shared.models.storage_events import StorageEventsAccepted
 from routes.auth_routes import auth_oauth2_scheme
 
 
@@ -24,8 +49,7 @@ MultiPartParser.max_file_size = 1 * 1024 * 1024
     response_model_exclude_none=True, 
     response_model_exclude_unset=True
 )
-async def get_bucket_list(request: Request, _:str = Depends(auth_oauth2_scheme)) -> GetStorageBucketListResponse :
-    credentialServices = CredentialServices()
+async def get_bucket_list(request: Request, _:str = Depends(auth_oauth2_scheme), credentialServices: CredentialServices = Depends(get_credential_services)) -> GetStorageBucketListResponse :
 
     response = await credentialServices.list_storage_buckets()
 
@@ -42,13 +66,12 @@ async def get_bucket_list(request: Request, _:str = Depends(auth_oauth2_scheme))
 async def create_collections(
     request: Request,
     payload: CreateCollectionPayload, 
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    collection_services: CollectionServices = Depends(get_collection_services)
 ) -> CreateCollectionResponse:
     
     user_id = request.state.user
     
-    collection_services = CollectionServices()
-
     result = await collection_services.create_collection(payload=payload, user_id=user_id)
     
     return result
@@ -62,12 +85,11 @@ async def create_collections(
 async def download_file_request(
     request: Request,
     payload: DownloadFileRequestPayload,
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
 ) -> DownloadFileRequestResponse:
     user_id = request.state.user
 
-    files_services = FileServices()
-
     result = await files_services.create_download_request_directly(payload, user_id=user_id) 
 
     return result
@@ -82,13 +104,207 @@ async def download_file_request(
 async def upload_file_request_direct(
     request: Request,
     payload: UploadFileRequestPayload,
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
 ) -> UploadFileRequestResponse:
     
     user_id = request.state.user
 
-    files_services = FileServices()
-    
     result = await files_services.create_upload_file_request_directly(payload=payload, user_id=user_id)
 
     return result
+
+
+@router.post(
+    "/files/download-request/batch", 
+    summary="Download request for several files", 
+    description="Returns one signed url per catalog file id, in the order of the request",
+    response_model=DownloadFileBatchRequestResponse
+)
+async def download_file_request_batch(
+    request: Request,
+    payload: DownloadFileBatchRequestPayload,
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> DownloadFileBatchRequestResponse:
+    user_id = request.state.user
+
+    result = await files_services.create_download_requests_batch(payload=payload, user_id=user_id)
+
+    return result
+
+
+@router.post(
+    "/files/upload-request/batch",
+    summary="Open an upload call for several files of the same collection",
+    description="This endpoint will create the catalog records and generate one signed url per file, in the order of the request",
+    response_model=UploadFileBatchRequestResponse
+)
+async def upload_file_request_batch(
+    request: Request,
+    payload: UploadFileBatchRequestPayload,
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> UploadFileBatchRequestResponse:
+    
+    user_id = request.state.user
+
+    result = await files_services.create_upload_file_requests_batch(payload=payload, user_id=user_id)
+
+    return result
+
+
+@router.post(
+    "/files/upload-sessions",
+    summary="Open a multipart / resumable upload session for a large file",
+    description="This endpoint will create the catalog record and return one signed url per part: S3 multipart upload parts (can be uploaded in parallel, keep the ETag of each response), a GCS resumable session url (parts sent in order with a `Content-Range` header) or a WebHDFS append url (parts appended in order). Finish with `/files/upload-sessions/{session_id}/complete`.",
+    response_model=UploadSessionResponse
+)
+async def create_upload_session(
+    request: Request,
+    payload: CreateUploadSessionPayload,
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> UploadSessionResponse:
+
+    user_id = request.state.user
+
+    result = await files_services.create_upload_session(payload=payload, user_id=user_id)
+
+    return result
+
+
+@router.get(
+    "/files/upload-sessions/{session_id}",
+    summary="Progress of an upload session",
+    description="Returns the parts already stored and fresh signed urls for the others, to resume an interrupted upload",
+    response_model=UploadSessionResponse
+)
+async def get_upload_session(
+    request: Request,
+    session_id: str,
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> UploadSessionResponse:
+
+    user_id = request.state.user
+
+    result = await files_services.get_upload_session(session_id=session_id, user_id=user_id)
+
+    return result
+
+
+@router.post(
+    "/files/upload-sessions/{session_id}/complete",
+    summary="Complete an upload session",
+    description="Assembles the uploaded parts and sets the catalog record to ready with the stored size and checksum. S3 part ETags are read from the storage when not given.",
+    response_model=CouchbaseCatalogFileModel
+)
+async def complete_upload_session(
+    request: Request,
+    session_id: str,
+    payload: CompleteUploadSessionPayload = None,
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> CouchbaseCatalogFileModel:
+
+    user_id = request.state.user
+
+    result = await files_services.complete_upload_session(session_id=session_id, payload=payload, user_id=user_id)
+
+    return result
+
+
+@router.delete(
+    "/files/upload-sessions/{session_id}",
+    summary="Abort an upload session",
+    description="Drops the uploaded parts and the catalog record of the file",
+    response_model=UploadSessionResponse
+)
+async def abort_upload_session(
+    request: Request,
+    session_id: str,
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> UploadSessionResponse:
+
+    user_id = request.state.user
+
+    result = await files_services.abort_upload_session(session_id=session_id, user_id=user_id)
+
+    return result
+
+
+@router.put(
+    "/files/proxy-upload",
+    summary="Upload a file through the API",
+    description="For clients that cannot reach the storage: the raw request body is streamed to the bucket as it arrives, without being stored on the server. The file fields are query parameters. Returns the catalog record, ready with the size and md5 checksum of the body.",
+    response_model=CouchbaseCatalogFileModel
+)
+async def proxy_upload_file(
+    request: Request,
+    payload: UploadFileRequestPayload = Depends(),
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> CouchbaseCatalogFileModel:
+
+    user_id = request.state.user
+
+    result = await files_services.proxy_upload(payload=payload, stream=request.stream(), user_id=user_id)
+
+    return result
+
+
+@router.get(
+    "/files/proxy-download/{catalog_file_id}",
+    summary="Download a file through the API",
+    description="For clients that cannot reach the storage: the file is streamed from the bucket. Supports a single `Range: bytes=start-end` header (206 Partial Content) to resume or split downloads.",
+    response_class=StreamingResponse
+)
+async def proxy_download_file(
+    request: Request,
+    catalog_file_id: str,
+    range_header: str = Header(default=None, alias="Range"),
+    _: str = Depends(auth_oauth2_scheme),
+    files_services: FileServices = Depends(get_file_services)
+) -> StreamingResponse:
+
+    user_id = request.state.user
+
+    status_code, headers, body = await files_services.proxy_download(catalog_file_id=catalog_file_id, user_id=user_id, range_header=range_header)
+
+    return StreamingResponse(body, status_code=status_code, headers=headers, media_type="application/octet-stream")
+
+
+@router.post(
+    "/events",
+    summary="Storage notifications of written objects",
+    description="Receives S3 event notifications (raw or SNS), GCS Pub/Sub push messages and HDFS inotify-style events. The written objects are matched to their file records, which are set to ready with the stored size and checksum. Authenticated with the storage events token (`token` query parameter or `X-Storage-Events-Token` header) instead of a user token.",
+    status_code=202,
+    response_model=StorageEventsAccepted
+)
+async def receive_storage_events(
+    request: Request,
+    token: str = Query(default=None),
+    x_storage_events_token: str = Header(default=None),
+    storageEventServices: StorageEventServices = Depends(get_storage_event_services)
+) -> StorageEventsAccepted:
+
+    storageEventServices.authorize(token=token or x_storage_events_token)
+
+    try:
+        # SNS posts its JSON messages as text/plain
+        body = json.loads(await request.body())
+
+        if isinstance(body, dict) and body.get("Type") == "SubscriptionConfirmation":
+            await storageEventServices.confirm_subscription(body)
+
+            return StorageEventsAccepted(accepted=0)
+
+        events = storageEventServices.parse(body)
+    except (KeyError, ValueError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Invalid storage notification: {e}")
+
+    accepted = storageEventServices.publish(events)
+
+    return StorageEventsAccepted(accepted=accepted)
@@ -2,7 +2,8 @@ from typing import List
 
 from fastapi import APIRouter, Depends, Query, Request
 
-from services.UserServices import UserServices
+from services.UserServices import UserServices, get_user_services
+from shared.models.jobs import JobModel
 from shared.models.users import AssertUserVisasPayload, CouchbaseUserAssertionModel, CouchbaseUserModelNoPassword, CreateUserPayload, PasswordChangeRequest, PasswordRecoveryRequest
 
 from routes.auth_routes import auth_oauth2_scheme
@@ -18,8 +19,7 @@ router = APIRouter(prefix="/user", tags=["Passport Users"])
     response_model_exclude_none=True, 
     response_model_exclude_unset=True
 )
-async def list_all_users(_: str = Depends(auth_oauth2_scheme)) -> List[CouchbaseUserModelNoPassword]:
-    usersService = UserServices()
+async def list_all_users(_: str = Depends(auth_oauth2_scheme), usersService: UserServices = Depends(get_user_services)) -> List[CouchbaseUserModelNoPassword]:
     response = await usersService.list_all()
     return response
 
@@ -31,25 +31,23 @@ async def list_all_users(_: str = Depends(auth_oauth2_scheme)) -> List[Couchbase
     response_model_exclude_none=True, 
     response_model_exclude_unset=True
 )
-async def list_user_details_by_id(user_uuid: str, _: str = Depends(auth_oauth2_scheme)) -> CouchbaseUserModelNoPassword:
-    usersService = UserServices()
+async def list_user_details_by_id(user_uuid: str, _: str = Depends(auth_oauth2_scheme), usersService: UserServices = Depends(get_user_services)) -> CouchbaseUserModelNoPassword:
     response = await usersService.list_info_by_user_id(user_uuid=user_uuid)
     return response
 
 
 @router.get("/visas/{user_uuid}", summary="Get User Visas by Id", response_model=CouchbaseUserAssertionModel)
-async def list_user_visas(user_uuid: str, _: str = Depends(auth_oauth2_scheme)) -> CouchbaseUserAssertionModel:
-    usersService = UserServices()
+async def list_user_visas(user_uuid: str, _: str = Depends(auth_oauth2_scheme), usersService: UserServices = Depends(get_user_services)) -> CouchbaseUserAssertionModel:
     response = await usersService.list_passport_by_user_id(user_uuid=user_uuid)
     return response
 
 
 @router.post("/create", summary="Create User", response_model=CouchbaseUserModelNoPassword, response_model_exclude_none=True, response_model_exclude_unset=True)
 async def create_users(
-   payload: CreateUserPayload
+   payload: CreateUserPayload,
+   usersService: UserServices = Depends(get_user_services)
 ) -> CouchbaseUserModelNoPassword:
     
-    usersService = UserServices()
     response = await usersService.create_user(payload)
     return response
 
@@ -58,9 +56,9 @@ async def create_users(
 async def grant_user_visas(
     user_uuid: str,
     payload: AssertUserVisasPayload,
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    usersService: UserServices = Depends(get_user_services)
 ) -> CouchbaseUserAssertionModel:
-    usersService = UserServices()
     response = await usersService.grant_visas_to_user(user_uuid=user_uuid, visa_uuids=payload.visas_uuids)
     return response
 
@@ -68,9 +66,9 @@ async def grant_user_visas(
 async def revoke_user_visas(
     user_uuid: str,
     payload: AssertUserVisasPayload,
-    _: str = Depends(auth_oauth2_scheme)
+    _: str = Depends(auth_oauth2_scheme),
+    usersService: UserServices = Depends(get_user_services)
 ) -> CouchbaseUserAssertionModel:
-    usersService = UserServices()
     response = await usersService.revoke_visas_from_user(user_uuid=user_uuid, visa_uuids=payload.visas_uuids)
     return response
 
@@ -80,8 +78,7 @@ async def revoke_user_visas(
     description="A password change token will be sent to the user's email",
     response_model=str
 )
-async def password_recovery_request(payload: PasswordRecoveryRequest):
-    usersService = UserServices()
+async def password_recovery_request(payload: PasswordRecoveryRequest, usersService: UserServices = Depends(get_user_services)):
 
     response = await usersService.password_recovery_request(payload=payload)
 
@@ -94,17 +91,17 @@ async def password_recovery_request(payload: PasswordRecoveryRequest):
     description="A request token sent to the user's email is necessary",
     response_model=str
 )
-async def change_password(payload: PasswordChangeRequest):
-    usersService = UserServices()
+async def change_password(payload: PasswordChangeRequest, usersService: UserServices = Depends(get_user_services)):
     respose = await usersService.password_change_request(payload=payload)
     return respose
 
 
 @router.delete(
     path="/delete/{user_uuid}", 
-    response_model=str,
+    status_code=202,
+    response_model=JobModel,
     summary="Delete User",
-    description="This endpoint allows for possession tranfering. To transfer an user's collections and files to another user before deleting them, please provide the `trasfer_ownership_to_user_id` query parameter. *WARNING:* All the collections and files created by an user will be automatically deleted if possession transfering is not used."
+    description="This endpoint allows for possession tranfering. To transfer an user's collections and files to another user before deleting them, please provide the `trasfer_ownership_to_user_id` query parameter. *WARNING:* All the collections and files created by an user will be automatically deleted if possession transfering is not used. The deletion runs in the background, poll `/jobs/{job_uuid}` for its progress."
 )
 async def delete(
     request: Request,
@@ -113,14 +110,13 @@ async def delete(
         default=None, include_in_schema=True, 
         alias="trasfer_ownership_to_user_id"
     ),
-    _: str = Depends(auth_oauth2_scheme)
-) -> str:
+    _: str = Depends(auth_oauth2_scheme),
+    usersService: UserServices = Depends(get_user_services)
+) -> JobModel:
     
     user_id = request.state.user if request.state.user else None
     user_role = request.state.user_role if request.state.user_role else None
  
-    usersService = UserServices()
-
     response = await usersService.delete_user(user_uuid=user_uuid, requestor_id=user_id, requestor_role=user_role, new_owner_id=trasfer_ownership_to_user_id)
 
     return response
@@ -2,10 +2,10 @@
 
 import traceback
 from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
 
-from services.VisasServices import VisaServices
+from services.VisasServices import VisaServices, get_visa_services
+from shared.models.jobs import JobModel
 from shared.models.visas import AssertedVisaModel, CreateVisaPayload, VisaModel
 
 from routes.auth_routes import auth_oauth2_scheme
@@ -14,9 +14,7 @@ router = APIRouter(prefix="/visa", tags=["Passport Visas"])
 
 
 @router.get("/list", summary="List Passport Visas", response_model=List[VisaModel])
-async def list_all_visas(_: str = Depends(auth_oauth2_scheme)) -> List[VisaModel]:
-
-    visaServices = VisaServices()
+async def list_all_visas(_: str = Depends(auth_oauth2_scheme), visaServices: VisaServices = Depends(get_visa_services)) -> List[VisaModel]:
 
     response = await visaServices.list_all()
 
@@ -24,9 +22,7 @@ async def list_all_visas(_: str = Depends(auth_oauth2_scheme)) -> List[VisaModel
 
 
 @router.get("/id/{visa_uuid}", summary="Get Passport Visa by Id", response_model=AssertedVisaModel)
-async def get_visa_by_id(visa_uuid: str, _: str = Depends(auth_oauth2_scheme)) -> AssertedVisaModel:
-
-    visaServices = VisaServices()
+async def get_visa_by_id(visa_uuid: str, _: str = Depends(auth_oauth2_scheme), visaServices: VisaServices = Depends(get_visa_services)) -> AssertedVisaModel:
 
     response = await visaServices.get_by_id(visa_uuid=visa_uuid)
 
@@ -34,10 +30,9 @@ async def get_visa_by_id(visa_uuid: str, _: str = Depends(auth_oauth2_scheme)) -
 
 
 @router.post("/create", summary="Create Passport Visas", response_model=VisaModel)
-async def create_visa(payload: CreateVisaPayload, _: str = Depends(auth_oauth2_scheme)) -> VisaModel:
+async def create_visa(payload: CreateVisaPayload, _: str = Depends(auth_oauth2_scheme), visaServices: VisaServices = Depends(get_visa_services)) -> VisaModel:
 
     try:
-        visaServices = VisaServices()
 
         response = await visaServices.create_visa(payload)
 
@@ -52,10 +47,9 @@ async def create_visa(payload: CreateVisaPayload, _: str = Depends(auth_oauth2_s
 
 
 @router.put("/update", summary="Create Passport Visas", response_model=VisaModel)
-async def update_visa(payload: AssertedVisaModel, _: str = Depends(auth_oauth2_scheme)) -> VisaModel:
+async def update_visa(payload: AssertedVisaModel, _: str = Depends(auth_oauth2_scheme), visaServices: VisaServices = Depends(get_visa_services)) -> VisaModel:
 
     try:
-        visaServices = VisaServices()
 
         response = await visaServices.update_visa(payload)
 
@@ -69,11 +63,11 @@ async def update_visa(payload: AssertedVisaModel, _: str = Depends(auth_oauth2_s
     return response
 
 
-@router.delete("/delete/{visa_uuid}", summary="Delete Visas by Id")
-async def delete_visa_by_id(visa_uuid: str, _: str = Depends(auth_oauth2_scheme)) -> JSONResponse:
+@router.delete("/delete/{visa_uuid}", summary="Delete Visas by Id", status_code=202, response_model=JobModel)
+async def delete_visa_by_id(visa_uuid: str, request: Request, _: str = Depends(auth_oauth2_scheme), visaServices: VisaServices = Depends(get_visa_services)) -> JobModel:
 
-    visaServices = VisaServices()
+    user_id = request.state.user if request.state.user else None
 
-    response = await visaServices.delete_visa(visa_uuid=visa_uuid)
+    response = await visaServices.schedule_visa_deletion(visa_uuid=visa_uuid, user_id=user_id)
 
     return response
\ No newline at end of file
@@ -1,8 +1,9 @@
+from functools import lru_cache
 from typing import List
 
 from fastapi import HTTPException
 import uuid6
-from repositories.CouchbaseRepository import CouchbaseRepository
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
 
 from shared.models.access_requests import (
     AccessRequestModel,
@@ -12,12 +13,14 @@ from shared.models.access_requests import (
     RevokeAccessRequestPayload,
 )
 from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
+from shared.models.bulk_operations import BulkOperationResult
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
 
 class AccessRequestServices:
     def __init__(self):
         self.scope = "users"
 
-        self.couchbaseRepo = CouchbaseRepository(
+        self.couchbaseRepo = CouchbaseKVRepository(
             scope=self.scope,
         )
 
@@ -28,13 +31,13 @@ class AccessRequestServices:
     async def create_request(
         self, payload: AccessRequestModel
     ) -> CouchbaseAccessRequestModel:
-        from services.CatalogServices import CatalogServices
-        from services.UserServices import UserServices
+        from services.CatalogServices import get_catalog_services
+        from services.UserServices import get_user_services
         from shared.handlers.TimeHandler import TimeHandler
         from shared.handlers.MailingClient import MailingClient
 
-        catalogServices = CatalogServices()
-        userServices = UserServices()
+        catalogServices = get_catalog_services()
+        userServices = get_user_services()
         timeHandler = TimeHandler()
 
         owner_details = await userServices.list_info_by_user_id(
@@ -84,7 +87,7 @@ class AccessRequestServices:
             f"Please log into your account to accept or reject it!"
         )
         
-        mailing_client.send_email(couchbaseRecord.owner_email)
+        await BlockingIOHandler.run(mailing_client.send_email, couchbaseRecord.owner_email)
 
         return couchbaseRecord
 
@@ -101,13 +104,13 @@ class AccessRequestServices:
         ][0]
 
     async def grant_access(self, payload: GrantAccessRequestPayload, user_id: str):
-        from services.UserServices import UserServices
-        from services.CatalogServices import CatalogServices
+        from services.UserServices import get_user_services
+        from services.CatalogServices import get_catalog_services
         from shared.handlers.TimeHandler import TimeHandler
         from shared.handlers.MailingClient import MailingClient
 
-        userServices = UserServices()
-        catalogServices = CatalogServices()
+        userServices = get_user_services()
+        catalogServices = get_catalog_services()
         timeHandler = TimeHandler()
 
         access_request = await self.get_by_id(document_id=payload.access_request_id)
@@ -183,7 +186,7 @@ class AccessRequestServices:
             f"Your request to access the collection {collection.collection_name} was granted by the collection's owner.\n"
         )
         
-        mailing_client.send_email(updated_access_request.requestor_email)
+        await BlockingIOHandler.run(mailing_client.send_email, updated_access_request.requestor_email)
 
         await self.couchbaseRepo.create_document(
             collection_name="access_requests",
@@ -196,13 +199,13 @@ class AccessRequestServices:
         return updated_access_request
 
     async def revoke_access(self, payload: RevokeAccessRequestPayload, user_id: str):
-        from services.UserServices import UserServices
-        from services.CatalogServices import CatalogServices
+        from services.UserServices import get_user_services
+        from services.CatalogServices import get_catalog_services
         from shared.handlers.TimeHandler import TimeHandler
         from shared.handlers.MailingClient import MailingClient
 
-        userServices = UserServices()
-        catalogServices = CatalogServices()
+        userServices = get_user_services()
+        catalogServices = get_catalog_services()
         timeHandler = TimeHandler()
 
         access_request = await self.get_by_id(document_id=payload.access_request_id)
@@ -287,7 +290,7 @@ class AccessRequestServices:
             f"Your request to access the collection {collection.collection_name} was rejected by the collection's owner.\n"
         )
         
-        mailing_client.send_email(updated_access_request.requestor_email)
+        await BlockingIOHandler.run(mailing_client.send_email, updated_access_request.requestor_email)
 
         return updated_access_request
 
@@ -305,7 +308,7 @@ class AccessRequestServices:
 
         query = querybuilder.order_by_field("requested_at", direction="DESC").build()
 
-        results = await self.couchbaseRepo.query(statement=query)
+        results = await self.couchbaseRepo.query(statement=query, args=querybuilder.args)
 
         if not results:
             return list()
@@ -317,9 +320,9 @@ class AccessRequestServices:
         return parsed_results
 
     async def delete_access_request(self, user_id: str, document_id: str) -> str:
-        from services.UserServices import UserServices
+        from services.UserServices import get_user_services
 
-        userServices = UserServices()
+        userServices = get_user_services()
 
         access_request = await self.get_by_id(document_id=document_id)
 
@@ -344,3 +347,16 @@ class AccessRequestServices:
         )
 
         return document_id
+
+    async def delete_access_requests(self, document_ids: List[str]) -> BulkOperationResult:
+        """Delete several access requests at once. Callers are responsible for checking ownership."""
+        response = await self.couchbaseRepo.delete_many(
+            collection_name="access_requests", document_keys=document_ids
+        )
+
+        return response
+
+
+@lru_cache(maxsize=1)
+def get_access_request_services() -> AccessRequestServices:
+    return AccessRequestServices()
@@ -1,22 +1,29 @@
+import hashlib
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
-from typing import Literal
+from functools import lru_cache
+from typing import Literal, Tuple
 from jose import ExpiredSignatureError, JWTError, jwt
 from passlib.context import CryptContext
 
 from fastapi import HTTPException, status, Response
 
 from shared.models.authentication import TokenData
-from shared.models.env import EnvSettings
+from shared.models.env import get_settings
 
 class AuthServices:
+    # sha256(token) -> (exp, decoded token) of already verified tokens, least recently used first
+    _verified_tokens: "OrderedDict[str, Tuple[int, TokenData]]" = OrderedDict()
+
     def __init__(self, crypto_scheme: Literal["bcrypt", "argon2"] = "bcrypt"):
         self.pwd_context = CryptContext(schemes=crypto_scheme, deprecated="auto")
-        self.env_settings = EnvSettings()
+        self.env_settings = get_settings()
 
     async def authenticate(self, email: str, password: str) -> tuple | None:
-        from services.UserServices import UserServices
+        from services.UserServices import get_user_services
 
-        userServices = UserServices()
+        userServices = get_user_services()
 
         user = await userServices.list_by_email(email=email)
 
@@ -86,7 +93,48 @@ class AuthServices:
 
         return encoded_jwt
     
+    def __token_cache_key(self, token: str, refresh: bool) -> str:
+        return hashlib.sha256(f"{int(refresh)}:{token}".encode()).hexdigest()
+
+    def __cached_token(self, cache_key: str) -> TokenData | None:
+        cached = AuthServices._verified_tokens.get(cache_key)
+
+        if cached is None:
+            return None
+
+        exp, token_data = cached
+
+        if exp <= time.time():
+            del AuthServices._verified_tokens[cache_key]
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Token has expired",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+
+        AuthServices._verified_tokens.move_to_end(cache_key)
+
+        return token_data.model_copy()
+
+    def __cache_token(self, cache_key: str, token_data: TokenData) -> None:
+        # tokens without expiry are verified every time
+        if not token_data.exp or self.env_settings.AUTH_TOKEN_CACHE_SIZE <= 0:
+            return
+
+        AuthServices._verified_tokens[cache_key] = (token_data.exp, token_data.model_copy())
+
+        while len(AuthServices._verified_tokens) > self.env_settings.AUTH_TOKEN_CACHE_SIZE:
+            AuthServices._verified_tokens.popitem(last=False)
+
     def decode_jwt_token(self, token: str, refresh: bool = False) -> TokenData:
+        """Verify and decode a token. Verified tokens are cached by hash until they expire."""
+        cache_key = self.__token_cache_key(token=token, refresh=refresh)
+
+        cached_token = self.__cached_token(cache_key)
+
+        if cached_token is not None:
+            return cached_token
+
         try:
             secret_key = self.env_settings.REFRESH_TOKEN_KEY if refresh else self.env_settings.AUTH_SECRET_KEY
 
@@ -112,7 +160,11 @@ class AuthServices:
                 headers={"WWW-Authenticate": "Bearer"},
             )
 
-        return TokenData(**decoded_token)
+        token_data = TokenData(**decoded_token)
+
+        self.__cache_token(cache_key=cache_key, token_data=token_data)
+
+        return token_data.model_copy()
     
     def set_refresh_cookie(self, response: Response, token: str):
         # response.set_cookie(
@@ -136,4 +188,10 @@ class AuthServices:
         )
 
     def clear_refresh_cookie(self, response: Response):
-        response.delete_cookie(key="refresh_token", path="/")
\ No newline at end of file
+        response.delete_cookie(key="refresh_token", path="/")
+
+
+@lru_cache(maxsize=1)
+def get_auth_services() -> AuthServices:
+    """Process-wide AuthServices, so the password context is built once."""
+    return AuthServices()
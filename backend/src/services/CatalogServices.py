@@ -1,104 +1,194 @@
-import boto3
-from google.cloud import storage
+import asyncio
+import base64
+import contextvars
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
 from google.api_core.exceptions import GoogleAPICallError
-from typing import List, Union
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple, Union
 from fastapi import HTTPException, status
 import uuid6
 
 from botocore.exceptions import BotoCoreError, ClientError
 
-import requests
 from requests_kerberos import HTTPKerberosAuth
 
 
-from repositories.CouchbaseRepository import CouchbaseRepository
-from services.CredentialServices import CredentialServices
-from shared.models.access_requests import AccessRequestSearchPayload
-from shared.models.catalog import CatalogCollectionBaseModel, CatalogFileBaseModel, CatalogFilter, CouchbaseCatalogCollectionModel, CouchbaseCatalogFileModel, FileStatus, GetCollectionsCatalogResponse, GetFilesCatalogResponse
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.CouchbaseRepository import CouchbaseError
+from repositories.StorageClientPool import StorageClientPool
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from services.CredentialServices import get_credential_services
+from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
+from shared.models.catalog import CatalogCollectionBaseModel, CatalogFileBaseModel, CatalogFilter, CatalogSearchHit, CatalogSearchResponse, CatalogStatsGroup, CatalogStatsResponse, CatalogStatsRow, CouchbaseCatalogCollectionModel, CouchbaseCatalogFileModel, FileStatus, GetCollectionsCatalogResponse, GetFilesCatalogResponse
 
 from shared.models.credentials import CouchbaseCredentialModel
+from shared.models.env import get_settings
+from shared.models.jobs import JobModel
 from shared.models.storage import Collections
 
-import math
+logger = logging.getLogger(__name__)
 
-from typing import TypeVar
+# fields of the catalog stats breakdowns
+STATS_GROUP_FIELDS: Dict[str, List[str]] = {
+    "collection": ["collection_id", "collection_name"],
+    "storage_type": ["storage_type"],
+    "processing_level": ["processing_level"],
+    "file_status": ["file_status"],
+}
 
-T = TypeVar("T")
+StatsKey = Tuple[str, Tuple[str, ...]]
+
+# full-text search index (see SEARCH_INDEX_REGISTRY) and searched fields with their boost, per catalog
+SEARCH_INDEXES: Dict[str, str] = {
+    "files": "fts_catalog_files",
+    "collections": "fts_catalog_collections",
+}
+
+SEARCH_FIELDS: Dict[str, Dict[str, float]] = {
+    "files": {"file_name": 3.0, "collection_name": 1.5, "file_description": 1.0},
+    "collections": {"collection_name": 3.0, "collection_description": 1.0},
+}
+
+# largest from + size the search service accepts (bleveMaxResultWindow)
+SEARCH_MAX_RESULTS = 10000
 
 
 class CatalogServices:
-    
+
+    PAGE_SIZE = 1000
+
+    # (user id, breakdown) -> (monotonic time it was computed, stats), least recently used first
+    _stats_cache: "OrderedDict[StatsKey, Tuple[float, CatalogStatsResponse]]" = OrderedDict()
+    _stats_refreshes: Dict[StatsKey, asyncio.Task] = {}
 
     def __init__(self) -> None:
+        settings = get_settings()
+
         self.scope = "catalogs"
 
-        self.couchbaseRepo = CouchbaseRepository(
+        self.couchbaseRepo = CouchbaseKVRepository(
             scope=self.scope
         )
 
-    def __catalog_pagination(self, catalog: List[T], page_number: int) -> tuple[List[T], int, int]:
-            
-            if not catalog:
-                return (list(), None, 0)
+        self.stats_ttl_seconds = settings.CATALOG_STATS_CACHE_TTL_SECONDS
+        self.stats_max_stale_seconds = settings.CATALOG_STATS_MAX_STALE_SECONDS
+        self.stats_cache_size = settings.CATALOG_STATS_CACHE_SIZE
 
-            size = len(catalog)
-            page_size = 1000
-            n_pages = math.ceil(size/page_size)
+        self.search_page_size = settings.CATALOG_SEARCH_PAGE_SIZE
+        self.search_fuzziness = settings.CATALOG_SEARCH_FUZZINESS
 
-            if page_number > n_pages:
-                raise HTTPException(status_code=400, detail="Page not found!")
-            
-            
-            if page_number < 1:
-                page_number = 1
+    def __encode_page_token(self, last_id: str) -> str:
+        return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode()
 
-            start_index = (page_number-1)*page_size
-            end_index = min(start_index+page_size, len(catalog))
-            
-            catalog = catalog[start_index:end_index]
+    def __decode_page_token(self, page_token: str) -> str:
+        try:
+            return json.loads(base64.urlsafe_b64decode(page_token.encode()))["after"]
+        except (ValueError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid page token!")
 
-            next_page = page_number+1 if end_index <= n_pages else None
+    async def __catalog_page(
+        self,
+        queryBuilder: CouchbaseQueryBuilder,
+        collection_name: Collections,
+        page_number: int = 1,
+        page_token: str = None
+    ) -> Union[GetFilesCatalogResponse, GetCollectionsCatalogResponse]:
+        """
+        Fetch one page of the query results, ordered by record id (uuid7, i.e. insertion order).
+        With a page_token the page is resolved by keyset (id > cursor), otherwise by offset.
+        """
+        response_model = GetFilesCatalogResponse if collection_name == "files" else GetCollectionsCatalogResponse
+        record_model = CouchbaseCatalogFileModel if collection_name == "files" else CouchbaseCatalogCollectionModel
+
+        pageBuilder = (
+            queryBuilder.instance_copy(deep=True)
+            .order_by_field("id", "ASC")
+            .limit_to(self.PAGE_SIZE + 1)
+        )
+
+        total = None
+
+        if page_token:
+            pageBuilder.where(field="id", op=">", value=self.__decode_page_token(page_token))
+
+            response = await self.couchbaseRepo.query(statement=pageBuilder.build(), args=pageBuilder.args)
+        else:
+            page_number = max(page_number, 1)
 
-            return (
-                catalog,
-                next_page,
-                size
+            pageBuilder.offset((page_number - 1) * self.PAGE_SIZE)
+
+            countBuilder = queryBuilder.count_copy()
+
+            count_response, response = await asyncio.gather(
+                self.couchbaseRepo.query(statement=countBuilder.build(), args=countBuilder.args),
+                self.couchbaseRepo.query(statement=pageBuilder.build(), args=pageBuilder.args)
             )
-        
-    async def __get_credential_by_storage_bucket(self, storage_type: str, bucket_name: str) -> CouchbaseCredentialModel:
-        credentialServices = CredentialServices()
 
-        credentials = await credentialServices.list_all_cloud(collection_name="cloud")
+            total = count_response[0]["count"] if count_response else 0
 
-        response_list = [ item for item in credentials if storage_type == item.storage_type and bucket_name in item.bucket_names ]
+            if not response and page_number > 1 and total:
+                raise HTTPException(status_code=400, detail="Page not found!")
 
-        return response_list[0]
-    
-    async def __user_collection_accesses(self, user_id: str) -> List[str]:
-        from services.UserServices import UserServices
+        records = [ record_model(**row[collection_name]) for row in response ]
 
-        userServices = UserServices()
+        has_more = len(records) > self.PAGE_SIZE
 
-        user_passport = await userServices.list_passport_by_user_id(user_uuid=user_id)
+        records = records[:self.PAGE_SIZE]
 
-        collection_names = []
+        return response_model(
+            records=records,
+            next_page=page_number + 1 if has_more and not page_token else None,
+            next_token=self.__encode_page_token(records[-1].id) if has_more else None,
+            total=total
+        )
+
+    async def __access_filter(
+        self,
+        queryBuilder: CouchbaseQueryBuilder,
+        user_id: str,
+        collection_name: Collections,
+        include_owned: bool = False
+    ) -> CouchbaseQueryBuilder:
+        """Restrict a catalog query to the non-deleted records the user is allowed to see."""
+        user_collection_ids = await self.__user_collection_ids(user_id=user_id)
+
+        if collection_name == "files":
+            queryBuilder.where(field="file_status", op="!=", value="deleted")
+            visibility = [("public", "=", True)]
+            collection_id_field = "collection_id"
+        else:
+            queryBuilder.where(field="status", op="!=", value="deleted")
+            visibility = [("IFMISSINGORNULL(secret, false)", "=", False)]
+            collection_id_field = "id"
+
+        if user_collection_ids:
+            visibility.append((collection_id_field, "IN", sorted(user_collection_ids)))
 
-        if not user_passport or not user_passport.passportVisaAssertions:
-            return collection_names
+            if include_owned:
+                visibility.append(("inserted_by", "LIKE", f"{user_id}:%"))
 
-        visas = [ visaAssertions.passportVisa for visaAssertions in user_passport.passportVisaAssertions ]
+        return queryBuilder.where_any_of(visibility)
+        
+    async def __get_credential_by_storage_bucket(self, storage_type: str, bucket_name: str) -> CouchbaseCredentialModel:
+        credentialServices = get_credential_services()
 
-        # collection_ids = []
+        return await credentialServices.get_by_storage_bucket(storage_type=storage_type, bucket_name=bucket_name)
+    
+    async def __user_collection_ids(self, user_id: str) -> Set[str]:
+        from services.UserServices import get_user_services
 
-        for visa in visas:
-            col_id, col_name = visa.visaName.split(":")
-            collection_names.append(col_name)
-            # collection_ids.append(col_id)
+        access = await get_user_services().get_collection_access(user_uuid=user_id)
 
-        return collection_names
+        return set(access.collection_ids)
 
+    def __record_collection_id(self, record: Union[CouchbaseCatalogFileModel, CouchbaseCatalogCollectionModel]) -> str:
+        return record.collection_id if isinstance(record, CouchbaseCatalogFileModel) else record.id
 
-    async def create_catalog_record(
+    def __catalog_model(
         self, 
         payload: CatalogFileBaseModel | CatalogCollectionBaseModel, 
         collection_name: Collections = "files"
@@ -112,11 +202,37 @@ class CatalogServices:
         elif collection_name == "collections":
             couchbasePayload = CouchbaseCatalogCollectionModel(id=record_id, **payload.__dict__)
 
+        return couchbasePayload
+
+    async def create_catalog_record(
+        self, 
+        payload: CatalogFileBaseModel | CatalogCollectionBaseModel, 
+        collection_name: Collections = "files"
+    ) -> Union[CouchbaseCatalogFileModel | CouchbaseCatalogCollectionModel]:
+        couchbasePayload = self.__catalog_model(payload=payload, collection_name=collection_name)
+
         dumped_payload = couchbasePayload.model_dump(exclude_none=True, exclude_unset=True)
 
-        await self.couchbaseRepo.create_document(collection_name=collection_name, key=record_id, value=dumped_payload)
+        await self.couchbaseRepo.create_document(collection_name=collection_name, key=couchbasePayload.id, value=dumped_payload)
 
         return couchbasePayload
+
+    async def create_catalog_records(
+        self, 
+        payloads: List[CatalogFileBaseModel | CatalogCollectionBaseModel], 
+        collection_name: Collections = "files"
+    ) -> List[Union[CouchbaseCatalogFileModel | CouchbaseCatalogCollectionModel]]:
+        """Insert several catalog records with a single batched write."""
+        couchbasePayloads = [ self.__catalog_model(payload=payload, collection_name=collection_name) for payload in payloads ]
+
+        documents = {
+            record.id: record.model_dump(exclude_none=True, exclude_unset=True)
+            for record in couchbasePayloads
+        }
+
+        await self.couchbaseRepo.upsert_multi(collection_name=collection_name, documents=documents)
+
+        return couchbasePayloads
     
     async def get_by_id_api(self, document_id: str, collection_name: Collections = "files") -> Union[CouchbaseCatalogFileModel, CouchbaseCatalogCollectionModel]:
 
@@ -153,29 +269,157 @@ class CatalogServices:
         
         catalog_record = couchbasePayload[0]
 
-        user_collections_names = await self.__user_collection_accesses(user_id=user_id)
+        user_collection_ids = await self.__user_collection_ids(user_id=user_id)
 
-        if not catalog_record.public and catalog_record.collection_name not in user_collections_names:
+        if not catalog_record.public and self.__record_collection_id(catalog_record) not in user_collection_ids:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Access Denied: User has no granted visa to access this item")
 
         return catalog_record
     
     
+    async def get_many_by_id(
+        self, 
+        document_ids: List[str], 
+        user_id: str, 
+        collection_name: Collections = "files"
+    ) -> Dict[str, Union[CouchbaseCatalogFileModel, CouchbaseCatalogCollectionModel]]:
+        """Fetch several records by id in one batch. Unknown ids are left out of the returned mapping."""
+        response = await self.couchbaseRepo.get_multi(collection_name=collection_name, document_keys=list(set(document_ids)))
+
+        if collection_name == "files":
+            records = [ CouchbaseCatalogFileModel(**item[collection_name]) for item in response ]
+        else:
+            records = [ CouchbaseCatalogCollectionModel(**item[collection_name]) for item in response ]
+
+        user_collection_ids = await self.__user_collection_ids(user_id=user_id)
+
+        denied_ids = [
+            record.id for record in records 
+            if not record.public and self.__record_collection_id(record) not in user_collection_ids
+        ]
+
+        if denied_ids:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=f"Access Denied: User has no granted visa to access the items {denied_ids}")
+
+        return { record.id: record for record in records }
+
+    async def latest_file_versions(
+        self, 
+        collection_id: str, 
+        file_names: List[str], 
+        user_id: str = None
+    ) -> Dict[Tuple[str, str, str], int]:
+        """Highest existing version of each (file_name, file_category, processing_level) of a collection."""
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="files")
+
+        queryBuilder.select([
+            "file_name", 
+            "file_category", 
+            "processing_level", 
+            "MAX(file_version) AS latest_version"
+        ]).where(
+            field="collection_id", op="=", value=collection_id
+        ).where_in(
+            target="file_name", in_values=list(set(file_names))
+        )
+
+        if user_id:
+            await self.__access_filter(queryBuilder=queryBuilder, user_id=user_id, collection_name="files")
+
+        queryBuilder.group_by_fields(["file_name", "file_category", "processing_level"])
+
+        query = queryBuilder.build()
+
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
+
+        return {
+            (row.get("file_name"), row.get("file_category"), row.get("processing_level")): row.get("latest_version") or 1
+            for row in response
+        }
+
+    def __version_counter_key(self, collection_id: str, version_key: Tuple[str, str, str]) -> str:
+        # file names can be longer than a document key
+        digest = hashlib.sha1("\x00".join(str(part) for part in version_key).encode()).hexdigest()
+
+        return f"{collection_id}::{digest}"
+
+    async def allocate_file_versions(
+        self,
+        collection_id: str,
+        files: List[Tuple[str, str, str, Optional[int]]]
+    ) -> List[int]:
+        """
+        Version of each new (file_name, file_category, processing_level, requested_version) of a collection, in order.
+
+        Each file has a counter document in catalogs.file_versions, incremented atomically, so concurrent uploads
+        of the same file get distinct versions. Requested versions above 1 are kept and move the counter up to
+        them. A counter is seeded from the highest stored version of its file when it is first used.
+        """
+        requested_versions: Dict[Tuple[str, str, str], List[Tuple[int, Optional[int]]]] = {}
+
+        for index, (file_name, file_category, processing_level, requested_version) in enumerate(files):
+            requested_versions.setdefault((file_name, file_category, processing_level), []).append((index, requested_version))
+
+        counter_keys = { version_key: self.__version_counter_key(collection_id, version_key) for version_key in requested_versions }
+
+        counters = await self.couchbaseRepo.get_many(collection_name="file_versions", document_keys=list(counter_keys.values()))
+
+        unseeded = [ version_key for version_key, counter_key in counter_keys.items() if counter_key not in counters.succeeded ]
+
+        # every stored version counts, not only the ones the uploader can see
+        latest_versions = await self.latest_file_versions(
+            collection_id=collection_id,
+            file_names=[ version_key[0] for version_key in unseeded ]
+        ) if unseeded else {}
+
+        versions: List[int] = [0] * len(files)
+
+        async def allocate(version_key: Tuple[str, str, str], requests: List[Tuple[int, Optional[int]]]) -> None:
+            # the versions of a same file are allocated in request order
+            for index, requested_version in requests:
+                explicit = bool(requested_version and requested_version > 1)
+
+                version = await self.couchbaseRepo.increment_counter(
+                    collection_name="file_versions",
+                    key=counter_keys[version_key],
+                    field="latest_version",
+                    delta=0 if explicit else 1,
+                    minimum=requested_version if explicit else 0,
+                    initial=latest_versions.get(version_key, 0),
+                    document=dict(
+                        collection_id=collection_id,
+                        file_name=version_key[0],
+                        file_category=version_key[1],
+                        processing_level=version_key[2]
+                    )
+                )
+
+                versions[index] = requested_version if explicit else version
+
+        await asyncio.gather(*[ allocate(version_key, requests) for version_key, requests in requested_versions.items() ])
+
+        return versions
+
     async def get_by_filters(
         self, 
         filters: List[CatalogFilter], 
         page_number: int = 1,
         user_id: str = None,
         collection_name: Collections = "collections",
+        page_token: str = None,
     ) -> Union[GetFilesCatalogResponse, GetCollectionsCatalogResponse]:
-        from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
         from shared.handlers.TimeHandler import TimeHandler
 
         timeHandler = TimeHandler()
 
         queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection=collection_name)
 
+        record_model = CouchbaseCatalogFileModel if collection_name == "files" else CouchbaseCatalogCollectionModel
+
         for filter_item in filters:
+            if filter_item.property_name not in record_model.model_fields:
+                raise HTTPException(status_code=400, detail=f"Invalid filter property: {filter_item.property_name}")
+
             if filter_item.property_name in ["inserted_at", "expires_at"]:
                 if isinstance(filter_item.property_value, str) and filter_item.property_value.isdigit():
                     filter_item.property_value = int(filter_item.property_value)
@@ -195,126 +439,287 @@ class CatalogServices:
 
             queryBuilder.where(field=filter_item.property_name, op=filter_item.operator, value=filter_item.property_value)
 
-        query = queryBuilder.build()
+        # the access restrictions apply to the user's filters as a whole
+        queryBuilder.group_filters()
 
-        response = await self.couchbaseRepo.query(query)
+        if user_id:
+            await self.__access_filter(queryBuilder=queryBuilder, user_id=user_id, collection_name=collection_name)
 
-        if not response:
-            return GetFilesCatalogResponse(records=[], next_page=None, total=0) if collection_name == "files" else GetCollectionsCatalogResponse(records=[], next_page=None, total=0)
-        
-        loaded_catalog = []
+        return await self.__catalog_page(
+            queryBuilder=queryBuilder, 
+            collection_name=collection_name, 
+            page_number=page_number, 
+            page_token=page_token
+        )
 
-        if collection_name == "files":
-            loaded_catalog = list(map(lambda x: CouchbaseCatalogFileModel(**x[collection_name]), response))
-        elif collection_name=="collections":
-            loaded_catalog = list(map(lambda x: CouchbaseCatalogCollectionModel(**x[collection_name]), response))
+
+    async def list_collections(self, user_id: str = None, page_number: int = 1, page_token: str = None) -> GetCollectionsCatalogResponse: 
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="collections")
 
         if user_id:
-            user_collections_names = await self.__user_collection_accesses(user_id=user_id)
-
-            if not user_collections_names:
-                if collection_name == "files":
-                    loaded_catalog = [ 
-                        item for item in loaded_catalog 
-                        if item.public 
-                        and item.file_status != "deleted"
+            await self.__access_filter(queryBuilder=queryBuilder, user_id=user_id, collection_name="collections", include_owned=True)
+
+        return await self.__catalog_page(
+            queryBuilder=queryBuilder, 
+            collection_name="collections", 
+            page_number=page_number, 
+            page_token=page_token
+        )
+    
+    
+    async def list_files(self, user_id: str = None, page_number: int = 1, page_token: str = None) -> GetFilesCatalogResponse: 
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="files")
+       
+        if not user_id:
+            queryBuilder.where(field="public", op="=", value=True)
+        else:
+            await self.__access_filter(queryBuilder=queryBuilder, user_id=str(user_id), collection_name="files", include_owned=True)
+
+        return await self.__catalog_page(
+            queryBuilder=queryBuilder, 
+            collection_name="files", 
+            page_number=page_number, 
+            page_token=page_token
+        )
+    
+    
+    async def get_stats(self, user_id: str = None, group_by: List[CatalogStatsGroup] = None) -> CatalogStatsResponse:
+        """
+        Number of files, total size, latest version and last insertion of the files the user can see (as in
+        list_files), optionally broken down per collection, storage type, processing level and/or status.
+
+        Computed in the database with one GROUP BY query and cached per user and breakdown: results younger than
+        CATALOG_STATS_CACHE_TTL_SECONDS are returned as they are, older ones (up to CATALOG_STATS_MAX_STALE_SECONDS)
+        are returned while they are recomputed in the background.
+        """
+        cls = CatalogServices
+
+        group_by = list(dict.fromkeys(group_by)) if group_by else []
+
+        key = (str(user_id) if user_id else "", tuple(sorted(group_by)))
+
+        cached = cls._stats_cache.get(key)
+
+        if cached:
+            cls._stats_cache.move_to_end(key)
+
+            age = time.monotonic() - cached[0]
+
+            if age < self.stats_ttl_seconds:
+                return cached[1]
+
+            if age < self.stats_max_stale_seconds:
+                self.__refresh_stats(key=key, user_id=user_id, group_by=group_by)
+                return cached[1]
+
+        # a cancelled request does not cancel the computation shared with the others
+        return await asyncio.shield(self.__refresh_stats(key=key, user_id=user_id, group_by=group_by))
+
+    def __refresh_stats(self, key: StatsKey, user_id: str, group_by: List[CatalogStatsGroup]) -> asyncio.Task:
+        """Computes the stats of a key once at a time, concurrent callers share the running computation."""
+        cls = CatalogServices
+
+        task = cls._stats_refreshes.get(key)
+
+        if task is not None:
+            return task
+
+        # the result outlives the request, it must not use the request's memoized lookups
+        task = asyncio.create_task(
+            self.__compute_stats(key=key, user_id=user_id, group_by=group_by), context=contextvars.Context()
+        )
+
+        def done(task: asyncio.Task) -> None:
+            cls._stats_refreshes.pop(key, None)
+
+            if not task.cancelled() and task.exception():
+                logger.warning(f"Failed to compute the catalog stats {key}: {task.exception()}")
+
+        task.add_done_callback(done)
+
+        cls._stats_refreshes[key] = task
+
+        return task
+
+    async def __compute_stats(self, key: StatsKey, user_id: str, group_by: List[CatalogStatsGroup]) -> CatalogStatsResponse:
+        from shared.handlers.TimeHandler import TimeHandler
+
+        cls = CatalogServices
+
+        group_fields = [ field for group in group_by for field in STATS_GROUP_FIELDS[group] ]
+
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="files")
+
+        queryBuilder.select([
+            *[ f"`{field}`" for field in group_fields ],
+            "COUNT(*) AS file_count",
+            "SUM(IFMISSINGORNULL(file_size, 0)) AS total_size",
+            "MAX(file_version) AS latest_version",
+            "MAX(inserted_at) AS last_inserted_at"
+        ])
+
+        if not user_id:
+            queryBuilder.where(field="file_status", op="!=", value="deleted")
+            queryBuilder.where(field="public", op="=", value=True)
+        else:
+            await self.__access_filter(queryBuilder=queryBuilder, user_id=str(user_id), collection_name="files", include_owned=True)
+
+        if group_fields:
+            queryBuilder.group_by_fields(group_fields)
+
+        response = await self.couchbaseRepo.query(statement=queryBuilder.build(), args=queryBuilder.args)
+
+        # aggregates over no files are null
+        rows = [ CatalogStatsRow(**{ field: value for field, value in row.items() if value is not None }) for row in response ]
+
+        totals = CatalogStatsRow(
+            file_count=sum(row.file_count for row in rows),
+            total_size=sum(row.total_size for row in rows),
+            latest_version=max((row.latest_version for row in rows if row.latest_version is not None), default=None),
+            last_inserted_at=max((row.last_inserted_at for row in rows if row.last_inserted_at is not None), default=None)
+        )
+
+        stats = CatalogStatsResponse(
+            group_by=group_by,
+            totals=totals,
+            groups=sorted(rows, key=lambda row: row.file_count, reverse=True) if group_fields else [],
+            computed_at=int(TimeHandler().utc_now().timestamp())
+        )
+
+        cls._stats_cache[key] = (time.monotonic(), stats)
+        cls._stats_cache.move_to_end(key)
+
+        while len(cls._stats_cache) > self.stats_cache_size:
+            cls._stats_cache.popitem(last=False)
+
+        return stats
+
+    async def search(
+        self,
+        text: str,
+        user_id: str = None,
+        collection_name: Collections = "files",
+        page_number: int = 1,
+        page_size: int = None
+    ) -> CatalogSearchResponse:
+        """
+        Full-text search of the file (name, description, collection name) or collection (name, description)
+        records the user can see, ranked by relevance. Words match with up to CATALOG_SEARCH_FUZZINESS typos,
+        and the last word also matches as a prefix, so partially typed names are found.
+
+        The access restrictions of the listings are part of the search request, and applied again to the
+        fetched records since the search index catches up with writes asynchronously.
+        """
+        terms = text.lower().split()
+
+        if not terms:
+            raise HTTPException(status_code=400, detail="Empty search text!")
+
+        page_number = max(page_number, 1)
+        page_size = page_size if page_size else self.search_page_size
+
+        if page_number * page_size > SEARCH_MAX_RESULTS:
+            raise HTTPException(status_code=400, detail=f"Only the first {SEARCH_MAX_RESULTS} results can be paged through, refine the search")
+
+        user_collection_ids = await self.__user_collection_ids(user_id=user_id) if user_id else set()
+
+        request = {
+            "query": {
+                "must": {
+                    "conjuncts": [
+                        self.__search_text_query(text=text, terms=terms, collection_name=collection_name),
+                        self.__search_access_query(user_id=user_id, user_collection_ids=user_collection_ids, collection_name=collection_name),
                     ]
-                else:
-                    loaded_catalog = [ 
-                        item for item in loaded_catalog 
-                        if not item.secret 
-                        and item.status != "deleted"
+                },
+                "must_not": {
+                    "disjuncts": [
+                        {"term": "deleted", "field": "file_status" if collection_name == "files" else "status"}
                     ]
+                },
+            },
+            "size": page_size,
+            "from": (page_number - 1) * page_size,
+            "sort": ["-_score"],
+        }
 
-            if collection_name == "files":
-                loaded_catalog = [ 
-                    item for item in loaded_catalog 
-                    if item.file_status != "deleted" 
-                    and (
-                        item.collection_name in user_collections_names 
-                        or item.public
-                    )
-                ]
-            else:
-                loaded_catalog = [ 
-                    item for item in loaded_catalog 
-                    if item.status != "deleted" 
-                    and (
-                        item.collection_name in user_collections_names 
-                        or not item.secret
-                    )
-                ]
+        try:
+            response = await self.couchbaseRepo.search(index_name=SEARCH_INDEXES[collection_name], request=request)
+        except CouchbaseError as e:
+            logger.warning(f"Catalog search failed: {e}")
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Search is unavailable, retry later")
 
-        catalog_page, next_page, size = self.__catalog_pagination(catalog=loaded_catalog, page_number=page_number)
+        hits = response.get("hits") or []
+        total = response.get("total_hits", 0)
 
-        return GetFilesCatalogResponse(records=catalog_page, next_page=next_page, total=size) if collection_name == "files" else GetCollectionsCatalogResponse(records=catalog_page, next_page=next_page, total=size)
+        records = await self.couchbaseRepo.get_many(collection_name=collection_name, document_keys=[hit["id"] for hit in hits])
 
+        record_model = CouchbaseCatalogFileModel if collection_name == "files" else CouchbaseCatalogCollectionModel
 
-    async def list_collections(self, user_id: str = None, page_number: int = 1) -> GetCollectionsCatalogResponse: 
-        response = await self.couchbaseRepo.get_documents(collection_name="collections") 
+        records_by_id = { row["id"]: record_model(**row[collection_name]) for row in records.results }
 
-        parsed_catalog = list(map(lambda x: CouchbaseCatalogCollectionModel(**x["collections"]), response))
+        search_hits = []
 
-        catalog = []
+        for hit in hits:
+            record = records_by_id.get(hit["id"])
 
-        if not user_id:
-            catalog = parsed_catalog
+            if record is None or not self.__search_visible(record=record, user_id=user_id, user_collection_ids=user_collection_ids):
+                continue
 
-        else:
-            user_collection_names = await self.__user_collection_accesses(user_id=user_id)
-            if not user_collection_names:
-                catalog = [
-                    item for item in parsed_catalog 
-                    if not item.secret
-                    and item.status != "deleted"
-                ]
-            else:
-                catalog = [ 
-                    item for item in parsed_catalog if item.status != "deleted" 
-                    and (
-                        item.collection_name in user_collection_names 
-                        or user_id in item.inserted_by 
-                        or not item.secret
-                    )
-                ]
+            search_hits.append(CatalogSearchHit(score=hit["score"], record=record))
 
-        catalog_page, next_page, size = self.__catalog_pagination(catalog=catalog, page_number=page_number)
+        return CatalogSearchResponse(
+            hits=search_hits,
+            next_page=page_number + 1 if page_number * page_size < min(total, SEARCH_MAX_RESULTS) else None,
+            total=total
+        )
 
-        return GetCollectionsCatalogResponse(records=catalog_page, next_page=next_page, total=size)
-    
-    
-    async def list_files(self, user_id: str = None, page_number: int = 1) -> GetFilesCatalogResponse: 
-        response = await self.couchbaseRepo.get_documents(collection_name="files") 
+    def __search_text_query(self, text: str, terms: List[str], collection_name: Collections) -> dict:
+        disjuncts = []
 
-        parsed_catalog = list(map(lambda x: CouchbaseCatalogFileModel(**x["files"]), response))
+        for field, boost in SEARCH_FIELDS[collection_name].items():
+            disjuncts.append({"match": text, "field": field, "fuzziness": self.search_fuzziness, "prefix_length": 1, "boost": boost})
 
-        catalog = []
-       
-        if not user_id:
-            catalog = [ item for item in parsed_catalog if item.public ]
+            # prefix terms are not analyzed, the text fields are indexed lowercased
+            disjuncts.append({"prefix": terms[-1], "field": field, "boost": boost / 2})
+
+        return {"disjuncts": disjuncts}
+
+    def __search_access_query(self, user_id: str, user_collection_ids: Set[str], collection_name: Collections) -> dict:
+        """Search counterpart of __access_filter (with the owned records, as in the listings)."""
+        if collection_name == "files":
+            visibility = [{"bool": True, "field": "public"}]
+            granted = [{"term": collection_id, "field": "collection_id"} for collection_id in sorted(user_collection_ids)]
         else:
-            user_collection_names = await self.__user_collection_accesses(user_id=str(user_id))
-            if not user_collection_names:
-                catalog = [
-                    item for item in parsed_catalog 
-                    if item.public and item.file_status != "deleted"
-                ]
-            else:
-                catalog = [ 
-                    item for item in parsed_catalog 
-                    if item.file_status != "deleted" 
-                    and (
-                        item.collection_name in user_collection_names 
-                        or user_id in item.inserted_by 
-                        or item.public
-                    )
-                ]
+            # records without a secret field are not secret
+            visibility = [{"must": {"conjuncts": [{"match_all": {}}]}, "must_not": {"disjuncts": [{"bool": True, "field": "secret"}]}}]
+            granted = [{"ids": sorted(user_collection_ids)}] if user_collection_ids else []
+
+        if user_collection_ids:
+            visibility.extend(granted)
+            visibility.append({"prefix": f"{user_id}:", "field": "inserted_by"})
+
+        return {"disjuncts": visibility}
+
+    def __search_visible(
+        self,
+        record: Union[CouchbaseCatalogFileModel, CouchbaseCatalogCollectionModel],
+        user_id: str,
+        user_collection_ids: Set[str]
+    ) -> bool:
+        if isinstance(record, CouchbaseCatalogFileModel):
+            if record.file_status == "deleted":
+                return False
+            visible = bool(record.public)
+        else:
+            if record.status == "deleted":
+                return False
+            visible = not record.secret
 
-        catalog_page, next_page, size = self.__catalog_pagination(catalog=catalog, page_number=page_number)
+        if user_collection_ids:
+            visible = visible or self.__record_collection_id(record) in user_collection_ids or (record.inserted_by or "").startswith(f"{user_id}:")
+
+        return visible
 
-        return GetFilesCatalogResponse(records=catalog_page, next_page=next_page, total=size)
-    
-    
     async def set_record_status(self, document_id: str, new_status: FileStatus = "ready", collection_name: Collections = "files") -> Union[CouchbaseCatalogFileModel | CouchbaseCatalogCollectionModel]:
 
         response = await self.couchbaseRepo.get_document_by_id(collection_name=collection_name, document_key=document_id)
@@ -343,6 +748,26 @@ class CatalogServices:
 
         return old_record
 
+    async def set_file_uploaded(self, document_id: str, file_size: int, file_checksum: str = None) -> CouchbaseCatalogFileModel:
+        """Sets a file record to ready once its object is stored, with the stored size and checksum"""
+        response = await self.couchbaseRepo.get_document_by_id(collection_name="files", document_key=document_id)
+
+        if not response:
+            raise HTTPException(status_code=400, detail="Invalid or inexisting document_id")
+
+        file_record = CouchbaseCatalogFileModel(**response[0]["files"])
+
+        file_record.file_status = "ready"
+        file_record.expires_at = None
+        file_record.file_size = file_size
+
+        if file_checksum:
+            file_record.file_checksum = file_checksum
+
+        await self.couchbaseRepo.upsert_document(collection_name="files", key=document_id, value=file_record.model_dump(exclude_none=True))
+
+        return file_record
+
     async def set_collection_owner(self, collection_record: CouchbaseCatalogCollectionModel, new_owner: str) -> CouchbaseCatalogCollectionModel:
 
         updated_record = collection_record.model_copy(deep=True)
@@ -384,8 +809,6 @@ class CatalogServices:
     
     
     async def delete_file_record(self, document_id: str, user_id = None) -> CouchbaseCatalogFileModel:
-        from shared.handlers.EncryptionHandler import EncryptionHandler  
-         
         file_record = await self.get_by_id(document_id=document_id, user_id=user_id, collection_name="files")
 
         if not file_record:
@@ -400,6 +823,14 @@ class CatalogServices:
         if user_id not in file_collection.inserted_by:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Insuficient privileges for this operation. Only collection can delete files")
 
+        await self.__delete_file_object(file_record=file_record)
+
+        await self.set_record_status(document_id=file_record.id, new_status = "deleted", collection_name="files")
+
+        return file_record
+
+    async def __delete_file_object(self, file_record: CouchbaseCatalogFileModel) -> None:
+        """Deletes the stored object of a file record, the record itself is left untouched"""
         credential = await self.__get_credential_by_storage_bucket(storage_type=file_record.storage_type, bucket_name=file_record.file_location)
 
         if not credential:
@@ -408,19 +839,18 @@ class CatalogServices:
                 detail=f"Missing credentials to operate in the following bucket enviroment {file_record.file_location}"
             )
 
-        encryptionHandler = EncryptionHandler()
-
-        decrypted_credential = encryptionHandler.decrypt_credentials(credential.credential)
+        decrypted_credential = get_credential_services().decrypt_credential(credential)
 
         blob_name = f"lakehouse/collections/{file_record.collection_name}/{file_record.processing_level}/v{file_record.file_version}/{file_record.file_name}"
 
         if file_record.storage_type == "gcs":
             try:
-                storage_client = storage.Client.from_service_account_info(info=decrypted_credential)
+                storage_client = await BlockingIOHandler.run(
+                    StorageClientPool.gcs_client, credential_id=credential.id, decoded_credential=decrypted_credential
+                )
                 bucket = storage_client.bucket(file_record.file_location)
                 blob = bucket.blob(blob_name)
-                blob.delete()
-                storage_client.close()
+                await BlockingIOHandler.run(blob.delete)
             except GoogleAPICallError as e:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST, 
@@ -429,19 +859,15 @@ class CatalogServices:
 
         elif file_record.storage_type == "s3":
             try:
-                storage_client = boto3.client(
-                    "s3",
-                    aws_access_key_id=decrypted_credential.get("access_key", ""),
-                    aws_secret_access_key=decrypted_credential.get("secret_access_key", ""),
-                    region_name=decrypted_credential.get("region", "")
+                storage_client = await BlockingIOHandler.run(
+                    StorageClientPool.s3_client, credential_id=credential.id, decoded_credential=decrypted_credential
                 )
 
-                storage_client.delete_object(
+                await BlockingIOHandler.run(
+                    storage_client.delete_object,
                     Bucket=file_record.file_location,
                     Key=blob_name
                 )
-
-                storage_client.close()
             except ClientError as e:
                 error_code = e.response['Error']['Code']
                 error_message = e.response['Error']['Message']
@@ -464,7 +890,8 @@ class CatalogServices:
 
             url = f"http://{namenode}:{port}/webhdfs/v1/{blob_name}?op=DELETE"
 
-            response = requests.delete(
+            response = await BlockingIOHandler.run(
+                StorageClientPool.hdfs_session().delete,
                 url=url, 
                 # auth=kerberos_auth
             )
@@ -472,17 +899,13 @@ class CatalogServices:
             if not response.status_code == 200:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error deleting file: {response.text}")
 
-        await self.set_record_status(document_id=file_record.id, new_status = "deleted", collection_name="files")
-
-        return file_record
-
 
-    #TODO [improvement] deletion logic by implementing delete multiple files in the bucket storad (or all the files with a blob prefix or dir)
-    async def delete_collection_record(self, document_id: str, user_id = None) -> CouchbaseCatalogCollectionModel:
-        from services.VisasServices import VisaServices
-        from services.AccessRequestServices import AccessRequestServices
-        
-        visaServices = VisaServices()
+    async def delete_collection_record(self, document_id: str, user_id = None) -> JobModel:
+        """
+        Marks the collection as deleting and queues the removal of its access requests, visa, files and
+        stored objects as a background job (see CollectionDeletionServices). Returns the job.
+        """
+        from services.CollectionDeletionServices import get_collection_deletion_services
 
         collection_record = await self.get_by_id(document_id=document_id, user_id=user_id, collection_name="collections")
 
@@ -491,49 +914,13 @@ class CatalogServices:
 
         if user_id not in collection_record.inserted_by:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Insuficient privileges for this operation. Only collection owners can delete collections")
-        
-        accessRequestService = AccessRequestServices()
-
-        filters = AccessRequestSearchPayload(
-            collection_id=collection_record.id
-        )
-
-        access_requests = await accessRequestService.search_by_owner_and_collections(payload=filters)
-
-        if access_requests:
-            for item in access_requests:
-                await accessRequestService.delete_access_request(
-                    user_id=user_id, 
-                    document_id=item.id
-                )
-
-        visas = await visaServices.list_all()
-
-        visa_name = f"{collection_record.id}:{collection_record.collection_name}"
-
-        collection_visa = [ visa for visa in visas if visa.visaName == visa_name ]
-
-        target_visa = collection_visa[0] if collection_visa else None
-
-        if target_visa:
-            # list users with this visa
-            # revoke this visa from all users that have it
-            # delete visa (already includes the previous steps)
-            await visaServices.delete_visa(visa_uuid=target_visa.id)
-
-        # deny all the access requests to this collection
-
-        filters = [
-            CatalogFilter(property_name="collection_id", operator="=", property_value=collection_record.id),
-        ]
 
-        collection_files = await self.get_by_filters(filters=filters, user_id=user_id, collection_name="files")
+        if collection_record.status != "deleting":
+            collection_record = await self.set_record_status(document_id=collection_record.id, new_status="deleting", collection_name="collections")
 
-        if collection_files:
-            for file_record in collection_files.records:
-                await self.delete_file_record(document_id=file_record.id, user_id=user_id)
+        return await get_collection_deletion_services().start(collection_record=collection_record, user_id=user_id)
 
-        await self.set_record_status(document_id=collection_record.id, new_status = "deleted", collection_name="collections")
 
-        return collection_record
-         
+@lru_cache(maxsize=1)
+def get_catalog_services() -> CatalogServices:
+    return CatalogServices()
@@ -0,0 +1,340 @@
+import asyncio
+from functools import lru_cache
+from typing import Dict, List
+
+from botocore.exceptions import BotoCoreError, ClientError
+from google.api_core.exceptions import GoogleAPICallError, NotFound
+
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.StorageClientPool import StorageClientPool
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
+from shared.models.access_requests import AccessRequestSearchPayload
+from shared.models.catalog import CouchbaseCatalogCollectionModel, CouchbaseCatalogFileModel
+from shared.models.credentials import CouchbaseCredentialModel
+from shared.models.env import get_settings
+from shared.models.jobs import JobModel
+
+S3_DELETE_BATCH_SIZE = 1000  # DeleteObjects limit
+GCS_DELETE_BATCH_SIZE = 100  # max calls per JSON API batch request
+WEBHDFS_PORT = 9870
+
+MAX_REPORTED_ERRORS = 20
+
+# steps of a collection deletion, in order, each one safe to run again after a crash
+PHASES = ["access_requests", "visa", "storage_prefix", "files", "collection"]
+
+
+class CollectionDeletionServices:
+    """
+    Cascade deletion of a collection, run as a "collection_delete" job (see
+    JobServices).
+
+    The job's progress (current phase, last file id handled, counters) is
+    saved after every step, so a deletion interrupted by a crash, a restart or
+    a cancellation goes on where it stopped when the job runs again. Files are
+    handled a page at a time: stored objects are removed with bulk calls (S3
+    DeleteObjects, GCS batch requests, one recursive WebHDFS DELETE of the
+    collection directory) and the page's catalog records are marked as deleted
+    with a single statement.
+
+    Objects that cannot be deleted leave their file records untouched and fail
+    the job before the collection itself is marked as deleted.
+    """
+
+    def __init__(self) -> None:
+        settings = get_settings()
+
+        self.scope = "catalogs"
+
+        self.couchbaseRepo = CouchbaseKVRepository(
+            scope=self.scope
+        )
+
+        self.page_size = settings.COLLECTION_DELETE_PAGE_SIZE
+        self.concurrency = settings.COLLECTION_DELETE_CONCURRENCY
+
+    async def start(self, collection_record: CouchbaseCatalogCollectionModel, user_id: str) -> JobModel:
+        """Queue the deletion of a collection, reusing the unfinished job of that collection if any."""
+        from services.JobServices import get_job_services
+
+        jobServices = get_job_services()
+
+        unfinished = await jobServices.list_unfinished(
+            job_type="collection_delete", payload_filters=dict(collection_id=collection_record.id)
+        )
+
+        if unfinished:
+            return unfinished[0]
+
+        return await jobServices.enqueue(
+            job_type="collection_delete",
+            payload=dict(collection_id=collection_record.id),
+            user_id=user_id,
+            progress=dict(phase=PHASES[0], cursor=None, files_deleted=0, files_failed=0, errors=[]),
+        )
+
+    async def run(self, job: JobModel) -> None:
+        from services.JobServices import get_job_services
+
+        jobServices = get_job_services()
+
+        collection_record = await self.__get_collection(job.payload["collection_id"])
+
+        while job.progress["phase"] in PHASES:
+            phase = job.progress["phase"]
+
+            if phase == "access_requests":
+                await self.__delete_access_requests(collection_record)
+            elif phase == "visa":
+                await self.__delete_visa(collection_record)
+            elif phase == "storage_prefix":
+                await self.__delete_storage_prefix(collection_record)
+            elif phase == "files":
+                await self.__delete_files(job, collection_record)
+            else:
+                await self.__delete_collection(job, collection_record)
+
+            next_phase = PHASES.index(phase) + 1
+
+            job.progress["phase"] = PHASES[next_phase] if next_phase < len(PHASES) else "done"
+            job.progress["cursor"] = None
+
+            await jobServices.save(job)
+
+    async def __get_collection(self, collection_id: str) -> CouchbaseCatalogCollectionModel:
+        response = await self.couchbaseRepo.get_document_by_id(collection_name="collections", document_key=collection_id)
+
+        if not response:
+            raise RuntimeError(f"Collection {collection_id} not found")
+
+        return CouchbaseCatalogCollectionModel(**response[0]["collections"])
+
+    async def __delete_access_requests(self, collection_record: CouchbaseCatalogCollectionModel) -> None:
+        from services.AccessRequestServices import get_access_request_services
+
+        accessRequestServices = get_access_request_services()
+
+        access_requests = await accessRequestServices.search_by_owner_and_collections(
+            payload=AccessRequestSearchPayload(collection_id=collection_record.id)
+        )
+
+        if not access_requests:
+            return
+
+        result = await accessRequestServices.delete_access_requests(
+            document_ids=[item.id for item in access_requests]
+        )
+
+        if result.failed:
+            raise RuntimeError(f"Failed to delete the access requests {list(result.failed.keys())}")
+
+    async def __delete_visa(self, collection_record: CouchbaseCatalogCollectionModel) -> None:
+        from services.VisasServices import get_visa_services
+
+        visaServices = get_visa_services()
+
+        visa_name = f"{collection_record.id}:{collection_record.collection_name}"
+
+        visas = await visaServices.list_all()
+
+        for visa in visas:
+            if visa.visaName == visa_name:
+                # revokes the visa from its users and credentials before removing it
+                await visaServices.delete_visa(visa_uuid=visa.id)
+
+    def __collection_prefix(self, collection_record: CouchbaseCatalogCollectionModel) -> str:
+        return f"lakehouse/collections/{collection_record.collection_name}"
+
+    def __blob_name(self, file_record: CouchbaseCatalogFileModel) -> str:
+        return f"lakehouse/collections/{file_record.collection_name}/{file_record.processing_level}/v{file_record.file_version}/{file_record.file_name}"
+
+    async def __delete_storage_prefix(self, collection_record: CouchbaseCatalogCollectionModel) -> None:
+        """WebHDFS deletes the whole collection directory at once, object stores are handled per file page."""
+        if collection_record.storage_type != "hdfs":
+            return
+
+        prefix = self.__collection_prefix(collection_record)
+
+        url = f"http://{collection_record.location}:{WEBHDFS_PORT}/webhdfs/v1/{prefix}?op=DELETE&recursive=true"
+
+        response = await BlockingIOHandler.run(StorageClientPool.hdfs_session().delete, url=url)
+
+        if not response.status_code == 200:
+            raise RuntimeError(f"Error deleting {prefix}: {response.text}")
+
+    async def __next_files(self, collection_id: str, cursor: str = None) -> List[CouchbaseCatalogFileModel]:
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="files")
+
+        queryBuilder.select().where(field="collection_id", op="=", value=collection_id)
+        queryBuilder.where(field="file_status", op="!=", value="deleted")
+
+        if cursor:
+            queryBuilder.where(field="id", op=">", value=cursor)
+
+        query = queryBuilder.order_by_field("id", "ASC").limit_to(self.page_size).build()
+
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
+
+        return [CouchbaseCatalogFileModel(**row["files"]) for row in response]
+
+    async def __delete_files(self, job: JobModel, collection_record: CouchbaseCatalogCollectionModel) -> None:
+        from services.CredentialServices import get_credential_services
+        from services.JobServices import get_job_services
+
+        credential, decoded_credential = None, None
+
+        if collection_record.storage_type in ["gcs", "s3"]:
+            credentialServices = get_credential_services()
+
+            credential = await credentialServices.get_by_storage_bucket(
+                storage_type=collection_record.storage_type, bucket_name=collection_record.location
+            )
+
+            if not credential:
+                raise RuntimeError(f"Missing credentials to operate in the following bucket enviroment {collection_record.location}")
+
+            decoded_credential = credentialServices.decrypt_credential(credential)
+
+        progress = job.progress
+
+        while True:
+            file_records = await self.__next_files(collection_id=collection_record.id, cursor=progress["cursor"])
+
+            if not file_records:
+                return
+
+            failed = await self.__delete_objects(
+                collection_record=collection_record,
+                credential=credential,
+                decoded_credential=decoded_credential,
+                blob_names=[self.__blob_name(file_record) for file_record in file_records],
+            )
+
+            deleted_ids = [
+                file_record.id for file_record in file_records if self.__blob_name(file_record) not in failed
+            ]
+
+            if deleted_ids:
+                result = await self.couchbaseRepo.update_where(
+                    collection_name="files",
+                    values={"file_status": "deleted", "expires_at": None},
+                    where="collection_id = $1 AND id IN $2",
+                    args=[collection_record.id, deleted_ids],
+                )
+
+                if result.failed:
+                    raise RuntimeError(f"Failed to mark {len(result.failed)} files as deleted")
+
+            progress["cursor"] = file_records[-1].id
+            progress["files_deleted"] += len(deleted_ids)
+            progress["files_failed"] += len(failed)
+            progress["errors"] = (
+                progress["errors"] + [f"{blob_name}: {error}" for blob_name, error in failed.items()]
+            )[:MAX_REPORTED_ERRORS]
+
+            await get_job_services().save(job)
+
+            if len(file_records) < self.page_size:
+                return
+
+    async def __delete_objects(
+        self,
+        collection_record: CouchbaseCatalogCollectionModel,
+        credential: CouchbaseCredentialModel,
+        decoded_credential: dict,
+        blob_names: List[str],
+    ) -> Dict[str, str]:
+        """Delete stored objects in concurrent batches. Returns the blob names that could not be deleted with the error."""
+        if collection_record.storage_type == "s3":
+            storage_client = await BlockingIOHandler.run(
+                StorageClientPool.s3_client, credential_id=credential.id, decoded_credential=decoded_credential
+            )
+            delete_batch, batch_size = self.__delete_s3_batch, S3_DELETE_BATCH_SIZE
+
+        elif collection_record.storage_type == "gcs":
+            storage_client = await BlockingIOHandler.run(
+                StorageClientPool.gcs_client, credential_id=credential.id, decoded_credential=decoded_credential
+            )
+            delete_batch, batch_size = self.__delete_gcs_batch, GCS_DELETE_BATCH_SIZE
+
+        else:
+            # already removed with the collection directory
+            return {}
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_batch(batch: List[str]) -> Dict[str, str]:
+            async with semaphore:
+                return await BlockingIOHandler.run(delete_batch, storage_client, collection_record.location, batch)
+
+        results = await asyncio.gather(*[
+            run_batch(blob_names[start:start + batch_size]) for start in range(0, len(blob_names), batch_size)
+        ])
+
+        return {blob_name: error for result in results for blob_name, error in result.items()}
+
+    @staticmethod
+    def __delete_s3_batch(storage_client, bucket_name: str, blob_names: List[str]) -> Dict[str, str]:
+        try:
+            response = storage_client.delete_objects(
+                Bucket=bucket_name,
+                Delete={"Objects": [{"Key": blob_name} for blob_name in blob_names], "Quiet": True},
+            )
+        except (BotoCoreError, ClientError) as e:
+            return {blob_name: str(e) for blob_name in blob_names}
+
+        return {
+            error["Key"]: error.get("Message", error.get("Code"))
+            for error in response.get("Errors", [])
+            if error.get("Code") != "NoSuchKey"
+        }
+
+    @staticmethod
+    def __delete_gcs_batch(storage_client, bucket_name: str, blob_names: List[str]) -> Dict[str, str]:
+        bucket = storage_client.bucket(bucket_name)
+
+        try:
+            # a batch raises when any of its deletions failed, a missing object included
+            with storage_client.batch(raise_exception=True):
+                for blob_name in blob_names:
+                    bucket.delete_blob(blob_name)
+
+            return {}
+        except GoogleAPICallError:
+            pass
+
+        # the outcome of each deletion is only known by running them one by one; the deleted ones are missing by now
+        errors = {}
+
+        for blob_name in blob_names:
+            try:
+                bucket.delete_blob(blob_name)
+            except NotFound:
+                continue
+            except GoogleAPICallError as e:
+                errors[blob_name] = e.message
+
+        return errors
+
+    async def __delete_collection(self, job: JobModel, collection_record: CouchbaseCatalogCollectionModel) -> None:
+        from services.CatalogServices import get_catalog_services
+
+        progress = job.progress
+
+        if progress["files_failed"]:
+            files_failed = progress["files_failed"]
+
+            # a retry goes over the files left behind again
+            progress.update(phase="files", cursor=None, files_failed=0)
+
+            raise RuntimeError(f"{files_failed} files could not be deleted from the storage")
+
+        await get_catalog_services().set_record_status(
+            document_id=collection_record.id, new_status="deleted", collection_name="collections"
+        )
+
+
+@lru_cache(maxsize=1)
+def get_collection_deletion_services() -> CollectionDeletionServices:
+    return CollectionDeletionServices()
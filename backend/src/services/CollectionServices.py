@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from shared.models.catalog import CatalogCollectionBaseModel, CatalogFilter
 from shared.models.storage import CreateCollectionPayload, CreateCollectionResponse
 from shared.models.visas import CreateVisaPayload
@@ -10,22 +12,20 @@ class CollectionServices:
         user_id: str
     ) -> CreateCollectionResponse:
         
-        from services.CredentialServices import CredentialServices
-        from services.CatalogServices import CatalogServices
-        from services.VisasServices import VisaServices
-        from services.UserServices import UserServices
+        from services.CredentialServices import get_credential_services
+        from services.CatalogServices import get_catalog_services
+        from services.VisasServices import get_visa_services
+        from services.UserServices import get_user_services
 
         from shared.handlers.TimeHandler import TimeHandler
 
-        credentialServices = CredentialServices()
-        catalogServices = CatalogServices()
-        visaServices = VisaServices()
-        userServices = UserServices()
+        credentialServices = get_credential_services()
+        catalogServices = get_catalog_services()
+        visaServices = get_visa_services()
+        userServices = get_user_services()
         timeHandler = TimeHandler()
 
-        credentials = await credentialServices.list_all_cloud(collection_name='cloud')
-
-        target_credential = [ item for item in credentials if item.storage_type == payload.storage_type and payload.bucket_name in item.bucket_names ]
+        target_credential = await credentialServices.get_by_storage_bucket(storage_type=payload.storage_type, bucket_name=payload.bucket_name)
 
         if not target_credential:
             raise HTTPException(
@@ -102,11 +102,16 @@ class CollectionServices:
                 detail="Unable to create visa for new collection"
             )
 
-        await credentialServices.grant_credential_to_visa(credential_uuid=target_credential[0].id, visa_uuid=visa_item.id)
+        await credentialServices.grant_credential_to_visa(credential_uuid=target_credential.id, visa_uuid=visa_item.id)
 
         await userServices.grant_visas_to_user(user_uuid=user_id, visa_uuids=[visa_item.id])
         
         return CreateCollectionResponse(
             associated_visa=visa_item,
             catalog_record=catalog_item
-        )
\ No newline at end of file
+        )
+
+
+@lru_cache(maxsize=1)
+def get_collection_services() -> CollectionServices:
+    return CollectionServices()
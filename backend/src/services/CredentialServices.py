@@ -1,44 +1,120 @@
+import asyncio
 import json
-from typing import List
+import time
+from functools import lru_cache
+from typing import Dict, List, Tuple
 import uuid6
 
-from repositories.CouchbaseRepository import CouchbaseRepository
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.StorageClientPool import StorageClientPool
 from shared.models.credentials import CreateCredentialsPayload, CouchbaseCredentialModel
 from shared.models.storage import Storage, StorageBucketItem
 from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
 from shared.handlers.FilesHandler import FilesHandler
+from shared.models.env import get_settings
 
 from fastapi import HTTPException, status
 
 
 class CredentialServices:
+    # Process-wide index of the cloud credentials by (storage_type, bucket_name),
+    # rebuilt from a single scan once it is older than CREDENTIALS_CACHE_TTL_SECONDS
+    # or after any credential write in this process (see invalidate_cache)
+    _bucket_index: Dict[Tuple[str, str], CouchbaseCredentialModel] = None
+    _bucket_index_loaded_at: float = 0.0
+    _bucket_index_lock: asyncio.Lock = None
+
+    # credential id -> (encrypted payload, decrypted payload)
+    _decrypted_credentials: Dict[str, Tuple[str, dict]] = {}
+
     def __init__(self, files_handler: FilesHandler = None) -> None:
+        settings = get_settings()
+
         self.filesHandler = files_handler
 
         self.scope = "credentials"
 
-        self.couchbaseRepo = CouchbaseRepository(
+        self.couchbaseRepo = CouchbaseKVRepository(
             scope=self.scope,
         )
 
+        self.cache_ttl_seconds = settings.CREDENTIALS_CACHE_TTL_SECONDS
+
+    @classmethod
+    def invalidate_cache(cls) -> None:
+        cls._bucket_index = None
+        cls._decrypted_credentials = {}
+
+        StorageClientPool.clear()
+
+    def __bucket_index_is_fresh(self) -> bool:
+        return (
+            CredentialServices._bucket_index is not None
+            and time.monotonic() - CredentialServices._bucket_index_loaded_at < self.cache_ttl_seconds
+        )
+
+    async def __load_bucket_index(self) -> Dict[Tuple[str, str], CouchbaseCredentialModel]:
+        if CredentialServices._bucket_index_lock is None:
+            CredentialServices._bucket_index_lock = asyncio.Lock()
+
+        async with CredentialServices._bucket_index_lock:
+            if self.__bucket_index_is_fresh():
+                return CredentialServices._bucket_index
+
+            credentials = await self.list_all_cloud(collection_name="cloud")
+
+            bucket_index = {}
+
+            for credential in credentials:
+                for bucket_name in credential.bucket_names:
+                    # keep the first credential per bucket, as the former linear search did
+                    bucket_index.setdefault((credential.storage_type, bucket_name), credential)
+
+            CredentialServices._bucket_index = bucket_index
+            CredentialServices._bucket_index_loaded_at = time.monotonic()
+
+            return bucket_index
+
+    async def get_by_storage_bucket(self, storage_type: Storage, bucket_name: str) -> CouchbaseCredentialModel:
+        """Returns the credential granting access to a bucket, or None when there is none."""
+        bucket_index = CredentialServices._bucket_index
+
+        if not self.__bucket_index_is_fresh():
+            bucket_index = await self.__load_bucket_index()
+
+        return bucket_index.get((storage_type, bucket_name))
+
+    def decrypt_credential(self, credential: CouchbaseCredentialModel) -> dict:
+        """Returns a copy of the decrypted credential payload, decrypting it once per process."""
+        from shared.handlers.EncryptionHandler import get_encryption_handler
+
+        cached = CredentialServices._decrypted_credentials.get(credential.id)
+
+        if cached and cached[0] == credential.credential:
+            return dict(cached[1])
+
+        decrypted_credential = get_encryption_handler().decrypt_credentials(credential.credential)
+
+        CredentialServices._decrypted_credentials[credential.id] = (credential.credential, decrypted_credential)
+
+        return dict(decrypted_credential)
+
     async def create_credentials(
         self, payload: CreateCredentialsPayload, collection_name: str = "cloud"
     ) -> CouchbaseCredentialModel:
-        from shared.handlers.EncryptionHandler import EncryptionHandler
-        from services.VisasServices import VisaServices
+        from shared.handlers.EncryptionHandler import get_encryption_handler
+        from services.VisasServices import get_visa_services
 
-        encryptationHandler = EncryptionHandler()
+        encryptationHandler = get_encryption_handler()
 
         invalid_ids = list([])
 
-        visaServices = VisaServices()
+        visaServices = get_visa_services()
 
         if payload.visa_uuids:
-            for visa_id in payload.visa_uuids:
-                response = visaServices.get_by_id(visa_uuid=visa_id)
+            requested_visas = await visaServices.get_by_ids(visa_uuids=payload.visa_uuids)
 
-            if not response:
-                invalid_ids.append(visa_id)
+            invalid_ids = [ visa_id for visa_id in payload.visa_uuids if not requested_visas.get(visa_id) ]
         else:
             payload.visa_uuids = []
 
@@ -67,6 +143,8 @@ class CredentialServices:
             ),
         )
 
+        self.invalidate_cache()
+
         return couchbase_credential
 
     async def create_credentials_from_json(
@@ -76,10 +154,10 @@ class CredentialServices:
         bucket_names: List[str],
         visa_uuids: List[str] = None,
     ) -> CouchbaseCredentialModel:
-        from shared.handlers.EncryptionHandler import EncryptionHandler
-        from services.VisasServices import VisaServices
+        from shared.handlers.EncryptionHandler import get_encryption_handler
+        from services.VisasServices import get_visa_services
 
-        encryptationHandler = EncryptionHandler()
+        encryptationHandler = get_encryption_handler()
 
         if not self.filesHandler:
             raise HTTPException(
@@ -106,12 +184,10 @@ class CredentialServices:
         invalid_ids = list([])
 
         if visa_uuids:
-            visaServices = VisaServices()
-            for visa_id in visa_uuids:
-                response = visaServices.get_by_id(visa_uuid=visa_id)
+            visaServices = get_visa_services()
+            requested_visas = await visaServices.get_by_ids(visa_uuids=visa_uuids)
 
-            if not response:
-                invalid_ids.append(visa_id)
+            invalid_ids = [ visa_id for visa_id in visa_uuids if not requested_visas.get(visa_id) ]
         else:
             visa_uuids = []
 
@@ -129,6 +205,8 @@ class CredentialServices:
             ),
         )
 
+        self.invalidate_cache()
+
         return couchbase_credential
 
     async def list_all_cloud(
@@ -174,7 +252,7 @@ class CredentialServices:
             .build()
         )
 
-        response = await self.couchbaseRepo.query(statement=query)
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
 
         if not response:
             return {}
@@ -198,7 +276,7 @@ class CredentialServices:
             .build()
         )
 
-        response = await self.couchbaseRepo.query(statement=query)
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
 
         if not response:
             return {}
@@ -218,11 +296,11 @@ class CredentialServices:
 
         query = (
             queryBuilder.select()
-            .where_intersect(target="id", in_filed="visa_uuids", value=visa_uuids)
+            .where_intersect(target="visa_uuids", in_values=visa_uuids)
             .build()
         )
 
-        response = await self.couchbaseRepo.query(statement=query)
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
 
         if not response:
             return {}
@@ -258,7 +336,7 @@ class CredentialServices:
             .build()
         )
 
-        response = await self.couchbaseRepo.query(statement=query)
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
 
         if not response:
             return []
@@ -289,6 +367,9 @@ class CredentialServices:
         await self.couchbaseRepo.delete_document(
             collection_name=collection_name, document_key=credential_uuid
         )
+
+        self.invalidate_cache()
+
         return credential_uuid
 
     async def revoke_credential_from_visa(
@@ -325,6 +406,8 @@ class CredentialServices:
             value=uploaded_credential.model_dump(exclude_none=True, exclude_unset=True),
         )
 
+        self.invalidate_cache()
+
         return uploaded_credential
 
     async def revoke_credential_from_visa_with_payload(
@@ -354,15 +437,17 @@ class CredentialServices:
             value=uploaded_credential.model_dump(exclude_unset=True, exclude_none=True),
         )
 
+        self.invalidate_cache()
+
         return uploaded_credential
 
     async def grant_credential_to_visa(
         self, credential_uuid: str, visa_uuid: str, collection_name="cloud"
     ) -> CouchbaseCredentialModel:
         # to prevent circular dependencies
-        from services.VisasServices import VisaServices
+        from services.VisasServices import get_visa_services
 
-        visaServices = VisaServices()
+        visaServices = get_visa_services()
 
         passport_visa = await visaServices.get_by_id(visa_uuid=visa_uuid)
 
@@ -393,4 +478,11 @@ class CredentialServices:
             value=new_credential.model_dump(exclude_none=True, exclude_unset=True),
         )
 
+        self.invalidate_cache()
+
         return new_credential
+
+
+@lru_cache(maxsize=1)
+def get_credential_services() -> CredentialServices:
+    return CredentialServices()
@@ -1,111 +1,139 @@
-import boto3
-from google.cloud import storage
 # from hdfs import InsecureClient
 
+from functools import lru_cache
+from typing import AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote
+
+import asyncio
+import base64
+import hashlib
+import logging
+import re
+import uuid6
+from botocore.exceptions import BotoCoreError, ClientError
 from fastapi import HTTPException, status
-import requests
+from google.api_core.exceptions import GoogleAPICallError
+from requests.exceptions import RequestException
 
 
 from starlette.formparsers import MultiPartParser
 
-from services.CatalogServices import CatalogServices
-from services.CredentialServices import CredentialServices
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.StorageClientPool import StorageClientPool
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from services.CatalogServices import CatalogServices, get_catalog_services
+from services.CredentialServices import get_credential_services
 from shared.functions.regex import get_ip_address
-from shared.models.catalog import CatalogFileBaseModel, CatalogFilter
-from shared.models.credentials import AmazonCredentialsModel, CouchbaseCredentialModel
-from shared.models.storage import DownloadFileRequestPayload, DownloadFileRequestResponse, UploadFileRequestPayload, UploadFileRequestResponse
+from shared.models.catalog import CatalogFileBaseModel, CouchbaseCatalogCollectionModel, CouchbaseCatalogFileModel
+from shared.models.credentials import CouchbaseCredentialModel
+from shared.models.env import get_settings
+from shared.models.storage import (
+    CompleteUploadSessionPayload,
+    CreateUploadSessionPayload,
+    DownloadFileBatchRequestPayload,
+    DownloadFileBatchRequestResponse,
+    DownloadFileBatchResponseItem,
+    DownloadFileRequestPayload,
+    DownloadFileRequestResponse,
+    UploadFileBatchRequestPayload,
+    UploadFileBatchRequestResponse,
+    UploadFileBatchResponseItem,
+    UploadFileRequestPayload,
+    UploadFileRequestResponse,
+    UploadSessionModel,
+    UploadSessionPart,
+    UploadSessionResponse
+)
 from shared.handlers.TimeHandler import TimeHandler
 
+logger = logging.getLogger(__name__)
+
 MultiPartParser.max_file_size = 20 * 1024 * 1024  # setting th emax file size to 20 MB
 
+BYTE_RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+SIGNED_URL_EXPIRY_SECONDS = 30 * 60
+
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+GCS_CHUNK_ALIGNMENT = 256 * 1024  # resumable upload chunks, except the last one, are multiples of 256 KiB
+
 
 class FileServices:
+    _proxy_uploads: asyncio.Semaphore = None
 
-    async def __get_credential_by_storage_bucket(self, storage_type: str, bucket_name: str) -> CouchbaseCredentialModel:
-        credentialServices = CredentialServices()
+    def __init__(self) -> None:
+        settings = get_settings()
 
-        credentials = await credentialServices.list_all_cloud(collection_name="cloud")
+        self.scope = "catalogs"
 
-        response_list = [ item for item in credentials if storage_type == item.storage_type and bucket_name in item.bucket_names ]
+        self.couchbaseRepo = CouchbaseKVRepository(
+            scope=self.scope
+        )
 
-        return response_list[0]
+        self.session_part_size = settings.UPLOAD_SESSION_PART_SIZE
+        self.session_expiry_seconds = settings.UPLOAD_SESSION_EXPIRY_SECONDS
 
-    
-    async def create_upload_file_request_directly(
-        self, 
-        payload: UploadFileRequestPayload,
-        user_id: str
-    ) -> UploadFileRequestResponse:
-        """Returns a string containing a hash key for the file upload folder"""
-        from shared.handlers.EncryptionHandler import EncryptionHandler
+        # every proxied upload holds two part buffers, GCS resumable chunks are multiples of 256 KiB
+        self.proxy_part_size = -(-max(settings.STREAM_PROXY_PART_SIZE, S3_MIN_PART_SIZE) // GCS_CHUNK_ALIGNMENT) * GCS_CHUNK_ALIGNMENT
+        self.proxy_chunk_size = settings.STREAM_PROXY_CHUNK_SIZE
+        self.proxy_max_uploads = settings.STREAM_PROXY_MAX_UPLOADS
+
+        self.upload_url_concurrency = settings.UPLOAD_URL_CONCURRENCY
+        self.http_timeout = settings.STORAGE_HTTP_TIMEOUT_SECONDS
+
+    async def __get_credential_by_storage_bucket(self, storage_type: str, bucket_name: str) -> CouchbaseCredentialModel:
+        credentialServices = get_credential_services()
 
-        encryptionHandler = EncryptionHandler()
+        return await credentialServices.get_by_storage_bucket(storage_type=storage_type, bucket_name=bucket_name)
 
-        catalogServices = CatalogServices()
-        
+    def __blob_name(self, collection_name: str, processing_level: str, file_version: int, file_name: str) -> str:
+        return f"lakehouse/collections/{collection_name}/{processing_level}/v{file_version}/{file_name}"
+
+    async def __upload_target(
+        self,
+        catalogServices: CatalogServices,
+        collection_catalog_id: str,
+        user_id: str
+    ) -> Tuple[CouchbaseCatalogCollectionModel, CouchbaseCredentialModel]:
         collection_record = await catalogServices.get_by_id(
-            document_id=payload.collection_catalog_id, 
-            user_id=user_id, 
+            document_id=collection_catalog_id,
+            user_id=user_id,
             collection_name="collections"
         )
 
         if not collection_record:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, 
-                detail=f"Collection catalog id {payload.collection_catalog_id} was not found"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Collection catalog id {collection_catalog_id} was not found"
             )
-        
+
         credential = await self.__get_credential_by_storage_bucket(storage_type=collection_record.storage_type, bucket_name=collection_record.location)
 
         if not credential:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, 
+                status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Missing credentials to operate in the following bucket enviroment {collection_record.location}"
             )
-        
-        #checking for redundant file
-        filters = [
-            CatalogFilter(
-                property_name="collection_id",
-                operator="=",
-                property_value=collection_record.id
-            ),
-            CatalogFilter(
-                property_name="file_name",
-                operator="=",
-                property_value=payload.file_name
-            ),
-            CatalogFilter(
-                property_name="file_category",
-                operator="=",
-                property_value=payload.file_category
-            ),
-            CatalogFilter(
-                property_name="processing_level",
-                operator="=",
-                property_value=payload.processing_level
-            )
-        ]
-
-        catalog_file_items = await catalogServices.get_by_filters(filters=filters, collection_name="files", user_id=user_id)
 
-        latest_version = 1
-
-        if catalog_file_items and catalog_file_items.records:
-            for record in catalog_file_items.records:
-                if record.file_version > latest_version:
-                    latest_version = record.file_version
-            latest_version = latest_version + 1
+        return collection_record, credential
 
+    def __upload_catalog_payload(
+        self,
+        payload: UploadFileRequestPayload,
+        collection_record: CouchbaseCatalogCollectionModel,
+        file_version: int,
+        expiry_seconds: int = SIGNED_URL_EXPIRY_SECONDS
+    ) -> CatalogFileBaseModel:
         timeHandler = TimeHandler()
- 
-        expiry_date = timeHandler.expiry_at(seconds=30*60)
+
+        expiry_date = timeHandler.expiry_at(seconds=expiry_seconds)
 
         expiry_date = int(float(timeHandler.datetime_to_unix_timestamp(date=expiry_date)))
 
         inserted_at = int(float(timeHandler.datetime_to_unix_timestamp(date=timeHandler.utc_now())))
 
-        catalog_payload = CatalogFileBaseModel(
+        return CatalogFileBaseModel(
             collection_id=collection_record.id,
             collection_name=collection_record.collection_name,
             file_name=payload.file_name,
@@ -118,54 +146,41 @@ class FileServices:
             expires_at=expiry_date,
             file_status="uploading",
             file_description=payload.file_description if payload.file_description else None,
-            file_version=payload.file_version if (payload.file_version and payload.file_version > 1 and payload.file_version != latest_version) else latest_version,
+            file_version=file_version,
             file_size=payload.file_size,
             public=payload.public if payload.public else collection_record.public
         )
 
-        catalogRecord = await catalogServices.create_catalog_record(payload=catalog_payload)
-
+    def __upload_url(
+        self,
+        collection_record: CouchbaseCatalogCollectionModel,
+        credential: CouchbaseCredentialModel,
+        decoded_credential: dict,
+        blob_name: str
+    ) -> str:
         upload_url = None
 
-        blob_name = f"lakehouse/collections/{collection_record.collection_name}/raw/v{catalog_payload.file_version}/{catalog_payload.file_name}"
-
-        decoded_credential = encryptionHandler.decrypt_credentials(credential.credential)
-
-        expiry_in = 30 * 60
-
         if collection_record.storage_type == "gcs":
-            storage_client = storage.Client.from_service_account_info(info=decoded_credential)
+            storage_client = StorageClientPool.gcs_client(credential_id=credential.id, decoded_credential=decoded_credential)
             bucket = storage_client.bucket(collection_record.location)
             blob = bucket.blob(blob_name)
 
             upload_url = blob.generate_signed_url(
                 version="v4",
-                expiration=expiry_in,
+                expiration=SIGNED_URL_EXPIRY_SECONDS,
                 method="PUT",
                 content_type="application/octet-stream"
             )
 
-            storage_client.close()
-
         elif collection_record.storage_type == "s3":
-
-            credential = AmazonCredentialsModel(**decoded_credential)
-
-            storage_client = boto3.client(
-                "s3",
-                aws_access_key_id=decoded_credential.get("access_key", ""),
-                aws_secret_access_key=decoded_credential.get("secret_access_key", ""),
-                region_name=decoded_credential.get("region", "")
-            )
+            storage_client = StorageClientPool.s3_client(credential_id=credential.id, decoded_credential=decoded_credential)
 
             upload_url = storage_client.generate_presigned_url(
                 'put_object',
                 Params={'Bucket': collection_record.location, 'Key': blob_name, "ContentType": "application/octet-stream"},
-                ExpiresIn=expiry_in
+                ExpiresIn=SIGNED_URL_EXPIRY_SECONDS
             )
 
-            storage_client.close()
-
         elif collection_record.storage_type == 'hdfs':
 
             overwrite = False
@@ -174,7 +189,7 @@ class FileServices:
 
             if not hdfs_address:
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, 
+                    status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Invalid namenode address"
                 )
 
@@ -182,45 +197,1047 @@ class FileServices:
                 "op": "CREATE",
                 "overwrite": "true" if overwrite else "false"
             }
-            
+
             request_url = f"{hdfs_address}:9870/webhdfs/v1/{blob_name}"
 
-            response = requests.put(request_url, params=params, allow_redirects=False)
+            hdfs_session = StorageClientPool.hdfs_session()
+
+            response = hdfs_session.put(request_url, params=params, allow_redirects=False)
 
             if not response.status_code == 307:
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, 
+                    status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Failed to create upload request: {response.text}"
                 )
-            
+
             params = {
                 "op": "APPEND"
             }
 
-            response = requests.post(request_url, params=params, allow_redirects=False)
+            response = hdfs_session.post(request_url, params=params, allow_redirects=False)
 
             if not response.status_code == 307:
                 raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST, 
+                    status_code=status.HTTP_400_BAD_REQUEST,
                     detail=f"Failed to create upload request: {response.text}"
                 )
-            
+
             upload_url = response.headers["Location"]
 
-        if not upload_url:
-            await catalogServices.delete_catalog_record(document_id=catalogRecord.id, collection_name="files")
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, 
-                detail="Unable to generate upload url"
+        return upload_url
+
+    def __download_url(
+        self,
+        catalog_record: CouchbaseCatalogFileModel,
+        credential: CouchbaseCredentialModel,
+        decoded_credential: dict
+    ) -> str:
+        download_url = None
+
+        blob_name = self.__blob_name(
+            collection_name=catalog_record.collection_name,
+            processing_level=catalog_record.processing_level,
+            file_version=catalog_record.file_version,
+            file_name=catalog_record.file_name
+        )
+
+        if catalog_record.storage_type == "gcs":
+            storage_client = StorageClientPool.gcs_client(credential_id=credential.id, decoded_credential=decoded_credential)
+            bucket = storage_client.bucket(catalog_record.file_location)
+
+            blob = bucket.blob(blob_name)
+
+            download_url = blob.generate_signed_url(
+                version="v4",
+                expiration=SIGNED_URL_EXPIRY_SECONDS,
+                method="GET"
+            )
+
+
+        elif catalog_record.storage_type == "s3":
+            storage_client = StorageClientPool.s3_client(credential_id=credential.id, decoded_credential=decoded_credential)
+            download_url = storage_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': catalog_record.file_location, 'Key': blob_name},
+                ExpiresIn=SIGNED_URL_EXPIRY_SECONDS
+            )
+
+        elif catalog_record.storage_type == 'hdfs':
+            download_url=f"{catalog_record.file_location}/webhdfs/v1/{blob_name}?op=OPEN"
+
+        return download_url
+
+
+    def __delete_hdfs_files(self, location: str, blob_names: List[str]) -> List[str]:
+        """Removes files created by WebHDFS upload requests. Returns the blob names that could not be removed."""
+        hdfs_session = StorageClientPool.hdfs_session()
+
+        remaining = []
+
+        for blob_name in blob_names:
+            try:
+                # missing files are answered with {"boolean": false}
+                response = hdfs_session.delete(self.__webhdfs_url(location, blob_name), params={"op": "DELETE"})
+                response.raise_for_status()
+            except Exception as e:
+                logger.warning(f"Unable to remove the HDFS file {blob_name}: {e}")
+                remaining.append(blob_name)
+
+        return remaining
+
+    async def __discard_uploads(self, collection_record: CouchbaseCatalogCollectionModel, catalog_records: List[CouchbaseCatalogFileModel]) -> None:
+        """Removes the records of upload requests that failed, and the empty files WebHDFS created for them."""
+        if collection_record.storage_type == "hdfs":
+            blob_names = [
+                self.__blob_name(
+                    collection_name=record.collection_name,
+                    processing_level=record.processing_level,
+                    file_version=record.file_version,
+                    file_name=record.file_name
+                )
+                for record in catalog_records
+            ]
+
+            remaining = await BlockingIOHandler.run(self.__delete_hdfs_files, collection_record.location, blob_names)
+
+            if remaining:
+                logger.warning(f"Empty HDFS files left in {collection_record.location}: {remaining}")
+
+        result = await self.couchbaseRepo.delete_many(collection_name="files", document_keys=[record.id for record in catalog_records])
+
+        if result.failed:
+            # still uploading, removed by the expired uploads sweeper
+            logger.warning(f"Unable to remove the records of failed upload requests: {result.failed}")
+
+    async def create_upload_file_request_directly(
+        self,
+        payload: UploadFileRequestPayload,
+        user_id: str
+    ) -> UploadFileRequestResponse:
+        """Returns a string containing a hash key for the file upload folder"""
+        catalogServices = get_catalog_services()
+
+        collection_record, credential = await self.__upload_target(
+            catalogServices=catalogServices,
+            collection_catalog_id=payload.collection_catalog_id,
+            user_id=user_id
+        )
+
+        # next version of the file, allocated atomically
+        [file_version] = await catalogServices.allocate_file_versions(
+            collection_id=collection_record.id,
+            files=[(payload.file_name, payload.file_category, payload.processing_level, payload.file_version)]
+        )
+
+        catalog_payload = self.__upload_catalog_payload(payload=payload, collection_record=collection_record, file_version=file_version)
+
+        catalogRecord = await catalogServices.create_catalog_record(payload=catalog_payload)
+
+        blob_name = self.__blob_name(
+            collection_name=collection_record.collection_name,
+            processing_level=catalog_payload.processing_level,
+            file_version=catalog_payload.file_version,
+            file_name=catalog_payload.file_name
+        )
+
+        decoded_credential = get_credential_services().decrypt_credential(credential)
+
+        try:
+            # client creation, signing and the WebHDFS round trips are blocking
+            upload_url = await BlockingIOHandler.run(
+                self.__upload_url,
+                collection_record=collection_record,
+                credential=credential,
+                decoded_credential=decoded_credential,
+                blob_name=blob_name
             )
 
+            if not upload_url:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Unable to generate upload url"
+                )
+        except Exception:
+            await self.__discard_uploads(collection_record=collection_record, catalog_records=[catalogRecord])
+            raise
+
         return UploadFileRequestResponse(
             upload_url=upload_url,
             method="POST" if collection_record.storage_type == 'hdfs' else "PUT",
             catalog_record_id=catalogRecord.id
         )
 
-   
+    async def create_upload_file_requests_batch(
+        self,
+        payload: UploadFileBatchRequestPayload,
+        user_id: str
+    ) -> UploadFileBatchRequestResponse:
+        """Returns the signed upload urls of several files of the same collection, in request order"""
+        catalogServices = get_catalog_services()
+
+        collection_record, credential = await self.__upload_target(
+            catalogServices=catalogServices,
+            collection_catalog_id=payload.collection_catalog_id,
+            user_id=user_id
+        )
+
+        file_payloads = [ UploadFileRequestPayload(collection_catalog_id=collection_record.id, **item.model_dump()) for item in payload.files ]
+
+        # repeated files in the same batch get consecutive versions
+        file_versions = await catalogServices.allocate_file_versions(
+            collection_id=collection_record.id,
+            files=[
+                (file_payload.file_name, file_payload.file_category, file_payload.processing_level, file_payload.file_version)
+                for file_payload in file_payloads
+            ]
+        )
+
+        decoded_credential = get_credential_services().decrypt_credential(credential)
+
+        catalog_payloads = [
+            self.__upload_catalog_payload(payload=file_payload, collection_record=collection_record, file_version=file_version)
+            for file_payload, file_version in zip(file_payloads, file_versions)
+        ]
+
+        # the records are written first ("uploading", expiring with the urls), so every storage side effect has its record
+        catalog_records = await catalogServices.create_catalog_records(payloads=catalog_payloads, collection_name="files")
+
+        semaphore = asyncio.Semaphore(self.upload_url_concurrency)
+
+        async def sign(record: CouchbaseCatalogFileModel) -> str:
+            blob_name = self.__blob_name(
+                collection_name=record.collection_name,
+                processing_level=record.processing_level,
+                file_version=record.file_version,
+                file_name=record.file_name
+            )
+
+            async with semaphore:
+                upload_url = await BlockingIOHandler.run(
+                    self.__upload_url,
+                    collection_record=collection_record,
+                    credential=credential,
+                    decoded_credential=decoded_credential,
+                    blob_name=blob_name
+                )
+
+            if not upload_url:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Unable to generate upload url for {record.file_name}"
+                )
+
+            return upload_url
+
+        outcomes = await asyncio.gather(*[sign(record) for record in catalog_records], return_exceptions=True)
+
+        errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+
+        if errors:
+            await self.__discard_uploads(collection_record=collection_record, catalog_records=catalog_records)
+            raise errors[0]
+
+        upload_urls: List[str] = outcomes
+
+        method = "POST" if collection_record.storage_type == 'hdfs' else "PUT"
+
+        return UploadFileBatchRequestResponse(
+            files=[
+                UploadFileBatchResponseItem(
+                    upload_url=upload_url,
+                    method=method,
+                    catalog_record_id=record.id,
+                    file_name=record.file_name,
+                    file_version=record.file_version
+                )
+                for record, upload_url in zip(catalog_records, upload_urls)
+            ]
+        )
+
+
+    def __session_part_size(self, storage_type: str, file_size: int, requested_part_size: int = None) -> int:
+        part_size = requested_part_size if requested_part_size else self.session_part_size
+
+        if storage_type == "s3":
+            part_size = max(part_size, S3_MIN_PART_SIZE, -(-file_size // S3_MAX_PARTS))
+
+        elif storage_type == "gcs":
+            part_size = -(-part_size // GCS_CHUNK_ALIGNMENT) * GCS_CHUNK_ALIGNMENT
+
+        return min(part_size, file_size)
+
+    def __session_storage_client(self, storage_type: str, credential: CouchbaseCredentialModel, decoded_credential: dict):
+        if storage_type == "s3":
+            return StorageClientPool.s3_client(credential_id=credential.id, decoded_credential=decoded_credential)
+
+        if storage_type == "gcs":
+            return StorageClientPool.gcs_client(credential_id=credential.id, decoded_credential=decoded_credential)
+
+        return StorageClientPool.hdfs_session()
+
+    def __webhdfs_url(self, location: str, blob_name: str) -> str:
+        hdfs_address = get_ip_address(location)
+
+        if not hdfs_address:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid namenode address"
+            )
+
+        return f"{hdfs_address}:9870/webhdfs/v1/{blob_name}"
+
+    def __open_upload_session(self, storage_client, collection_record: CouchbaseCatalogCollectionModel, blob_name: str, file_size: int) -> dict:
+        """Starts the upload on the storage side. Returns the S3 upload id or the url the parts are sent to."""
+        if collection_record.storage_type == "s3":
+            response = storage_client.create_multipart_upload(
+                Bucket=collection_record.location, Key=blob_name, ContentType="application/octet-stream"
+            )
+
+            return dict(upload_id=response["UploadId"])
+
+        if collection_record.storage_type == "gcs":
+            blob = storage_client.bucket(collection_record.location).blob(blob_name)
+
+            session_url = blob.create_resumable_upload_session(content_type="application/octet-stream", size=file_size)
+
+            return dict(session_url=session_url)
+
+        request_url = self.__webhdfs_url(location=collection_record.location, blob_name=blob_name)
+
+        # the file is created empty, every part is then appended to it
+        response = storage_client.put(request_url, params={"op": "CREATE", "overwrite": "false"}, allow_redirects=False)
+
+        if not response.status_code == 307:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create upload session: {response.text}")
+
+        response = storage_client.put(response.headers["Location"], data=b"")
+
+        if not response.status_code == 201:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create upload session: {response.text}")
+
+        response = storage_client.post(request_url, params={"op": "APPEND"}, allow_redirects=False)
+
+        if not response.status_code == 307:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create upload session: {response.text}")
+
+        return dict(session_url=response.headers["Location"])
+
+    def __session_progress(self, storage_client, session: UploadSessionModel) -> Tuple[int, Dict[int, str]]:
+        """Bytes already stored and, for S3, the ETag of each uploaded part."""
+        if session.storage_type == "s3":
+            uploaded_parts = {}
+
+            paginator = storage_client.get_paginator("list_parts")
+
+            for page in paginator.paginate(Bucket=session.location, Key=session.blob_name, UploadId=session.upload_id):
+                for part in page.get("Parts", []):
+                    uploaded_parts[part["PartNumber"]] = part["ETag"]
+
+            uploaded_bytes = sum(
+                min(session.part_size, session.file_size - (part_number - 1) * session.part_size)
+                for part_number in uploaded_parts
+            )
+
+            return uploaded_bytes, uploaded_parts
+
+        if session.storage_type == "gcs":
+            response = StorageClientPool.http_session().put(
+                session.session_url, headers={"Content-Range": f"bytes */{session.file_size}"}, timeout=self.http_timeout
+            )
+
+            if response.status_code in [200, 201]:
+                return session.file_size, {}
+
+            if not response.status_code == 308:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to query upload session: {response.text}")
+
+            # "bytes=0-<last byte stored>", missing when nothing was stored yet
+            stored_range = response.headers.get("Range")
+
+            return (int(stored_range.split("-")[1]) + 1 if stored_range else 0), {}
+
+        request_url = self.__webhdfs_url(location=session.location, blob_name=session.blob_name)
+
+        response = storage_client.get(request_url, params={"op": "GETFILESTATUS"})
+
+        if not response.status_code == 200:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to query upload session: {response.text}")
+
+        return response.json()["FileStatus"]["length"], {}
+
+    def __session_parts(self, storage_client, session: UploadSessionModel, uploaded_bytes: int, uploaded_parts: Dict[int, str]) -> List[UploadSessionPart]:
+        parts = []
+
+        for part_number in range(1, session.part_count + 1):
+            offset = (part_number - 1) * session.part_size
+            size = min(session.part_size, session.file_size - offset)
+
+            if session.storage_type == "s3":
+                uploaded = part_number in uploaded_parts
+
+                upload_url = None if uploaded else storage_client.generate_presigned_url(
+                    'upload_part',
+                    Params={'Bucket': session.location, 'Key': session.blob_name, 'UploadId': session.upload_id, 'PartNumber': part_number},
+                    ExpiresIn=SIGNED_URL_EXPIRY_SECONDS
+                )
+                method = "PUT"
+
+            else:
+                # a single url, parts are sent in order (GCS with a Content-Range header)
+                uploaded = offset + size <= uploaded_bytes
+                upload_url = session.session_url
+                method = "PUT" if session.storage_type == "gcs" else "POST"
+
+            parts.append(
+                UploadSessionPart(
+                    part_number=part_number,
+                    offset=offset,
+                    size=size,
+                    upload_url=upload_url,
+                    method=method,
+                    uploaded=uploaded
+                )
+            )
+
+        return parts
+
+    def __complete_upload(self, storage_client, session: UploadSessionModel, completed_parts: Dict[int, str]) -> Tuple[int, Optional[str]]:
+        """Finishes the upload on the storage side. Returns the stored size and checksum."""
+        if session.storage_type == "s3":
+            if not completed_parts:
+                _, completed_parts = self.__session_progress(storage_client, session)
+
+            missing_parts = [ part_number for part_number in range(1, session.part_count + 1) if part_number not in completed_parts ]
+
+            if missing_parts:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Missing uploaded parts: {missing_parts}")
+
+            storage_client.complete_multipart_upload(
+                Bucket=session.location,
+                Key=session.blob_name,
+                UploadId=session.upload_id,
+                MultipartUpload={"Parts": [ {"ETag": etag, "PartNumber": part_number} for part_number, etag in sorted(completed_parts.items()) ]}
+            )
+
+            response = storage_client.head_object(Bucket=session.location, Key=session.blob_name)
+
+            etag = response["ETag"].strip('"')
+
+            return response["ContentLength"], f"etag:{etag}"
+
+        if session.storage_type == "gcs":
+            blob = storage_client.bucket(session.location).get_blob(session.blob_name)
+
+            if not blob:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="The upload is not finished")
+
+            file_checksum = f"md5:{base64.b64decode(blob.md5_hash).hex()}" if blob.md5_hash else None
+
+            return blob.size, file_checksum
+
+        uploaded_bytes, _ = self.__session_progress(storage_client, session)
+
+        if uploaded_bytes < session.file_size:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"The upload is not finished, {uploaded_bytes} of {session.file_size} bytes stored")
+
+        return uploaded_bytes, None
+
+    def __abort_upload(self, storage_client, session: UploadSessionModel) -> None:
+        if session.storage_type == "s3":
+            storage_client.abort_multipart_upload(Bucket=session.location, Key=session.blob_name, UploadId=session.upload_id)
+
+        elif session.storage_type == "gcs":
+            # a cancelled session answers 499
+            StorageClientPool.http_session().delete(session.session_url, timeout=self.http_timeout)
+
+        else:
+            storage_client.delete(self.__webhdfs_url(location=session.location, blob_name=session.blob_name), params={"op": "DELETE"})
+
+    async def __session_storage(self, storage_type: str, location: str, credential: CouchbaseCredentialModel = None):
+        if not credential:
+            credential = await self.__get_credential_by_storage_bucket(storage_type=storage_type, bucket_name=location)
+
+        if not credential and storage_type != "hdfs":
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Missing credentials to operate in the following bucket enviroment {location}"
+            )
+
+        decoded_credential = get_credential_services().decrypt_credential(credential) if credential else {}
+
+        return await BlockingIOHandler.run(
+            self.__session_storage_client, storage_type=storage_type, credential=credential, decoded_credential=decoded_credential
+        )
+
+    async def __get_upload_session(self, session_id: str, user_id: str) -> UploadSessionModel:
+        response = await self.couchbaseRepo.get_document_by_id(collection_name="upload_sessions", document_key=session_id)
+
+        if not response:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Upload session {session_id} not found")
+
+        session = UploadSessionModel(**response[0]["upload_sessions"])
+
+        if session.user_id != user_id:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Access denied: only the uploader can use this upload session")
+
+        return session
+
+    async def __save_upload_session(self, session: UploadSessionModel) -> UploadSessionModel:
+        await self.couchbaseRepo.upsert_document(
+            collection_name="upload_sessions",
+            key=session.id,
+            value=session.model_dump(exclude_none=True)
+        )
+
+        return session
+
+    def __session_response(self, session: UploadSessionModel, uploaded_bytes: int = 0, parts: List[UploadSessionPart] = None) -> UploadSessionResponse:
+        return UploadSessionResponse(
+            session_id=session.id,
+            catalog_record_id=session.catalog_record_id,
+            storage_type=session.storage_type,
+            status=session.status,
+            file_size=session.file_size,
+            part_size=session.part_size,
+            parallel=session.storage_type == "s3",
+            uploaded_bytes=uploaded_bytes,
+            parts=parts if parts else [],
+            expires_at=session.expires_at
+        )
+
+    async def create_upload_session(
+        self,
+        payload: CreateUploadSessionPayload,
+        user_id: str
+    ) -> UploadSessionResponse:
+        """
+        Opens a multipart upload (S3), a resumable session (GCS) or an empty file to append to (WebHDFS) and
+        returns one upload url per part. S3 parts can be uploaded concurrently, the others in order. The file
+        record stays uploading until complete_upload_session.
+        """
+        catalogServices = get_catalog_services()
+
+        collection_record, credential = await self.__upload_target(
+            catalogServices=catalogServices,
+            collection_catalog_id=payload.collection_catalog_id,
+            user_id=user_id
+        )
+
+        [file_version] = await catalogServices.allocate_file_versions(
+            collection_id=collection_record.id,
+            files=[(payload.file_name, payload.file_category, payload.processing_level, payload.file_version)]
+        )
+
+        # large uploads outlive the signed urls, the record expires with the session
+        catalog_payload = self.__upload_catalog_payload(
+            payload=payload, collection_record=collection_record, file_version=file_version, expiry_seconds=self.session_expiry_seconds
+        )
+
+        blob_name = self.__blob_name(
+            collection_name=collection_record.collection_name,
+            processing_level=catalog_payload.processing_level,
+            file_version=catalog_payload.file_version,
+            file_name=catalog_payload.file_name
+        )
+
+        storage_client = await self.__session_storage(
+            storage_type=collection_record.storage_type, location=collection_record.location, credential=credential
+        )
+
+        try:
+            opened = await BlockingIOHandler.run(
+                self.__open_upload_session,
+                storage_client=storage_client,
+                collection_record=collection_record,
+                blob_name=blob_name,
+                file_size=payload.file_size
+            )
+        except (BotoCoreError, ClientError, GoogleAPICallError, RequestException) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create upload session: {e}")
+
+        catalogRecord = await catalogServices.create_catalog_record(payload=catalog_payload)
+
+        part_size = self.__session_part_size(
+            storage_type=collection_record.storage_type, file_size=payload.file_size, requested_part_size=payload.part_size
+        )
+
+        session = await self.__save_upload_session(
+            UploadSessionModel(
+                id=str(uuid6.uuid7()),
+                catalog_record_id=catalogRecord.id,
+                user_id=user_id,
+                storage_type=collection_record.storage_type,
+                location=collection_record.location,
+                blob_name=blob_name,
+                file_size=payload.file_size,
+                part_size=part_size,
+                part_count=-(-payload.file_size // part_size),
+                created_at=catalog_payload.inserted_at,
+                expires_at=catalog_payload.expires_at,
+                **opened
+            )
+        )
+
+        parts = await BlockingIOHandler.run(
+            self.__session_parts, storage_client=storage_client, session=session, uploaded_bytes=0, uploaded_parts={}
+        )
+
+        return self.__session_response(session=session, parts=parts)
+
+    async def get_upload_session(self, session_id: str, user_id: str) -> UploadSessionResponse:
+        """Stored progress of an upload session, with fresh upload urls for the parts left, to resume it."""
+        session = await self.__get_upload_session(session_id=session_id, user_id=user_id)
+
+        if session.status != "open":
+            return self.__session_response(session=session)
+
+        storage_client = await self.__session_storage(storage_type=session.storage_type, location=session.location)
+
+        try:
+            uploaded_bytes, uploaded_parts = await BlockingIOHandler.run(self.__session_progress, storage_client, session)
+
+            parts = await BlockingIOHandler.run(
+                self.__session_parts, storage_client=storage_client, session=session, uploaded_bytes=uploaded_bytes, uploaded_parts=uploaded_parts
+            )
+        except (BotoCoreError, ClientError, GoogleAPICallError, RequestException) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to query upload session: {e}")
+
+        return self.__session_response(session=session, uploaded_bytes=uploaded_bytes, parts=parts)
+
+    async def complete_upload_session(
+        self,
+        session_id: str,
+        payload: CompleteUploadSessionPayload,
+        user_id: str
+    ) -> CouchbaseCatalogFileModel:
+        """Assembles the uploaded parts and sets the file record to ready with the stored size and checksum."""
+        session = await self.__get_upload_session(session_id=session_id, user_id=user_id)
+
+        if session.status != "open":
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Upload session {session_id} is already {session.status}")
+
+        storage_client = await self.__session_storage(storage_type=session.storage_type, location=session.location)
+
+        completed_parts = { part.part_number: part.etag for part in payload.parts } if payload and payload.parts else {}
+
+        try:
+            file_size, file_checksum = await BlockingIOHandler.run(self.__complete_upload, storage_client, session, completed_parts)
+        except (BotoCoreError, ClientError, GoogleAPICallError, RequestException) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to complete upload session: {e}")
+
+        file_record = await get_catalog_services().set_file_uploaded(
+            document_id=session.catalog_record_id, file_size=file_size, file_checksum=file_checksum
+        )
+
+        session.status = "completed"
+
+        await self.__save_upload_session(session)
+
+        return file_record
+
+    async def abort_upload_session(self, session_id: str, user_id: str) -> UploadSessionResponse:
+        """Drops the uploaded parts and the file record of an open upload session."""
+        session = await self.__get_upload_session(session_id=session_id, user_id=user_id)
+
+        if session.status != "open":
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Upload session {session_id} is already {session.status}")
+
+        storage_client = await self.__session_storage(storage_type=session.storage_type, location=session.location)
+
+        try:
+            await BlockingIOHandler.run(self.__abort_upload, storage_client, session)
+        except (BotoCoreError, ClientError, GoogleAPICallError, RequestException) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to abort upload session: {e}")
+
+        await get_catalog_services().delete_catalog_record(document_id=session.catalog_record_id, collection_name="files")
+
+        session.status = "aborted"
+
+        await self.__save_upload_session(session)
+
+        return self.__session_response(session=session)
+
+
+    def __proxy_upload_start(self, storage_client, storage_type: str, location: str, blob_name: str) -> dict:
+        """Opens the object on the storage side. Returns the state the parts are written with."""
+        if storage_type == "s3":
+            response = storage_client.create_multipart_upload(Bucket=location, Key=blob_name, ContentType="application/octet-stream")
+
+            return dict(upload_id=response["UploadId"], parts=[])
+
+        if storage_type == "gcs":
+            blob = storage_client.bucket(location).blob(blob_name)
+
+            # resumable upload, one request per chunk
+            return dict(writer=blob.open("wb", chunk_size=self.proxy_part_size, content_type="application/octet-stream"))
+
+        request_url = self.__webhdfs_url(location=location, blob_name=blob_name)
+
+        response = storage_client.put(request_url, params={"op": "CREATE", "overwrite": "false"}, allow_redirects=False)
+
+        if not response.status_code == 307:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create file: {response.text}")
+
+        response = storage_client.put(response.headers["Location"], data=b"")
+
+        if not response.status_code == 201:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create file: {response.text}")
+
+        return dict(request_url=request_url)
+
+    def __proxy_upload_part(self, storage_client, storage_type: str, location: str, blob_name: str, state: dict, part_number: int, data: bytearray) -> None:
+        if storage_type == "s3":
+            response = storage_client.upload_part(
+                Bucket=location, Key=blob_name, UploadId=state["upload_id"], PartNumber=part_number, Body=data
+            )
+
+            state["parts"].append({"ETag": response["ETag"], "PartNumber": part_number})
+
+        elif storage_type == "gcs":
+            state["writer"].write(data)
+
+        else:
+            response = storage_client.post(state["request_url"], params={"op": "APPEND"}, allow_redirects=False)
+
+            if not response.status_code == 307:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to append to file: {response.text}")
+
+            # buffers are sent as they are, without a copy
+            response = storage_client.post(response.headers["Location"], data=data)
+
+            if not response.status_code == 200:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to append to file: {response.text}")
+
+    def __proxy_upload_finish(self, storage_client, storage_type: str, location: str, blob_name: str, state: dict) -> None:
+        if storage_type == "s3":
+            storage_client.complete_multipart_upload(
+                Bucket=location, Key=blob_name, UploadId=state["upload_id"], MultipartUpload={"Parts": state["parts"]}
+            )
+
+        elif storage_type == "gcs":
+            state["writer"].close()
+
+    def __proxy_upload_abort(self, storage_client, storage_type: str, location: str, blob_name: str, state: dict) -> None:
+        if storage_type == "s3":
+            storage_client.abort_multipart_upload(Bucket=location, Key=blob_name, UploadId=state["upload_id"])
+
+        elif storage_type == "hdfs":
+            storage_client.delete(state["request_url"], params={"op": "DELETE"})
+
+        # an unfinished GCS resumable upload is dropped by the storage after a week
+
+    def __proxy_upload_slot(self) -> asyncio.Semaphore:
+        cls = FileServices
+
+        if cls._proxy_uploads is None:
+            cls._proxy_uploads = asyncio.Semaphore(self.proxy_max_uploads)
+
+        return cls._proxy_uploads
+
+    async def __stream_to_storage(self, storage_client, storage_type: str, location: str, blob_name: str, stream: AsyncIterator[bytes]) -> Tuple[int, str]:
+        """
+        Writes a request body to the storage in parts of proxy_part_size. A part is sent while the next one is
+        read into a second buffer; the body is not read further until the previous part is stored. Returns the
+        size and the md5 checksum of the file.
+        """
+        state = await BlockingIOHandler.run(self.__proxy_upload_start, storage_client, storage_type, location, blob_name)
+
+        buffers = [bytearray(self.proxy_part_size), bytearray(self.proxy_part_size)]
+
+        md5 = hashlib.md5()
+        file_size = 0
+        part_number = 0
+        filled = 0
+        sending: asyncio.Future = None
+
+        buffer = buffers[0]
+        view = memoryview(buffer)
+
+        async def send_part(part_number: int, data: bytearray) -> asyncio.Future:
+            if sending:
+                await sending
+
+            return asyncio.ensure_future(
+                BlockingIOHandler.run(self.__proxy_upload_part, storage_client, storage_type, location, blob_name, state, part_number, data)
+            )
+
+        try:
+            async for chunk in stream:
+                md5.update(chunk)
+                file_size += len(chunk)
+
+                chunk_view = memoryview(chunk)
+
+                while chunk_view:
+                    size = min(len(chunk_view), self.proxy_part_size - filled)
+
+                    view[filled:filled + size] = chunk_view[:size]
+                    chunk_view = chunk_view[size:]
+                    filled += size
+
+                    if filled == self.proxy_part_size:
+                        part_number += 1
+                        sending = await send_part(part_number, buffer)
+
+                        view.release()
+                        buffer = buffers[part_number % 2]
+                        view = memoryview(buffer)
+                        filled = 0
+
+            # the last part is shorter, the buffer is cut down in place
+            if filled or not part_number:
+                view.release()
+                del buffer[filled:]
+
+                part_number += 1
+                sending = await send_part(part_number, buffer)
+
+            await sending
+
+            await BlockingIOHandler.run(self.__proxy_upload_finish, storage_client, storage_type, location, blob_name, state)
+
+        except BaseException:
+            if sending:
+                await asyncio.gather(sending, return_exceptions=True)
+
+            try:
+                await BlockingIOHandler.run(self.__proxy_upload_abort, storage_client, storage_type, location, blob_name, state)
+            except Exception:
+                pass
+
+            raise
+
+        return file_size, f"md5:{md5.hexdigest()}"
+
+    async def proxy_upload(
+        self,
+        payload: UploadFileRequestPayload,
+        stream: AsyncIterator[bytes],
+        user_id: str
+    ) -> CouchbaseCatalogFileModel:
+        """
+        Uploads a request body through the API, for clients that cannot reach the storage. The body is piped to
+        the storage as it arrives (S3 multipart upload, GCS resumable upload, WebHDFS appends) with at most two
+        parts in memory; at most STREAM_PROXY_MAX_UPLOADS uploads run at the same time, the others wait.
+        """
+        catalogServices = get_catalog_services()
+
+        collection_record, credential = await self.__upload_target(
+            catalogServices=catalogServices,
+            collection_catalog_id=payload.collection_catalog_id,
+            user_id=user_id
+        )
+
+        [file_version] = await catalogServices.allocate_file_versions(
+            collection_id=collection_record.id,
+            files=[(payload.file_name, payload.file_category, payload.processing_level, payload.file_version)]
+        )
+
+        catalog_payload = self.__upload_catalog_payload(
+            payload=payload, collection_record=collection_record, file_version=file_version, expiry_seconds=self.session_expiry_seconds
+        )
+
+        blob_name = self.__blob_name(
+            collection_name=collection_record.collection_name,
+            processing_level=catalog_payload.processing_level,
+            file_version=catalog_payload.file_version,
+            file_name=catalog_payload.file_name
+        )
+
+        storage_client = await self.__session_storage(
+            storage_type=collection_record.storage_type, location=collection_record.location, credential=credential
+        )
+
+        catalogRecord = await catalogServices.create_catalog_record(payload=catalog_payload)
+
+        try:
+            async with self.__proxy_upload_slot():
+                file_size, file_checksum = await self.__stream_to_storage(
+                    storage_client=storage_client,
+                    storage_type=collection_record.storage_type,
+                    location=collection_record.location,
+                    blob_name=blob_name,
+                    stream=stream
+                )
+
+        except (BotoCoreError, ClientError, GoogleAPICallError, RequestException) as e:
+            await catalogServices.delete_catalog_record(document_id=catalogRecord.id, collection_name="files")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to upload file: {e}")
+
+        except BaseException:
+            await catalogServices.delete_catalog_record(document_id=catalogRecord.id, collection_name="files")
+            raise
+
+        return await catalogServices.set_file_uploaded(document_id=catalogRecord.id, file_size=file_size, file_checksum=file_checksum)
+
+    def __byte_range(self, range_header: str, file_size: int) -> Optional[Tuple[int, int]]:
+        """First and last byte of a single "bytes=" range. Other ranges are ignored, the whole file is sent."""
+        match = BYTE_RANGE_PATTERN.match(range_header.strip()) if range_header else None
+
+        if not match or not any(match.groups()):
+            return None
+
+        first, last = match.groups()
+
+        if first:
+            start, end = int(first), int(last) if last else file_size - 1
+        else:
+            start, end = max(file_size - int(last), 0), file_size - 1
+
+        end = min(end, file_size - 1)
+
+        if start > end:
+            raise HTTPException(
+                status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                detail=f"Range not satisfiable: {range_header}",
+                headers={"Content-Range": f"bytes */{file_size}"}
+            )
+
+        return start, end
+
+    def __proxy_object_size(self, storage_client, storage_type: str, location: str, blob_name: str) -> int:
+        if storage_type == "s3":
+            try:
+                return storage_client.head_object(Bucket=location, Key=blob_name)["ContentLength"]
+            except ClientError as e:
+                if e.response["Error"]["Code"] in ["404", "NoSuchKey", "NotFound"]:
+                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found in the storage")
+                raise
+
+        if storage_type == "gcs":
+            blob = storage_client.bucket(location).get_blob(blob_name)
+
+            if not blob:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found in the storage")
+
+            return blob.size
+
+        response = storage_client.get(self.__webhdfs_url(location=location, blob_name=blob_name), params={"op": "GETFILESTATUS"})
+
+        if response.status_code == 404:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="File not found in the storage")
+
+        if not response.status_code == 200:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to read file: {response.text}")
+
+        return response.json()["FileStatus"]["length"]
+
+    def __proxy_download_chunks(self, storage_client, storage_type: str, location: str, blob_name: str, start: int, end: int) -> Iterator[bytes]:
+        """Blocking iterator over the bytes start to end (inclusive) of an object, proxy_chunk_size at a time."""
+        if storage_type == "s3":
+            response = storage_client.get_object(Bucket=location, Key=blob_name, Range=f"bytes={start}-{end}")
+
+            return response["Body"].iter_chunks(chunk_size=self.proxy_chunk_size)
+
+        if storage_type == "gcs":
+            return self.__gcs_chunks(storage_client.bucket(location).blob(blob_name), start, end)
+
+        response = storage_client.get(
+            self.__webhdfs_url(location=location, blob_name=blob_name),
+            params={"op": "OPEN", "offset": start, "length": end - start + 1},
+            stream=True
+        )
+
+        if not response.status_code == 200:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to read file: {response.text}")
+
+        return response.iter_content(chunk_size=self.proxy_chunk_size)
+
+    def __gcs_chunks(self, blob, start: int, end: int) -> Iterator[bytes]:
+        # ranged reads of proxy_part_size, handed out proxy_chunk_size at a time
+        with blob.open("rb", chunk_size=self.proxy_part_size) as reader:
+            reader.seek(start)
+
+            remaining = end - start + 1
+
+            while remaining > 0:
+                chunk = reader.read(min(self.proxy_chunk_size, remaining))
+
+                if not chunk:
+                    break
+
+                remaining -= len(chunk)
+
+                yield chunk
+
+    async def __stream_from_storage(self, open_chunks: Callable[[], Iterator[bytes]]) -> AsyncIterator[bytes]:
+        # the next chunk is only read once the client took the previous one
+        chunks = await BlockingIOHandler.run(open_chunks)
+
+        try:
+            while True:
+                chunk = await BlockingIOHandler.run(next, chunks, None)
+
+                if chunk is None:
+                    break
+
+                if chunk:
+                    yield chunk
+        finally:
+            close = getattr(chunks, "close", None)
+
+            if close:
+                await BlockingIOHandler.run(close)
+
+    async def proxy_download(
+        self,
+        catalog_file_id: str,
+        user_id: str,
+        range_header: str = None
+    ) -> Tuple[int, Dict[str, str], AsyncIterator[bytes]]:
+        """
+        Streams a file from the storage through the API, a chunk of STREAM_PROXY_CHUNK_SIZE at a time, with
+        single "bytes=" range requests. Returns the status code (200 or 206), the headers and the body.
+        """
+        catalogServices = get_catalog_services()
+
+        catalog_record = await catalogServices.get_by_id(document_id=catalog_file_id, user_id=user_id)
+
+        if not catalog_record:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Catalog record does not exist or invalid record id!"
+            )
+
+        blob_name = self.__blob_name(
+            collection_name=catalog_record.collection_name,
+            processing_level=catalog_record.processing_level,
+            file_version=catalog_record.file_version,
+            file_name=catalog_record.file_name
+        )
+
+        storage_type, location = catalog_record.storage_type, catalog_record.file_location
+
+        storage_client = await self.__session_storage(storage_type=storage_type, location=location)
+
+        try:
+            file_size = await BlockingIOHandler.run(self.__proxy_object_size, storage_client, storage_type, location, blob_name)
+        except (BotoCoreError, ClientError, GoogleAPICallError, RequestException) as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to read file: {e}")
+
+        byte_range = self.__byte_range(range_header=range_header, file_size=file_size)
+
+        start, end = byte_range if byte_range else (0, file_size - 1)
+
+        headers = {
+            "Accept-Ranges": "bytes",
+            "Content-Length": str(end - start + 1 if file_size else 0),
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(catalog_record.file_name)}",
+        }
+
+        if byte_range:
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+
+        if not file_size:
+            return status.HTTP_200_OK, headers, self.__stream_from_storage(lambda: iter([]))
+
+        body = self.__stream_from_storage(
+            lambda: self.__proxy_download_chunks(storage_client, storage_type, location, blob_name, start, end)
+        )
+
+        return (status.HTTP_206_PARTIAL_CONTENT if byte_range else status.HTTP_200_OK), headers, body
+
+
     async def create_download_request_directly(
         self,
         payload: DownloadFileRequestPayload,
@@ -228,13 +1245,7 @@ class FileServices:
     ) -> DownloadFileRequestResponse:
         """Returns a string containing the signed url to download the file"""
 
-        from shared.handlers.EncryptionHandler import EncryptionHandler
-
-        enctyptionHandler = EncryptionHandler()
-
-        timeHandler = TimeHandler()
-
-        catalogServices = CatalogServices()
+        catalogServices = get_catalog_services()
 
         catalog_record = await catalogServices.get_by_id(document_id=payload.catalog_file_id, user_id=user_id)
 
@@ -243,57 +1254,79 @@ class FileServices:
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Catalog record does not exist or invalid record id!"
             )
-        
+
         credential = await self.__get_credential_by_storage_bucket(storage_type=catalog_record.storage_type, bucket_name=catalog_record.file_location)
 
         if not credential:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, 
+                status_code=status.HTTP_400_BAD_REQUEST,
                 detail=f"Missing credentials to operate in the following bucket enviroment {catalog_record.file_location}"
             )
-        
-        decoded_credential = enctyptionHandler.decrypt_credentials(credential.credential)
 
-        expire_time = 30 * 60
+        decoded_credential = get_credential_services().decrypt_credential(credential)
 
-        expiry_date = timeHandler.expiry_at(seconds=expire_time)
-
-        expiry_date = timeHandler.datetime_to_unix_timestamp(date=expiry_date)
+        download_url = await BlockingIOHandler.run(
+            self.__download_url, catalog_record=catalog_record, credential=credential, decoded_credential=decoded_credential
+        )
 
-        download_url = None
+        return DownloadFileRequestResponse(
+            download_url=download_url
+        )
 
-        blob_name = f"lakehouse/collections/{catalog_record.collection_name}/{catalog_record.processing_level}/v{catalog_record.file_version}/{catalog_record.file_name}"
+    async def create_download_requests_batch(
+        self,
+        payload: DownloadFileBatchRequestPayload,
+        user_id: str
+    ) -> DownloadFileBatchRequestResponse:
+        """Returns the signed download urls of several catalog files, in request order"""
+        catalogServices = get_catalog_services()
 
-        if catalog_record.storage_type == "gcs":
-            storage_client = storage.Client.from_service_account_info(info=decoded_credential)
-            bucket = storage_client.bucket(catalog_record.file_location)
+        catalog_records = await catalogServices.get_many_by_id(document_ids=payload.catalog_file_ids, user_id=user_id, collection_name="files")
 
-            blob = bucket.blob(blob_name)
+        missing_ids = [ file_id for file_id in payload.catalog_file_ids if file_id not in catalog_records ]
 
-            download_url = blob.generate_signed_url(
-                version="v4",
-                expiration=expire_time,
-                method="GET"
+        if missing_ids:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Catalog records do not exist or invalid record ids: {missing_ids}"
             )
 
+        credentials: Dict[Tuple[str, str], Tuple[CouchbaseCredentialModel, dict]] = {}
 
-        elif catalog_record.storage_type == "s3":
-            credential = AmazonCredentialsModel(**decoded_credential)
-            storage_client = boto3.client(
-                "s3",
-                aws_access_key_id=credential.access_key,
-                aws_secret_access_key=credential.secret_access_key,
-                region_name=credential.region
+        files = []
+
+        for file_id in payload.catalog_file_ids:
+            catalog_record = catalog_records[file_id]
+
+            bucket_key = (catalog_record.storage_type, catalog_record.file_location)
+
+            if bucket_key not in credentials:
+                credential = await self.__get_credential_by_storage_bucket(storage_type=catalog_record.storage_type, bucket_name=catalog_record.file_location)
+
+                if not credential:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Missing credentials to operate in the following bucket enviroment {catalog_record.file_location}"
+                    )
+
+                credentials[bucket_key] = (credential, get_credential_services().decrypt_credential(credential))
+
+            credential, decoded_credential = credentials[bucket_key]
+
+            download_url = await BlockingIOHandler.run(
+                self.__download_url, catalog_record=catalog_record, credential=credential, decoded_credential=decoded_credential
             )
-            download_url = storage_client.generate_presigned_url(
-                'get_object',
-                Params={'Bucket': catalog_record.file_location, 'Key': blob_name},
-                ExpiresIn=expire_time
+
+            files.append(
+                DownloadFileBatchResponseItem(
+                    catalog_file_id=file_id,
+                    download_url=download_url
+                )
             )
 
-        elif catalog_record.storage_type == 'hdfs':
-            download_url=f"{catalog_record.file_location}/webhdfs/v1/{blob_name}?op=OPEN"
+        return DownloadFileBatchRequestResponse(files=files)
 
-        return DownloadFileRequestResponse(
-            download_url=download_url
-        )
\ No newline at end of file
+
+@lru_cache(maxsize=1)
+def get_file_services() -> FileServices:
+    return FileServices()
@@ -0,0 +1,322 @@
+import asyncio
+import contextvars
+import logging
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import uuid6
+from fastapi import HTTPException, status
+
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
+from shared.handlers.TimeHandler import TimeHandler
+from shared.models.env import EnvSettings, get_settings
+from shared.models.jobs import JobModel, JobType
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[[JobModel], Awaitable[None]]
+
+
+class JobNotReady(Exception):
+    """Raised by a handler waiting for other jobs: the job runs again later, without counting an attempt."""
+
+
+class JobServices:
+    """
+    In-process queue for long-running operations.
+
+        job = await get_job_services().enqueue(job_type="user_delete", payload=dict(user_uuid=user_uuid), user_id=user_id)
+
+    Every job is stored in catalogs.jobs before it is queued and its status
+    (pending, running, completed, failed, cancelled) is kept up to date there,
+    so endpoints can answer 202 with the job and clients poll /jobs/{id}.
+    JOB_WORKERS workers run the jobs concurrently, each one in its own context
+    (no request-scoped memoization). A failed job is queued again after
+    JOB_RETRY_DELAY_SECONDS until it reached JOB_MAX_ATTEMPTS attempts, and can
+    be retried by hand afterwards. Jobs left pending or running by a previous
+    process are queued again on startup (see the lifespan handler in app.py),
+    so handlers must be safe to run again. Handlers may checkpoint their
+    progress in job.progress with save(), and raise JobNotReady to be run
+    again after JOB_RETRY_DELAY_SECONDS while jobs they queued are unfinished.
+    """
+
+    _queue: asyncio.Queue = None
+    _workers: List[asyncio.Task] = []
+    _running: Dict[str, Optional[asyncio.Task]] = {}
+    _cancelled: Set[str] = set()
+
+    def __init__(self) -> None:
+        settings = get_settings()
+
+        self.scope = "catalogs"
+
+        self.couchbaseRepo = CouchbaseKVRepository(
+            scope=self.scope
+        )
+
+        self.max_attempts = settings.JOB_MAX_ATTEMPTS
+        self.retry_delay_seconds = settings.JOB_RETRY_DELAY_SECONDS
+
+    @classmethod
+    def open(cls, settings: EnvSettings = None) -> None:
+        if cls._queue is not None:
+            return
+
+        settings = settings if settings else get_settings()
+
+        cls._queue = asyncio.Queue()
+        cls._workers = [
+            asyncio.create_task(cls.__worker(), name=f"job-worker-{index}")
+            for index in range(settings.JOB_WORKERS)
+        ]
+
+    @classmethod
+    async def close(cls) -> None:
+        """Stop the workers. Running jobs stay running in the database and are resumed on the next startup."""
+        workers = cls._workers
+
+        for worker in workers:
+            worker.cancel()
+
+        await asyncio.gather(*workers, return_exceptions=True)
+
+        cls._queue = None
+        cls._workers = []
+        cls._running = {}
+
+    @classmethod
+    async def __worker(cls) -> None:
+        while True:
+            job_id = await cls._queue.get()
+
+            try:
+                await get_job_services().run(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Job {job_id} could not be run: {e}")
+            finally:
+                cls._queue.task_done()
+
+    def __put(self, job_id: str) -> None:
+        if JobServices._queue is None:
+            JobServices.open()
+
+        JobServices._queue.put_nowait(job_id)
+
+    def __handler(self, job_type: JobType) -> JobHandler:
+        if job_type == "collection_delete":
+            from services.CollectionDeletionServices import get_collection_deletion_services
+            return get_collection_deletion_services().run
+
+        if job_type == "user_delete":
+            from services.UserServices import get_user_services
+            return get_user_services().run_user_deletion
+
+        if job_type == "visa_delete":
+            from services.VisasServices import get_visa_services
+            return get_visa_services().run_visa_deletion
+
+        raise RuntimeError(f"Unknown job type {job_type}")
+
+    def __now(self) -> int:
+        timeHandler = TimeHandler()
+
+        return int(timeHandler.utc_now().timestamp())
+
+    async def save(self, job: JobModel) -> JobModel:
+        job.updated_at = self.__now()
+
+        await self.couchbaseRepo.upsert_document(
+            collection_name="jobs",
+            key=job.id,
+            value=job.model_dump(exclude_none=True),
+        )
+
+        return job
+
+    async def enqueue(self, job_type: JobType, payload: dict, user_id: str = None, progress: dict = None) -> JobModel:
+        job = JobModel(
+            id=str(uuid6.uuid7()),
+            job_type=job_type,
+            user_id=user_id,
+            payload=payload,
+            progress=progress if progress else {},
+            created_at=self.__now(),
+        )
+
+        await self.save(job)
+
+        self.__put(job.id)
+
+        return job
+
+    async def get_job(self, job_id: str) -> JobModel:
+        response = await self.couchbaseRepo.get_document_by_id(collection_name="jobs", document_key=job_id)
+
+        if not response:
+            return None
+
+        return JobModel(**response[0]["jobs"])
+
+    async def get_by_id(self, job_id: str, user_id: str, user_role: str) -> JobModel:
+        """Returns a job to its creator or to an admin."""
+        job = await self.get_job(job_id)
+
+        if not job:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Job {job_id} not found")
+
+        if job.user_id != user_id and user_role != "admin":
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Access denied: only the job creator can access this job")
+
+        return job
+
+    async def list_unfinished(self, job_type: JobType = None, payload_filters: dict = None) -> List[JobModel]:
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="jobs")
+
+        queryBuilder.select().where_in(target="status", in_values=["pending", "running"])
+
+        if job_type:
+            queryBuilder.where(field="job_type", op="=", value=job_type)
+
+        for key, value in (payload_filters or {}).items():
+            queryBuilder.where(field=f"payload.{key}", op="=", value=value)
+
+        query = queryBuilder.order_by_field("created_at", "ASC").build()
+
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
+
+        return [JobModel(**row["jobs"]) for row in response]
+
+    async def resume(self) -> List[str]:
+        """Queue every job left pending or running by a previous process. Returns their ids."""
+        jobs = await self.list_unfinished()
+
+        for job in jobs:
+            self.__put(job.id)
+
+        return [job.id for job in jobs]
+
+    async def cancel(self, job_id: str, user_id: str, user_role: str) -> JobModel:
+        """
+        Cancel a pending or running job. A running handler is cancelled and the
+        worker saves the cancelled status once it stopped; the returned job
+        already carries that status.
+        """
+        job = await self.get_by_id(job_id=job_id, user_id=user_id, user_role=user_role)
+
+        if job.status not in ["pending", "running"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Job {job_id} is already {job.status}")
+
+        # seen by run() before it starts the handler, whichever of the two gets there first
+        JobServices._cancelled.add(job_id)
+
+        if job_id in JobServices._running:
+            task = JobServices._running[job_id]
+
+            if task is not None and not task.cancel():
+                JobServices._cancelled.discard(job_id)
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Job {job_id} is already finishing")
+
+            job.status = "cancelled"
+        else:
+            job.status = "cancelled"
+            await self.save(job)
+
+        return job
+
+    async def retry(self, job_id: str, user_id: str, user_role: str) -> JobModel:
+        job = await self.get_by_id(job_id=job_id, user_id=user_id, user_role=user_role)
+
+        if job.status not in ["failed", "cancelled"]:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Only failed or cancelled jobs can be retried, job {job_id} is {job.status}")
+
+        job.status = "pending"
+        job.attempts = 0
+
+        JobServices._cancelled.discard(job_id)
+
+        await self.save(job)
+
+        self.__put(job.id)
+
+        return job
+
+    async def run(self, job_id: str) -> JobModel:
+        if job_id in JobServices._running:
+            return await self.get_job(job_id)
+
+        # registered before the first await so that a cancel() landing meanwhile does not save over the run
+        JobServices._running[job_id] = None
+
+        try:
+            job = await self.get_job(job_id)
+
+            if not job or job.status not in ["pending", "running"]:
+                JobServices._cancelled.discard(job_id)
+                return job
+
+            handler = self.__handler(job.job_type)
+
+            job.status = "running"
+            job.attempts += 1
+
+            await self.save(job)
+
+            if job_id in JobServices._cancelled:
+                JobServices._cancelled.discard(job_id)
+
+                job.status = "cancelled"
+
+                return await self.save(job)
+
+            task = asyncio.create_task(handler(job), context=contextvars.Context())
+
+            JobServices._running[job_id] = task
+
+            try:
+                await task
+
+                job.status = "completed"
+                job.error = None
+
+            except asyncio.CancelledError:
+                if job_id not in JobServices._cancelled:
+                    # shutdown, the job is left running and resumed by the next process
+                    raise
+
+                JobServices._cancelled.discard(job_id)
+
+                job.status = "cancelled"
+
+            except JobNotReady as e:
+                # waiting does not hold a worker, the jobs waited for may need one
+                job.status = "pending"
+                job.attempts -= 1
+                job.error = None
+
+                logger.info(f"Job {job_id} ({job.job_type}) waiting: {e}")
+
+                asyncio.get_running_loop().call_later(self.retry_delay_seconds, self.__put, job_id)
+
+            except Exception as e:
+                logger.warning(f"Job {job_id} ({job.job_type}) failed on attempt {job.attempts}: {e}")
+
+                job.error = str(e)
+
+                if job.attempts < self.max_attempts:
+                    job.status = "pending"
+                    asyncio.get_running_loop().call_later(self.retry_delay_seconds, self.__put, job_id)
+                else:
+                    job.status = "failed"
+
+            return await self.save(job)
+
+        finally:
+            JobServices._running.pop(job_id, None)
+
+
+@lru_cache(maxsize=1)
+def get_job_services() -> JobServices:
+    return JobServices()
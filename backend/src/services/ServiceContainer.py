@@ -0,0 +1,57 @@
+from typing import Callable, List
+
+from services.AccessRequestServices import get_access_request_services
+from services.AuthServices import get_auth_services
+from services.CatalogServices import get_catalog_services
+from services.CollectionDeletionServices import get_collection_deletion_services
+from services.CollectionServices import get_collection_services
+from services.CredentialServices import get_credential_services
+from services.FileServices import get_file_services
+from services.JobServices import get_job_services
+from services.StorageEventServices import get_storage_event_services
+from services.UploadSweeperServices import get_upload_sweeper_services
+from services.UserServices import get_user_services
+from services.VisasServices import get_visa_services
+from shared.handlers.EncryptionHandler import get_encryption_handler
+
+
+class ServiceContainer:
+    """
+    Process-wide service instances.
+
+    Each service module exposes a cached get_*() factory that routes inject
+    with Depends and services use to reach each other, e.g.
+
+        async def list_all_users(usersService: UserServices = Depends(get_user_services)):
+
+    Services hold no per-request state (the caller is always passed in), so a
+    single instance of each is shared by every request. open() builds them all
+    on application startup instead of on the first request; close() drops them
+    so the next call builds fresh ones.
+    """
+
+    FACTORIES: List[Callable[[], object]] = [
+        get_encryption_handler,
+        get_auth_services,
+        get_user_services,
+        get_visa_services,
+        get_credential_services,
+        get_catalog_services,
+        get_collection_services,
+        get_collection_deletion_services,
+        get_file_services,
+        get_access_request_services,
+        get_job_services,
+        get_upload_sweeper_services,
+        get_storage_event_services,
+    ]
+
+    @classmethod
+    def open(cls) -> None:
+        for factory in cls.FACTORIES:
+            factory()
+
+    @classmethod
+    def close(cls) -> None:
+        for factory in cls.FACTORIES:
+            factory.cache_clear()
@@ -0,0 +1,420 @@
+import asyncio
+import base64
+import contextvars
+import hmac
+import json
+import logging
+import re
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Tuple
+from urllib.parse import unquote_plus
+
+from fastapi import HTTPException, status
+
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.StorageClientPool import StorageClientPool
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
+from shared.models.catalog import CouchbaseCatalogFileModel
+from shared.models.env import EnvSettings, get_settings
+from shared.models.metrics import StorageEventMetrics
+from shared.models.storage_events import StorageEvent
+
+logger = logging.getLogger(__name__)
+
+# lakehouse/collections/{collection_name}/{processing_level}/v{file_version}/{file_name}
+BLOB_NAME_PATTERN = re.compile(r"^lakehouse/collections/(?P<collection_name>[^/]+)/(?P<processing_level>[^/]+)/v(?P<file_version>\d+)/(?P<file_name>.+)$")
+
+# SNS subscription confirmation links, only fetched on the SNS endpoints
+SNS_SUBSCRIBE_URL_PATTERN = re.compile(r"^https://sns\.[a-z0-9-]+\.amazonaws\.com(\.cn)?/")
+
+FileKey = Tuple[str, str, str, str, int, str]
+
+
+class StorageEventServices:
+    """
+    Upload completion from storage-side notifications.
+
+    Notifications are posted to /storage/events (or dropped as .json files in
+    STORAGE_EVENTS_SPOOL_DIR, a local stand-in for a notification queue) in
+    any of these formats:
+
+    - S3 event notifications ({"Records": [...]}), raw or in an SNS envelope
+      (SNS subscription confirmations are confirmed, see confirm_subscription);
+    - GCS Pub/Sub push messages ({"message": {"attributes": ..., "data": ...}})
+      or plain object resources ({"kind": "storage#object", ...});
+    - HDFS inotify-style events ({"namenode": ..., "events": [{"eventType": "CLOSE", ...}]}).
+
+    Object writes are queued and applied in batches of up to
+    STORAGE_EVENTS_BATCH_SIZE, or whatever arrived within
+    STORAGE_EVENTS_FLUSH_SECONDS: blob names are matched to their file
+    records with one query, and the records still uploading or ready are set
+    to ready with the stored size and checksum by conditional updates, so a
+    record deleted meanwhile stays deleted. Events still queued on shutdown
+    are lost; the expired uploads sweeper (see UploadSweeperServices) settles
+    those records later.
+    """
+
+    _queue: asyncio.Queue = None
+    _tasks: List[asyncio.Task] = []
+
+    _received_total: int = 0
+    _ignored_total: int = 0
+    _matched_total: int = 0
+    _unmatched_total: int = 0
+    _errors_total: int = 0
+    _batches_total: int = 0
+    _batch_total: float = 0.0
+
+    MAX_CONCURRENT_UPDATES = 16
+
+    def __init__(self) -> None:
+        settings = get_settings()
+
+        self.scope = "catalogs"
+
+        self.couchbaseRepo = CouchbaseKVRepository(
+            scope=self.scope
+        )
+
+        self.token = settings.STORAGE_EVENTS_TOKEN
+        self.http_timeout = settings.STORAGE_HTTP_TIMEOUT_SECONDS
+
+    @classmethod
+    def open(cls, settings: EnvSettings = None) -> None:
+        if cls._queue is not None:
+            return
+
+        settings = settings if settings else get_settings()
+
+        cls._queue = asyncio.Queue(maxsize=settings.STORAGE_EVENTS_QUEUE_SIZE)
+
+        # background tasks must not inherit the memoized lookups of the request that started them
+        cls._tasks = [
+            asyncio.create_task(
+                cls.__consume(settings.STORAGE_EVENTS_BATCH_SIZE, settings.STORAGE_EVENTS_FLUSH_SECONDS),
+                name="storage-events", context=contextvars.Context()
+            )
+        ]
+
+        if settings.STORAGE_EVENTS_SPOOL_DIR:
+            cls._tasks.append(
+                asyncio.create_task(
+                    cls.__poll_spool(Path(settings.STORAGE_EVENTS_SPOOL_DIR), settings.STORAGE_EVENTS_FLUSH_SECONDS),
+                    name="storage-events-spool", context=contextvars.Context()
+                )
+            )
+
+    @classmethod
+    async def close(cls) -> None:
+        tasks = cls._tasks
+
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        cls._queue = None
+        cls._tasks = []
+
+    @classmethod
+    def metrics(cls) -> StorageEventMetrics:
+        average_batch_ms = (cls._batch_total / cls._batches_total) * 1000 if cls._batches_total else 0.0
+
+        return StorageEventMetrics(
+            is_running=any(not task.done() for task in cls._tasks),
+            queued=cls._queue.qsize() if cls._queue is not None else 0,
+            received_total=cls._received_total,
+            ignored_total=cls._ignored_total,
+            matched_total=cls._matched_total,
+            unmatched_total=cls._unmatched_total,
+            errors_total=cls._errors_total,
+            batches_total=cls._batches_total,
+            average_batch_ms=round(average_batch_ms, 3),
+        )
+
+    @classmethod
+    async def __consume(cls, batch_size: int, flush_seconds: float) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            events = [await cls._queue.get()]
+
+            deadline = loop.time() + flush_seconds
+
+            while len(events) < batch_size:
+                timeout = deadline - loop.time()
+
+                if timeout <= 0:
+                    break
+
+                try:
+                    events.append(await asyncio.wait_for(cls._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            started = time.monotonic()
+
+            try:
+                await get_storage_event_services().apply(events)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                cls._errors_total += len(events)
+                logger.warning(f"Failed to apply {len(events)} storage events: {e}")
+
+            cls._batches_total += 1
+            cls._batch_total += time.monotonic() - started
+
+    @classmethod
+    async def __poll_spool(cls, spool_dir: Path, interval_seconds: float) -> None:
+        storageEventServices = get_storage_event_services()
+
+        while True:
+            await asyncio.sleep(interval_seconds)
+
+            for path in sorted(spool_dir.glob("*.json")):
+                try:
+                    body = json.loads(await BlockingIOHandler.run(path.read_text))
+
+                    for item in body if isinstance(body, list) else [body]:
+                        storageEventServices.publish(storageEventServices.parse(item))
+
+                    await BlockingIOHandler.run(path.unlink)
+
+                except HTTPException:
+                    # queue full, the file is read again on the next poll
+                    break
+
+                except (OSError, KeyError, ValueError) as e:
+                    cls._errors_total += 1
+                    logger.warning(f"Invalid storage events file {path}: {e}")
+                    await BlockingIOHandler.run(path.rename, path.with_suffix(".invalid"))
+
+    def authorize(self, token: str = None) -> None:
+        if not self.token or not token or not hmac.compare_digest(self.token, token):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid storage events token")
+
+    def publish(self, events: List[StorageEvent]) -> int:
+        """Queue object writes for the next batch. Raises 503 when the queue is full, so the sender retries."""
+        cls = StorageEventServices
+
+        if cls._queue is None:
+            cls.open()
+
+        if cls._queue.maxsize and cls._queue.qsize() + len(events) > cls._queue.maxsize:
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Storage events queue is full, retry later")
+
+        for event in events:
+            cls._queue.put_nowait(event)
+
+        cls._received_total += len(events)
+
+        return len(events)
+
+    async def confirm_subscription(self, body: dict) -> None:
+        """Confirm the SNS subscription of the endpoint by fetching the SubscribeURL of its SubscriptionConfirmation."""
+        subscribe_url = body.get("SubscribeURL") or ""
+
+        if not SNS_SUBSCRIBE_URL_PATTERN.match(subscribe_url):
+            raise ValueError("SubscribeURL is not an SNS endpoint")
+
+        logger.info(f"Confirming the SNS subscription to {body.get('TopicArn')}: {subscribe_url}")
+
+        try:
+            response = await BlockingIOHandler.run(StorageClientPool.http_session().get, subscribe_url, timeout=self.http_timeout)
+
+            response.raise_for_status()
+        except OSError as e:
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=f"SNS subscription not confirmed: {e}")
+
+    def parse(self, body: dict) -> List[StorageEvent]:
+        """Object writes of a notification in any supported format. Other events are counted as ignored."""
+        if not isinstance(body, dict):
+            raise ValueError("Storage notifications must be JSON objects")
+
+        if body.get("Type") in ("SubscriptionConfirmation", "UnsubscribeConfirmation"):
+            StorageEventServices._ignored_total += 1
+            return []
+
+        if body.get("Type") == "Notification" and "Message" in body:
+            body = json.loads(body["Message"])
+
+        if "Records" in body:
+            return self.__s3_events(body["Records"])
+
+        if "message" in body:
+            return self.__gcs_pubsub_events(body["message"])
+
+        if body.get("kind") == "storage#object":
+            return [self.__gcs_event(body)]
+
+        if "events" in body and "namenode" in body:
+            return self.__hdfs_events(body["namenode"], body["events"])
+
+        raise ValueError("Unknown storage notification format")
+
+    def __s3_events(self, records: List[dict]) -> List[StorageEvent]:
+        events = []
+
+        for record in records:
+            if not record.get("eventName", "").startswith("ObjectCreated:"):
+                StorageEventServices._ignored_total += 1
+                continue
+
+            s3_object = record["s3"]["object"]
+
+            etag = s3_object.get("eTag", "").strip('"')
+
+            events.append(
+                StorageEvent(
+                    storage_type="s3",
+                    bucket=record["s3"]["bucket"]["name"],
+                    blob_name=unquote_plus(s3_object["key"]),
+                    file_size=s3_object.get("size"),
+                    # multipart uploads have an ETag that is not the object's md5
+                    file_checksum=(f"etag:{etag}" if "-" in etag else f"md5:{etag}") if etag else None,
+                )
+            )
+
+        return events
+
+    def __gcs_pubsub_events(self, message: dict) -> List[StorageEvent]:
+        event_type = message.get("attributes", {}).get("eventType")
+
+        if event_type != "OBJECT_FINALIZE":
+            StorageEventServices._ignored_total += 1
+            return []
+
+        return [self.__gcs_event(json.loads(base64.b64decode(message["data"])))]
+
+    def __gcs_event(self, resource: dict) -> StorageEvent:
+        if resource.get("md5Hash"):
+            checksum = f"md5:{base64.b64decode(resource['md5Hash']).hex()}"
+        elif resource.get("crc32c"):
+            checksum = f"crc32c:{resource['crc32c']}"
+        else:
+            checksum = None
+
+        return StorageEvent(
+            storage_type="gcs",
+            bucket=resource["bucket"],
+            blob_name=resource["name"],
+            file_size=int(resource["size"]) if resource.get("size") is not None else None,
+            file_checksum=checksum,
+        )
+
+    def __hdfs_events(self, namenode: str, hdfs_events: List[dict]) -> List[StorageEvent]:
+        events = []
+
+        for hdfs_event in hdfs_events:
+            if hdfs_event.get("eventType") != "CLOSE":
+                StorageEventServices._ignored_total += 1
+                continue
+
+            events.append(
+                StorageEvent(
+                    storage_type="hdfs",
+                    bucket=namenode,
+                    blob_name=hdfs_event["path"].lstrip("/"),
+                    file_size=hdfs_event.get("fileSize"),
+                )
+            )
+
+        return events
+
+    async def apply(self, events: List[StorageEvent]) -> None:
+        """Set the file records of a batch of object writes to ready, with their stored size and checksum."""
+        cls = StorageEventServices
+
+        # the last write of an object wins
+        writes: Dict[FileKey, StorageEvent] = {}
+
+        for event in events:
+            match = BLOB_NAME_PATTERN.match(event.blob_name)
+
+            if not match:
+                cls._unmatched_total += 1
+                continue
+
+            writes[(
+                event.storage_type,
+                event.bucket,
+                match["collection_name"],
+                match["processing_level"],
+                int(match["file_version"]),
+                match["file_name"],
+            )] = event
+
+        if not writes:
+            return
+
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="files")
+
+        queryBuilder.select()
+        queryBuilder.where_in(target="file_name", in_values={key[5] for key in writes})
+        queryBuilder.where_in(target="collection_name", in_values={key[2] for key in writes})
+        queryBuilder.where_in(target="file_status", in_values=["uploading", "ready"])
+
+        query = queryBuilder.build()
+
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
+
+        file_records: Dict[FileKey, CouchbaseCatalogFileModel] = {}
+
+        for row in response:
+            file_record = CouchbaseCatalogFileModel(**row["files"])
+
+            file_records[(
+                file_record.storage_type,
+                file_record.file_location,
+                file_record.collection_name,
+                file_record.processing_level,
+                file_record.file_version,
+                file_record.file_name,
+            )] = file_record
+
+        # records getting the same values are updated together
+        updates: Dict[Tuple, List[str]] = {}
+
+        for key, event in writes.items():
+            file_record = file_records.get(key)
+
+            if not file_record:
+                cls._unmatched_total += 1
+                continue
+
+            values = {"file_status": "ready", "expires_at": None}
+
+            if event.file_size is not None:
+                values["file_size"] = event.file_size
+
+            if event.file_checksum:
+                values["file_checksum"] = event.file_checksum
+
+            updates.setdefault(tuple(values.items()), []).append(file_record.id)
+
+        semaphore = asyncio.Semaphore(cls.MAX_CONCURRENT_UPDATES)
+
+        async def update(values: Tuple, document_ids: List[str]) -> None:
+            async with semaphore:
+                # the status is checked by the update itself, a record deleted since the lookup stays deleted
+                result = await self.couchbaseRepo.update_where(
+                    collection_name="files",
+                    values=dict(values),
+                    where="file_status IN $1 AND id IN $2",
+                    args=[["uploading", "ready"], document_ids],
+                )
+
+            cls._matched_total += len(result.succeeded)
+            cls._unmatched_total += len(result.missing)
+            cls._errors_total += len(result.failed)
+
+        await asyncio.gather(*(update(values, document_ids) for values, document_ids in updates.items()))
+
+
+@lru_cache(maxsize=1)
+def get_storage_event_services() -> StorageEventServices:
+    return StorageEventServices()
@@ -0,0 +1,310 @@
+import asyncio
+import contextvars
+import logging
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from botocore.exceptions import ClientError
+from google.api_core.exceptions import GoogleAPICallError
+
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.StorageClientPool import StorageClientPool
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
+from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
+from shared.handlers.TimeHandler import TimeHandler
+from shared.models.catalog import CouchbaseCatalogFileModel
+from shared.models.env import EnvSettings, get_settings
+from shared.models.metrics import UploadSweeperMetrics
+
+logger = logging.getLogger(__name__)
+
+WEBHDFS_PORT = 9870
+
+S3_MISSING_CODES = {"404", "NoSuchKey", "NotFound"}
+
+
+class UploadSweeperServices:
+    """
+    Periodic clean up of abandoned uploads.
+
+    Upload requests store their file records as "uploading" with an expires_at
+    matching the signed url; the record is only set to ready if the client
+    reports the upload. Every UPLOAD_SWEEP_INTERVAL_SECONDS the sweeper takes
+    the records whose url expired more than UPLOAD_SWEEP_GRACE_SECONDS ago
+    (one query on the idx_files_status_expiry index), a page of
+    UPLOAD_SWEEP_BATCH_SIZE at a time, and checks their objects in the
+    storage backend concurrently:
+
+    - stored objects: the record is set to ready with the stored size;
+    - missing objects: the record is removed (or set to deleted when
+      UPLOAD_SWEEP_DELETE_STALE is false).
+
+    Both writes only apply to records that are still uploading, so a record
+    completed or deleted meanwhile is left as it is. Records whose object
+    could not be checked are left for the next run.
+    """
+
+    _task: asyncio.Task = None
+    _interval_seconds: float = 0.0
+
+    _runs_total: int = 0
+    _errors_total: int = 0
+    _records_checked: int = 0
+    _records_promoted: int = 0
+    _records_removed: int = 0
+    _last_run_at: Optional[int] = None
+    _last_run_ms: float = 0.0
+
+    def __init__(self) -> None:
+        settings = get_settings()
+
+        self.scope = "catalogs"
+
+        self.couchbaseRepo = CouchbaseKVRepository(
+            scope=self.scope
+        )
+
+        self.batch_size = settings.UPLOAD_SWEEP_BATCH_SIZE
+        self.concurrency = settings.UPLOAD_SWEEP_CONCURRENCY
+        self.grace_seconds = settings.UPLOAD_SWEEP_GRACE_SECONDS
+        self.delete_stale = settings.UPLOAD_SWEEP_DELETE_STALE
+
+    @classmethod
+    def open(cls, settings: EnvSettings = None) -> None:
+        if cls._task is not None:
+            return
+
+        settings = settings if settings else get_settings()
+
+        cls._interval_seconds = settings.UPLOAD_SWEEP_INTERVAL_SECONDS
+
+        if cls._interval_seconds <= 0:
+            return
+
+        cls._task = asyncio.create_task(cls.__loop(), name="upload-sweeper", context=contextvars.Context())
+
+    @classmethod
+    async def close(cls) -> None:
+        if cls._task is None:
+            return
+
+        cls._task.cancel()
+
+        await asyncio.gather(cls._task, return_exceptions=True)
+
+        cls._task = None
+
+    @classmethod
+    async def __loop(cls) -> None:
+        while True:
+            await asyncio.sleep(cls._interval_seconds)
+
+            try:
+                await get_upload_sweeper_services().sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                cls._errors_total += 1
+                logger.warning(f"Upload sweep failed: {e}")
+
+    @classmethod
+    def metrics(cls) -> UploadSweeperMetrics:
+        return UploadSweeperMetrics(
+            is_running=cls._task is not None and not cls._task.done(),
+            interval_seconds=cls._interval_seconds,
+            runs_total=cls._runs_total,
+            errors_total=cls._errors_total,
+            records_checked=cls._records_checked,
+            records_promoted=cls._records_promoted,
+            records_removed=cls._records_removed,
+            last_run_at=cls._last_run_at,
+            last_run_ms=round(cls._last_run_ms, 3),
+        )
+
+    def __blob_name(self, file_record: CouchbaseCatalogFileModel) -> str:
+        return f"lakehouse/collections/{file_record.collection_name}/{file_record.processing_level}/v{file_record.file_version}/{file_record.file_name}"
+
+    async def __expired_uploads(self, expired_before: int) -> List[CouchbaseCatalogFileModel]:
+        queryBuilder = CouchbaseQueryBuilder(scope=self.scope, collection="files")
+
+        queryBuilder.select().where(field="file_status", op="=", value="uploading")
+        queryBuilder.where(field="expires_at", op="<", value=expired_before)
+
+        query = queryBuilder.order_by_field("expires_at", "ASC").limit_to(self.batch_size).build()
+
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
+
+        return [CouchbaseCatalogFileModel(**row["files"]) for row in response]
+
+    async def sweep(self) -> UploadSweeperMetrics:
+        """Run one pass over the expired uploads. Returns the updated metrics."""
+        cls = UploadSweeperServices
+
+        started = time.monotonic()
+
+        timeHandler = TimeHandler()
+
+        now = int(timeHandler.utc_now().timestamp())
+
+        while True:
+            file_records = await self.__expired_uploads(expired_before=now - int(self.grace_seconds))
+
+            if not file_records:
+                break
+
+            sizes, failed = await self.__stored_sizes(file_records)
+
+            promoted: Dict[int, List[str]] = {}
+
+            for file_record in file_records:
+                if sizes.get(file_record.id) is not None:
+                    promoted.setdefault(sizes[file_record.id], []).append(file_record.id)
+
+            stale = [file_record.id for file_record in file_records if file_record.id in sizes and sizes[file_record.id] is None]
+
+            # the updates re-check the status, a record completed or deleted since the lookup is left as it is
+            for file_size, document_ids in promoted.items():
+                result = await self.couchbaseRepo.update_where(
+                    collection_name="files",
+                    values={"file_status": "ready", "expires_at": None, "file_size": file_size},
+                    where="file_status = $1 AND id IN $2",
+                    args=["uploading", document_ids],
+                )
+                cls._records_promoted += len(result.succeeded)
+                failed += len(result.failed)
+
+            if stale and self.delete_stale:
+                result = await self.couchbaseRepo.delete_where(
+                    collection_name="files",
+                    where="file_status = $1 AND id IN $2",
+                    args=["uploading", stale],
+                )
+                cls._records_removed += len(result.succeeded)
+                failed += len(result.failed)
+
+            elif stale:
+                result = await self.couchbaseRepo.update_where(
+                    collection_name="files",
+                    values={"file_status": "deleted", "expires_at": None},
+                    where="file_status = $1 AND id IN $2",
+                    args=["uploading", stale],
+                )
+                cls._records_removed += len(result.succeeded)
+                failed += len(result.failed)
+
+            cls._records_checked += len(file_records)
+            cls._errors_total += failed
+
+            # records left uploading would come back in the next page, they wait for the next run
+            if failed or len(file_records) < self.batch_size:
+                break
+
+        cls._runs_total += 1
+        cls._last_run_at = now
+        cls._last_run_ms = (time.monotonic() - started) * 1000
+
+        return cls.metrics()
+
+    async def __stored_sizes(self, file_records: List[CouchbaseCatalogFileModel]) -> Tuple[Dict[str, Optional[int]], int]:
+        """
+        Size of the stored object of each record (None when it does not exist), keyed by record id.
+        Records that could not be checked are left out. Returns the sizes and the number of failed checks.
+        """
+        from services.CredentialServices import get_credential_services
+
+        credentialServices = get_credential_services()
+
+        buckets: Dict[Tuple[str, str], List[CouchbaseCatalogFileModel]] = {}
+
+        for file_record in file_records:
+            buckets.setdefault((file_record.storage_type, file_record.file_location), []).append(file_record)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        sizes: Dict[str, Optional[int]] = {}
+        failed = 0
+
+        for (storage_type, location), bucket_records in buckets.items():
+            if storage_type in ["gcs", "s3"]:
+                credential = await credentialServices.get_by_storage_bucket(storage_type=storage_type, bucket_name=location)
+
+                if not credential:
+                    logger.warning(f"Missing credentials to check the uploads in the bucket {location}")
+                    failed += len(bucket_records)
+                    continue
+
+                decoded_credential = credentialServices.decrypt_credential(credential)
+
+                if storage_type == "s3":
+                    storage_client = await BlockingIOHandler.run(
+                        StorageClientPool.s3_client, credential_id=credential.id, decoded_credential=decoded_credential
+                    )
+                    stat = self.__s3_size
+                else:
+                    storage_client = await BlockingIOHandler.run(
+                        StorageClientPool.gcs_client, credential_id=credential.id, decoded_credential=decoded_credential
+                    )
+                    stat = self.__gcs_size
+
+            elif storage_type == "hdfs":
+                storage_client, stat = StorageClientPool.hdfs_session(), self.__hdfs_size
+
+            else:
+                failed += len(bucket_records)
+                continue
+
+            async def check(file_record: CouchbaseCatalogFileModel) -> Optional[int]:
+                async with semaphore:
+                    return await BlockingIOHandler.run(stat, storage_client, location, self.__blob_name(file_record))
+
+            outcomes = await asyncio.gather(*[check(file_record) for file_record in bucket_records], return_exceptions=True)
+
+            for file_record, outcome in zip(bucket_records, outcomes):
+                if isinstance(outcome, BaseException):
+                    logger.warning(f"Unable to check the upload of file {file_record.id}: {outcome}")
+                    failed += 1
+                else:
+                    sizes[file_record.id] = outcome
+
+        return sizes, failed
+
+    @staticmethod
+    def __s3_size(storage_client, bucket_name: str, blob_name: str) -> Optional[int]:
+        try:
+            response = storage_client.head_object(Bucket=bucket_name, Key=blob_name)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in S3_MISSING_CODES:
+                return None
+            raise
+
+        return response["ContentLength"]
+
+    @staticmethod
+    def __gcs_size(storage_client, bucket_name: str, blob_name: str) -> Optional[int]:
+        try:
+            blob = storage_client.bucket(bucket_name).get_blob(blob_name)
+        except GoogleAPICallError as e:
+            raise RuntimeError(e.message)
+
+        return blob.size if blob else None
+
+    @staticmethod
+    def __hdfs_size(hdfs_session, namenode: str, blob_name: str) -> Optional[int]:
+        response = hdfs_session.get(
+            f"http://{namenode}:{WEBHDFS_PORT}/webhdfs/v1/{blob_name}?op=GETFILESTATUS",
+            timeout=get_settings().STORAGE_HTTP_TIMEOUT_SECONDS
+        )
+
+        if response.status_code == 404:
+            return None
+
+        if not response.status_code == 200:
+            raise RuntimeError(f"Error checking {blob_name}: {response.text}")
+
+        return response.json()["FileStatus"]["length"]
+
+
+@lru_cache(maxsize=1)
+def get_upload_sweeper_services() -> UploadSweeperServices:
+    return UploadSweeperServices()
@@ -1,14 +1,17 @@
+from functools import lru_cache
 from typing import List
 import uuid6
 from datetime import datetime, timedelta
 
-import requests
-from repositories.CouchbaseRepository import CouchbaseRepository
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.PassportBrokerClient import PassportBrokerClient
 
 from shared.models.catalog import CatalogFilter, CouchbaseCatalogCollectionModel
 
-from shared.models.env import EnvSettings
+from shared.models.env import get_settings
+from shared.models.jobs import JobModel
 from shared.models.users import (
+    CouchbaseUserAccessModel,
     CouchbaseUserAssertionModel,
     CouchbaseUserModel,
     CouchbaseUserModelNoPassword,
@@ -23,24 +26,24 @@ from shared.handlers.CouchbaseQueryBuilder import CouchbaseQueryBuilder
 
 from fastapi import HTTPException, status
 
-from shared.handlers.EncryptionHandler import EncryptionHandler
+from shared.handlers.EncryptionHandler import get_encryption_handler
 from shared.handlers.MailingClient import MailingClient
+from shared.handlers.RequestContextHandler import RequestContextHandler
+from shared.handlers.BlockingIOHandler import BlockingIOHandler
 
 
 class UserServices:
     def __init__(self) -> None:
-        settings = EnvSettings()
-
         self.scope = "users"
-        self.couchbaseRepo = CouchbaseRepository(
+        self.couchbaseRepo = CouchbaseKVRepository(
             scope=self.scope,
         )
-        self.passport_broker_url = settings.PASSPORT_BROKER_SERVICE_URL
-
-    async def delete_user(self, user_uuid: str, requestor_id: str, requestor_role: str, new_owner_id: str = None) -> str:
-        from services.CatalogServices import CatalogServices
 
-        passport_broker_url = f"{self.passport_broker_url}/admin/ga4gh/passport/v1/users/{user_uuid}"
+    async def delete_user(self, user_uuid: str, requestor_id: str, requestor_role: str, new_owner_id: str = None) -> JobModel:
+        """
+        Validates the request and queues the deletion of the user (see run_user_deletion). Returns the job.
+        """
+        from services.JobServices import get_job_services
 
         user = await self.list_info_by_user_id(user_uuid=user_uuid)
 
@@ -49,22 +52,84 @@ class UserServices:
         
         if user_uuid != requestor_id and requestor_role != "admin":
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized! Only admin users can delete other users")
-        
-        user_passport = await self.list_passport_by_user_id(user_uuid=user_uuid)
 
         if new_owner_id:
+            user_passport = await self.list_passport_by_user_id(user_uuid=user_uuid)
+
             if not user_passport:
                 raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Unable to list user passports/collections")
-        
+
             new_owner = await self.list_info_by_user_id(user_uuid=new_owner_id)
 
             if not new_owner:
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"User {user_uuid} not found! Please specify a valid user id for ownership transfer")
 
+        jobServices = get_job_services()
+
+        unfinished = await jobServices.list_unfinished(job_type="user_delete", payload_filters=dict(user_uuid=user_uuid))
+
+        if unfinished:
+            return unfinished[0]
+
+        return await jobServices.enqueue(
+            job_type="user_delete",
+            payload=dict(user_uuid=user_uuid, new_owner_id=new_owner_id),
+            user_id=requestor_id,
+        )
+
+    async def run_user_deletion(self, job: JobModel) -> None:
+        """
+        Handler of "user_delete" jobs: transfers the user's collections to the new owner, or deletes them,
+        then removes the user's passport and info. The info document goes last, so a retry starts over.
+
+        Owned collections are deleted by their own "collection_delete" jobs (recorded in
+        job.progress["collection_jobs"]), the user's records are only removed once all of them completed:
+        until then the job waits (JobNotReady), and a failed or cancelled collection job fails the attempt,
+        the next attempt queuing that collection's deletion again.
+        """
+        from services.CatalogServices import get_catalog_services
+        from services.JobServices import JobNotReady, get_job_services
+
+        user_uuid = job.payload["user_uuid"]
+        new_owner_id = job.payload.get("new_owner_id")
+
+        user = await self.list_info_by_user_id(user_uuid=user_uuid)
+
+        if not user:
+            # removed by a previous attempt
+            return
+
+        user_passport = await self.list_passport_by_user_id(user_uuid=user_uuid)
+
+        if new_owner_id:
+            # the passport is already gone when a previous attempt stopped after removing it
+            new_owner = await self.list_info_by_user_id(user_uuid=new_owner_id)
+
+            if not new_owner:
+                raise RuntimeError(f"User {new_owner_id} not found, the ownership of the collections cannot be transferred")
+
             await self.transfer_collections_ownership(owner_id=user_uuid, new_owner_id=new_owner.id, new_owner_email=new_owner.email, owner_passport=user_passport, user_id=user_uuid)
 
         else:
-            catalogServices = CatalogServices()
+            catalogServices = get_catalog_services()
+            jobServices = get_job_services()
+
+            collection_jobs = job.progress.setdefault("collection_jobs", {})
+
+            failed = []
+
+            for collection_id, collection_job_id in list(collection_jobs.items()):
+                collection_job = await jobServices.get_job(collection_job_id)
+
+                if collection_job is None or collection_job.status in ["failed", "cancelled"]:
+                    # queued again by the next attempt
+                    collection_jobs.pop(collection_id)
+                    failed.append(collection_id)
+
+            if failed:
+                await jobServices.save(job)
+
+                raise RuntimeError(f"Deletion of the collections {failed} did not complete")
 
             filters = [ 
                 CatalogFilter(
@@ -76,30 +141,42 @@ class UserServices:
 
             owned_collections = await catalogServices.get_by_filters(filters=filters, user_id=user_uuid, collection_name="collections")
 
-            try:
-                if owned_collections:
-                    for collection in owned_collections.records:
-                        await catalogServices.delete_collection_record(document_id=collection.id, user_id=user_uuid)
-            except Exception as e:
-                raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"{str(e)}")
+            remaining = [ collection for collection in owned_collections.records if collection.status != "deleted" ] if owned_collections else []
+
+            if remaining:
+                for collection in remaining:
+                    # each collection is removed by its own job, an unfinished one is reused
+                    collection_job = await catalogServices.delete_collection_record(document_id=collection.id, user_id=user_uuid)
+
+                    collection_jobs[collection.id] = collection_job.id
+
+                await jobServices.save(job)
+
+                raise JobNotReady(f"waiting for the deletion of {len(remaining)} collections")
             
         if user_passport:
             await self.couchbaseRepo.delete_document(
                 collection_name="visa", document_key=user_passport.id
             )
 
-        requests.delete(url=passport_broker_url)
+        await PassportBrokerClient.delete_user(user_uuid=user_uuid)
+
+        # missing for users that never listed the catalog
+        result = await self.couchbaseRepo.delete_many(collection_name="collection_access", document_keys=[user_uuid])
+
+        if result.failed:
+            raise RuntimeError(f"Failed to delete the collection access of user {user_uuid}")
 
         await self.couchbaseRepo.delete_document(
             collection_name="info", document_key=user_uuid
         )
 
-        return user_uuid
+        RequestContextHandler.invalidate_user(user_uuid)
 
     async def create_user(
         self, payload: CreateUserPayload
     ) -> CouchbaseUserModelNoPassword:
-        from services.AuthServices import AuthServices
+        from services.AuthServices import get_auth_services
 
         user_search = await self.list_by_email(email=payload.email)
 
@@ -109,7 +186,7 @@ class UserServices:
                 detail=f"User {payload.email} already exists!"
             )
 
-        authServices = AuthServices()
+        authServices = get_auth_services()
 
         user_id = str(uuid6.uuid7())
 
@@ -130,15 +207,9 @@ class UserServices:
             value=full_payload.model_dump(exclude_none=True, exclude_unset=True),
         )
 
-        passport_broker_url = (
-            f"{self.passport_broker_url}/admin/ga4gh/passport/v1/users"
-        )
-
-        data = dict(id=user_id)
+        await PassportBrokerClient.create_user(user_uuid=user_id)
 
-        _ = requests.post(url=passport_broker_url, json=data)
-
-        settings = EnvSettings()
+        settings = get_settings()
 
         mailingClient = MailingClient()
 
@@ -160,8 +231,8 @@ class UserServices:
         )
         
         try:
-            mailingClient.send_email(
-                full_payload.email
+            await BlockingIOHandler.run(
+                mailingClient.send_email, full_payload.email
             )
         except Exception as _:
             HTTPException(
@@ -190,7 +261,7 @@ class UserServices:
 
         queryStatement = queryBuilder.where(field="email", op="=", value=email).build()
 
-        response = await self.couchbaseRepo.query(queryStatement)
+        response = await self.couchbaseRepo.query(statement=queryStatement, args=queryBuilder.args)
 
         if not response:
             return {}
@@ -200,6 +271,13 @@ class UserServices:
 
     async def list_info_by_user_id(
         self, user_uuid: str
+    ) -> CouchbaseUserModelNoPassword:
+        return await RequestContextHandler.memoize(
+            ("user", user_uuid), lambda: self.__fetch_info_by_user_id(user_uuid=user_uuid)
+        )
+
+    async def __fetch_info_by_user_id(
+        self, user_uuid: str
     ) -> CouchbaseUserModelNoPassword:
         response = await self.couchbaseRepo.get_document_by_id(
             collection_name="info", document_key=user_uuid
@@ -216,6 +294,13 @@ class UserServices:
 
     async def list_passport_by_user_id(
         self, user_uuid: str
+    ) -> CouchbaseUserAssertionModel:
+        return await RequestContextHandler.memoize(
+            ("passport", user_uuid), lambda: self.__fetch_passport_by_user_id(user_uuid=user_uuid)
+        )
+
+    async def __fetch_passport_by_user_id(
+        self, user_uuid: str
     ) -> CouchbaseUserAssertionModel:
         queryBuilder = CouchbaseQueryBuilder(
             scope=self.scope, collection="visa"
@@ -225,7 +310,7 @@ class UserServices:
             queryBuilder.select().where("user_uuid", op="=", value=user_uuid).build()
         )
 
-        response = await self.couchbaseRepo.query(statement=query)
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
 
         if not response:
             return {}
@@ -234,6 +319,58 @@ class UserServices:
 
         return list(response)[0]
 
+    async def get_collection_access(self, user_uuid: str) -> CouchbaseUserAccessModel:
+        """Ids of the collections the user holds a visa for, read from its materialized access document."""
+        return await RequestContextHandler.memoize(
+            ("collection_access", user_uuid), lambda: self.__fetch_collection_access(user_uuid=user_uuid)
+        )
+
+    async def __fetch_collection_access(self, user_uuid: str) -> CouchbaseUserAccessModel:
+        if not user_uuid:
+            return CouchbaseUserAccessModel(user_uuid="")
+
+        response = await self.couchbaseRepo.get_document_by_id(collection_name="collection_access", document_key=user_uuid)
+
+        if response:
+            return CouchbaseUserAccessModel(**response[0]["collection_access"])
+
+        user_passport = await self.__fetch_passport_by_user_id(user_uuid=user_uuid)
+
+        # no passport, no access: nothing is stored, so a user being deleted does not get its document back
+        if not user_passport:
+            return CouchbaseUserAccessModel(user_uuid=user_uuid)
+
+        # users whose visas were granted before the access documents existed
+        return await self.refresh_collection_access(user_uuid=user_uuid, user_passport=user_passport)
+
+    async def refresh_collection_access(
+        self, user_uuid: str, user_passport: CouchbaseUserAssertionModel = None
+    ) -> CouchbaseUserAccessModel:
+        """Rebuilds the access document of a user from its passport. Called whenever its visas change."""
+        if user_passport is None:
+            user_passport = await self.__fetch_passport_by_user_id(user_uuid=user_uuid)
+
+        collection_ids = set()
+
+        for visaAssertion in (user_passport.passportVisaAssertions if user_passport else None) or []:
+            # collection visas are named "<collection id>:<collection name>"
+            collection_id, _, _ = visaAssertion.passportVisa.visaName.partition(":")
+            collection_ids.add(collection_id)
+
+        access = CouchbaseUserAccessModel(
+            user_uuid=user_uuid,
+            collection_ids=sorted(collection_ids),
+            updated_at=int(datetime.timestamp(datetime.now()))
+        )
+
+        await self.couchbaseRepo.upsert_document(
+            collection_name="collection_access",
+            key=user_uuid,
+            value=access.model_dump()
+        )
+
+        return access
+
     async def list_users_by_visa_id(
         self, visa_uuid: str
     ) -> List[CouchbaseUserAssertionModel]:
@@ -254,7 +391,7 @@ class UserServices:
             .build()
         )
 
-        response = await self.couchbaseRepo.query(statement=query)
+        response = await self.couchbaseRepo.query(statement=query, args=queryBuilder.args)
 
         if not response:
             return {}
@@ -268,7 +405,7 @@ class UserServices:
     async def grant_visas_to_user(
         self, user_uuid: str, visa_uuids: list[str]
     ) -> CouchbaseUserAssertionModel:
-        from services.VisasServices import VisaServices  # To avoid circular import
+        from services.VisasServices import get_visa_services  # To avoid circular import
 
         user = await self.list_info_by_user_id(user_uuid)
 
@@ -278,16 +415,16 @@ class UserServices:
                 detail=f"Invalid or inexisting user id: f{user_uuid}"
             )
 
-        passport_broker_url = f"{self.passport_broker_url}/admin/ga4gh/passport/v1/users/{user_uuid}"
-
-        visaServices = VisaServices()
+        visaServices = get_visa_services()
 
         visas = list([])
 
         invalid_visas = list([])
 
+        requested_visas = await visaServices.get_by_ids(visa_uuids=visa_uuids)
+
         for id in visa_uuids:
-            response = await visaServices.get_by_id(visa_uuid=id)
+            response = requested_visas.get(id)
             if response:
                 visas.append(
                     VisaModel(
@@ -334,7 +471,7 @@ class UserServices:
             id=user_uuid, passportVisaAssertions=visa_assertions
         )
 
-        requests.put(url=passport_broker_url, json=new_passport_payload.model_dump())
+        await PassportBrokerClient.update_user_passport(user_uuid=user_uuid, passport=new_passport_payload.model_dump())
 
         # creating on couchbase
 
@@ -362,12 +499,16 @@ class UserServices:
             ),
         )
 
+        await self.refresh_collection_access(user_uuid=user_uuid, user_passport=new_couchbase_payload)
+
+        RequestContextHandler.invalidate_user(user_uuid)
+
         return new_couchbase_payload
 
     async def revoke_visas_from_user(
         self, user_uuid: str, visa_uuids: list[str]
     ) -> CouchbaseUserAssertionModel:
-        from services.VisasServices import VisaServices  # To avoid cisrcular import
+        from services.VisasServices import get_visa_services  # To avoid cisrcular import
 
         user = await self.list_info_by_user_id(user_uuid)
 
@@ -377,16 +518,16 @@ class UserServices:
                 detail=f"Error due to invalid or inexisting user id: f{user_uuid}"
             )
 
-        passport_broker_url = f"{self.passport_broker_url}/admin/ga4gh/passport/v1/users/{user_uuid}"
-
-        visaServices = VisaServices()
+        visaServices = get_visa_services()
 
         visas = list([])
 
         invalid_visas = list([])
 
+        requested_visas = await visaServices.get_by_ids(visa_uuids=visa_uuids)
+
         for id in visa_uuids:
-            response = await visaServices.get_by_id(visa_uuid=id)
+            response = requested_visas.get(id)
             if response:
                 visas.append(response)
             else:
@@ -416,9 +557,7 @@ class UserServices:
             id=user_uuid, passportVisaAssertions=updated_record.passportVisaAssertions
         )
 
-        response = requests.put(
-            url=passport_broker_url, json=new_passport_payload.model_dump()
-        )
+        await PassportBrokerClient.update_user_passport(user_uuid=user_uuid, passport=new_passport_payload.model_dump())
 
         await self.couchbaseRepo.upsert_document(
             collection_name="visa",
@@ -426,6 +565,10 @@ class UserServices:
             value=updated_record.model_dump(),
         )
 
+        await self.refresh_collection_access(user_uuid=user_uuid, user_passport=updated_record)
+
+        RequestContextHandler.invalidate_user(user_uuid)
+
         return updated_record
 
     async def password_recovery_request(self, payload: PasswordRecoveryRequest) -> str:
@@ -447,7 +590,7 @@ class UserServices:
             **dumped_user
         )
 
-        encryptionhandler = EncryptionHandler()
+        encryptionhandler = get_encryption_handler()
 
         recovery_token = encryptionhandler.encrypt_credentials(
             recovery_token_payload.model_dump(exclude_none=True, exclude_unset=True)
@@ -473,14 +616,14 @@ class UserServices:
             """
         )
 
-        mailingClient.send_email(user.email)
+        await BlockingIOHandler.run(mailingClient.send_email, user.email)
 
         return payload.user_email
 
     async def password_change_request(self, payload: PasswordChangeRequest) -> str:
-        from services.AuthServices import AuthServices
+        from services.AuthServices import get_auth_services
 
-        encryptionhandler = EncryptionHandler()
+        encryptionhandler = get_encryption_handler()
 
         decoded_token = encryptionhandler.decrypt_credentials(payload.token)
 
@@ -494,7 +637,7 @@ class UserServices:
                 detail="Expired token"
             )
 
-        authServices = AuthServices()
+        authServices = get_auth_services()
 
         new_decoded_password = authServices.word_to_hash(payload.new_password)
 
@@ -509,6 +652,8 @@ class UserServices:
             value=uploaded_user.model_dump(exclude_unset=True, exclude_none=True)
         )
 
+        RequestContextHandler.invalidate_user(user.id)
+
         mailingClient = MailingClient()
 
         mailingClient.add_subject(
@@ -525,7 +670,7 @@ class UserServices:
             """
         )
 
-        mailingClient.send_email(user.email)
+        await BlockingIOHandler.run(mailingClient.send_email, user.email)
 
         return user.email
 
@@ -537,9 +682,9 @@ class UserServices:
             owner_passport: CouchbaseUserAssertionModel = None, 
             user_id: str = None
     ) -> List[CouchbaseCatalogCollectionModel]:
-        from services.CatalogServices import CatalogServices
+        from services.CatalogServices import get_catalog_services
 
-        catalogServices = CatalogServices()
+        catalogServices = get_catalog_services()
         
         if user_id and user_id != owner_id:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Ownership transfers can only be requested by collection owners!")
@@ -585,3 +730,8 @@ class UserServices:
     
     # TODO implement update users
     # async def update_user() -> dict:
+
+
+@lru_cache(maxsize=1)
+def get_user_services() -> UserServices:
+    return UserServices()
@@ -1,30 +1,27 @@
-from typing import List
+import asyncio
+from functools import lru_cache
+from typing import Dict, List
 import uuid6
+from fastapi import HTTPException, status
 
-import requests
-from repositories.CouchbaseRepository import CouchbaseRepository
-from shared.models.env import EnvSettings
+from repositories.CouchbaseKVRepository import CouchbaseKVRepository
+from repositories.PassportBrokerClient import PassportBrokerClient
+from shared.handlers.RequestContextHandler import RequestContextHandler
+from shared.models.env import get_settings
+from shared.models.jobs import JobModel
 from shared.models.visas import AssertedVisaModel, CreateVisaPayload, VisaModel
 
 
 class VisaServices:
     def __init__(self) -> None:
-        settings = EnvSettings()
-
         self.scope = "users"
-        self.couchbaseRepo = CouchbaseRepository(
+        self.couchbaseRepo = CouchbaseKVRepository(
             scope=self.scope
         )
 
-        self.passport_broker_url = settings.PASSPORT_BROKER_SERVICE_URL
-
     async def create_visa(self, payload: CreateVisaPayload) -> VisaModel:
         visa_id = str(uuid6.uuid7())
 
-        passport_broker_url = (
-            f"{self.passport_broker_url}/admin/ga4gh/passport/v1/visas"
-        )
-
         body = VisaModel(
             id=visa_id,
             visaName=payload.visaName,
@@ -32,18 +29,40 @@ class VisaServices:
             visaDescription=payload.visaDescription,
         )
 
-        response = requests.post(url=passport_broker_url, json=body.model_dump())
+        created = await PassportBrokerClient.create_visa(visa=body.model_dump())
 
-        if not response or "error" in response:
+        if not created:
             return {}
 
         return body
 
+    async def schedule_visa_deletion(self, visa_uuid: str, user_id: str = None) -> JobModel:
+        """Queues the revocation and removal of a visa (see delete_visa). Returns the job."""
+        from services.JobServices import get_job_services
+
+        visa = await self.get_by_id(visa_uuid=visa_uuid)
+
+        if not visa:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Visa {visa_uuid} not found! Please provide a valid visa id")
+
+        jobServices = get_job_services()
+
+        unfinished = await jobServices.list_unfinished(job_type="visa_delete", payload_filters=dict(visa_uuid=visa_uuid))
+
+        if unfinished:
+            return unfinished[0]
+
+        return await jobServices.enqueue(job_type="visa_delete", payload=dict(visa_uuid=visa_uuid), user_id=user_id)
+
+    async def run_visa_deletion(self, job: JobModel) -> None:
+        """Handler of "visa_delete" jobs."""
+        await self.delete_visa(visa_uuid=job.payload["visa_uuid"])
+
     async def delete_visa(self, visa_uuid: str) -> str:
-        from services.CredentialServices import CredentialServices
-        from services.UserServices import UserServices
+        from services.CredentialServices import get_credential_services
+        from services.UserServices import get_user_services
 
-        userServices = UserServices()
+        userServices = get_user_services()
 
         # Removing visa from user's asserted visas document records
 
@@ -52,14 +71,18 @@ class VisaServices:
         if response:
             user_visas_map = response
 
-            for user_visas in user_visas_map:
-                await userServices.revoke_visas_from_user(
-                    user_uuid=user_visas.user_uuid, visa_uuids=[visa_uuid]
-                )
+            semaphore = asyncio.Semaphore(get_settings().COLLECTION_DELETE_CONCURRENCY)
+
+            async def revoke_from_user(user_uuid: str) -> None:
+                async with semaphore:
+                    await userServices.revoke_visas_from_user(user_uuid=user_uuid, visa_uuids=[visa_uuid])
+
+            # each user has its own passport document, so the revocations are independent
+            await asyncio.gather(*[revoke_from_user(user_visas.user_uuid) for user_visas in user_visas_map])
 
         # Removing visa from credentials document records
 
-        credentialServices = CredentialServices()
+        credentialServices = get_credential_services()
 
         credentials_per_visa = await credentialServices.list_by_visa_id(
             visa_uuid=visa_uuid
@@ -73,42 +96,36 @@ class VisaServices:
 
         # Removing visa from passport broker
 
-        passport_broker_url = f"{self.passport_broker_url}/admin/ga4gh/passport/v1/visas/{visa_uuid}"
-
-        requests.delete(url=passport_broker_url)
+        await PassportBrokerClient.delete_visa(visa_uuid=visa_uuid)
 
         return visa_uuid
 
     async def list_all(self) -> List[VisaModel]:
-        passport_broker_url = (
-            f"{self.passport_broker_url}/admin/ga4gh/passport/v1/visas"
-        )
-
-        response = requests.get(url=passport_broker_url)
-
-        if not response or "error" in response:
-            return []
-
-        passport_visas = response.json()
+        passport_visas = await PassportBrokerClient.list_visas()
 
         return [VisaModel(**visa) for visa in passport_visas]
 
     async def get_by_id(self, visa_uuid: str) -> AssertedVisaModel:
-        passport_broker_url = f"{self.passport_broker_url}/admin/ga4gh/passport/v1/visas/{visa_uuid}"
+        response = await PassportBrokerClient.get_visa(visa_uuid=visa_uuid)
 
-        response = requests.get(url=passport_broker_url)
-
-        if not response or "error" in response:
+        if not response:
             return {}
 
-        response = response.json()
-
         return AssertedVisaModel(**response)
 
+    async def get_by_ids(self, visa_uuids: List[str]) -> Dict[str, AssertedVisaModel]:
+        """Fetch several visas concurrently. Unknown ids map to an empty dict, like get_by_id."""
+        response = await PassportBrokerClient.get_visas(visa_uuids=visa_uuids)
+
+        return {
+            visa_uuid: AssertedVisaModel(**visa) if visa else {}
+            for visa_uuid, visa in response.items()
+        }
+
     async def update_visa(self, payload: AssertedVisaModel) -> VisaModel:
-        from services.UserServices import UserServices
+        from services.UserServices import get_user_services
 
-        userServices = UserServices()
+        userServices = get_user_services()
 
         response = await userServices.list_users_by_visa_id(visa_uuid=payload.id)
 
@@ -123,24 +140,41 @@ class VisaServices:
                         )
                         visaAssertions.passportVisa.visaSecret = payload.visaSecret
 
+        result = await self.couchbaseRepo.upsert_many(
+            collection_name="visa",
+            documents={
+                user_assertion.id: user_assertion.model_dump(exclude_none=True, exclude_unset=True)
+                for user_assertion in response
+            },
+        )
+
+        # the visa name carries the collection id
+        await asyncio.gather(*[
+            userServices.refresh_collection_access(user_uuid=user_assertion.user_uuid, user_passport=user_assertion)
+            for user_assertion in response if user_assertion.id not in result.failed
+        ])
+
         for user_assertion in response:
-            await self.couchbaseRepo.upsert_document(
-                collection_name="visa",
-                key=user_assertion.id,
-                value=user_assertion.model_dump(exclude_none=True, exclude_unset=True),
-            )
+            RequestContextHandler.invalidate_user(user_assertion.user_uuid)
 
-        passport_broker_url = f"{self.passport_broker_url}/admin/ga4gh/passport/v1/visas/{payload.id}"
+        if result.failed:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Failed to update the visa on the following user assertions: {list(result.failed.keys())}"
+            )
 
         body = payload.model_dump()
 
-        response = requests.put(url=passport_broker_url, json=body)
+        response = await PassportBrokerClient.update_visa(visa_uuid=payload.id, visa=body)
 
-        if not response or "error" in response:
+        if not response:
             return {}
 
-        response = response.json()
-
         response = VisaModel(**response)
 
         return response
+
+
+@lru_cache(maxsize=1)
+def get_visa_services() -> VisaServices:
+    return VisaServices()
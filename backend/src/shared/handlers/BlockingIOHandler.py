@@ -0,0 +1,120 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from shared.models.env import EnvSettings, get_settings
+from shared.models.metrics import BlockingIOMetrics
+
+
+class BlockingIOHandler:
+    """
+    Bounded thread pool for the synchronous clients (requests, boto3,
+    google-cloud-storage, resend) used from async handlers.
+
+        response = await BlockingIOHandler.run(requests.get, url, timeout=10)
+
+    Running these calls inline would block the event loop, and every
+    concurrent request with it, for the whole network round trip. The pool is
+    created lazily with BLOCKING_IO_MAX_WORKERS threads and shut down with the
+    application (see the lifespan handler in app.py). Calls beyond the pool
+    size wait in the executor queue, which shows up as queued/average_wait_ms
+    in the metrics.
+    """
+
+    _executor: ThreadPoolExecutor = None
+    _max_workers: int = 0
+
+    _queued: int = 0
+    _running: int = 0
+    _peak_running: int = 0
+    _tasks_total: int = 0
+    _errors_total: int = 0
+    _wait_total: float = 0.0
+    _run_total: float = 0.0
+
+    @classmethod
+    def open(cls, settings: EnvSettings = None) -> ThreadPoolExecutor:
+        if cls._executor is not None:
+            return cls._executor
+
+        settings = settings if settings else get_settings()
+
+        cls._max_workers = settings.BLOCKING_IO_MAX_WORKERS
+        cls._executor = ThreadPoolExecutor(max_workers=cls._max_workers, thread_name_prefix="blocking-io")
+
+        return cls._executor
+
+    @classmethod
+    def close(cls) -> None:
+        if cls._executor is None:
+            return
+
+        cls._executor.shutdown(wait=False, cancel_futures=True)
+        cls._executor = None
+
+    @classmethod
+    async def run(cls, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking callable in the pool and await its result."""
+        executor = cls.open()
+        loop = asyncio.get_running_loop()
+
+        submitted_at = time.perf_counter()
+        cls._queued += 1
+
+        # taken by the worker starting the call or by the caller giving up on it, whichever comes first
+        dequeue = threading.Lock()
+
+        def timed_call() -> Any:
+            started_at = time.perf_counter()
+
+            # counters are only touched from the event loop thread
+            loop.call_soon_threadsafe(cls.__on_start, started_at - submitted_at, dequeue.acquire(blocking=False))
+
+            try:
+                return func(*args, **kwargs)
+            finally:
+                loop.call_soon_threadsafe(cls.__on_finish, time.perf_counter() - started_at)
+
+        try:
+            return await loop.run_in_executor(executor, timed_call)
+        except Exception:
+            cls._errors_total += 1
+            raise
+        finally:
+            # cancelled before a worker picked the call up (client disconnect, shutdown)
+            if dequeue.acquire(blocking=False):
+                cls._queued -= 1
+
+    @classmethod
+    def __on_start(cls, waited: float, dequeued: bool) -> None:
+        if dequeued:
+            cls._queued -= 1
+
+        cls._running += 1
+        cls._peak_running = max(cls._peak_running, cls._running)
+        cls._wait_total += waited
+
+    @classmethod
+    def __on_finish(cls, elapsed: float) -> None:
+        cls._running -= 1
+        cls._tasks_total += 1
+        cls._run_total += elapsed
+
+    @classmethod
+    def metrics(cls) -> BlockingIOMetrics:
+        average_wait_ms = (cls._wait_total / cls._tasks_total) * 1000 if cls._tasks_total else 0.0
+        average_run_ms = (cls._run_total / cls._tasks_total) * 1000 if cls._tasks_total else 0.0
+
+        return BlockingIOMetrics(
+            is_open=cls._executor is not None,
+            max_workers=cls._max_workers,
+            queued=cls._queued,
+            running=cls._running,
+            peak_running=cls._peak_running,
+            tasks_total=cls._tasks_total,
+            errors_total=cls._errors_total,
+            average_wait_ms=round(average_wait_ms, 3),
+            average_run_ms=round(average_run_ms, 3),
+        )
@@ -1,12 +1,19 @@
-from typing import List, Literal, Union
+from typing import List, Literal, Tuple, Union
 import copy
+import re
 
-from shared.models.env import EnvSettings
+from shared.models.env import get_settings
 
-Operator = Literal[">","<","=","!=",">=","<=", "%"]
+Operator = Literal[">","<","=","!=",">=","<=", "%", "IN", "LIKE"]
 
 Direction = Literal["ASC", "DESC"]
 
+# field paths (name, payload.key), quoted as `payload`.`key`
+FIELD_PATH_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+# single function calls over field names and literals, e.g. IFMISSINGORNULL(secret, false)
+FUNCTION_PATTERN = re.compile(r"^[A-Z_]+\([A-Za-z0-9_., ]*\)$")
+
 class CouchbaseQueryBuilder:
     """ Query Order
         query_builder
@@ -16,9 +23,16 @@ class CouchbaseQueryBuilder:
         .where("school", "!=", "university")
         .order_by_field("age", "DESC")
         .limit_to(10)
+        .offset(20)
+
+        Field names are quoted as identifiers, anything else than a field path or a
+        single function call over fields is rejected with a ValueError.
+        Values are emitted as positional parameters ($1, $2, ...). After build(),
+        the matching values are in `args` and must be sent along with the statement:
+        couchbaseRepo.query(statement=query_builder.build(), args=query_builder.args)
     """
     def __init__(self, scope:str, collection:str):
-        settings = EnvSettings()
+        settings = get_settings()
 
         self.bucket = settings.COUCHBASE_BUCKET
 
@@ -27,9 +41,12 @@ class CouchbaseQueryBuilder:
 
         self.select_fields = "*"
         self.filters: List[str] = []
+        self.filter_args: List[any] = []
+        self.args: List[any] = []
         self.limit: Union[int, None] = None
-        self.offset: Union[int, None] = None
+        self.skip: Union[int, None] = None
         self.order_by: Union[str, None] = None
+        self.group_by: Union[str, None] = None
     
 
     def select(self, fields: Union[List[str], str] = "*", count: bool = False):
@@ -47,14 +64,48 @@ class CouchbaseQueryBuilder:
             self.select_fields = fields
         return self
 
+    def __param(self, value: any) -> str:
+        self.filter_args.append(value)
+        return f"${len(self.filter_args)}"
+
+    def __identifier(self, field: str) -> str:
+        if FIELD_PATH_PATTERN.match(field):
+            return ".".join(f"`{part}`" for part in field.split("."))
+
+        if FUNCTION_PATTERN.match(field):
+            return field
+
+        raise ValueError(f"Invalid field name: {field}")
+
+    def __condition(self, field: str, op: Operator, value: any) -> str:
+        return f"{self.__identifier(field)} {op} {self.__param(value)}"
+
     def where(self, field: str, op: Operator, value:any):
         """
         Add filtering conditions to the query.
         """
-        if isinstance(value, str):
-            self.filters.append(f"{field} {op} '{value}'")
-        else:
-            self.filters.append(f"{field} {op} {value}")
+        self.filters.append(self.__condition(field, op, value))
+        return self
+
+    def where_any_of(self, conditions: List[Tuple[str, Operator, any]]):
+        """
+        Add a group of conditions joined by OR, e.g.
+        [("public", "=", True), ("collection_name", "IN", ["a", "b"])]
+        """
+        if not conditions:
+            return self
+
+        group = " OR ".join(self.__condition(field, op, value) for field, op, value in conditions)
+        self.filters.append(f"({group})")
+        return self
+
+    def group_filters(self):
+        """
+        Enclose the conditions added so far in parentheses, so the ones added next
+        are ANDed with the group as a whole.
+        """
+        if self.filters:
+            self.filters = [f"({' AND '.join(self.filters)})"]
         return self
     
     def ilike(self, field: str, value:str):
@@ -62,9 +113,9 @@ class CouchbaseQueryBuilder:
         Add filtering conditions to the query.
         """
         if isinstance(value, str):
-            self.filters.append(f"LOWER({field}) LIKE '%{value.lower()}%'")
+            self.filters.append(f"LOWER({self.__identifier(field)}) LIKE {self.__param(f'%{value.lower()}%')}")
         else:
-            self.filters.append(f"LOWER({field}) LIKE '%'")
+            self.filters.append(f"LOWER({self.__identifier(field)}) LIKE '%'")
         return self
     
     def where_any(self, target: str, in_filed: str, op: Operator, value:any, satisfies=None):
@@ -74,17 +125,17 @@ class CouchbaseQueryBuilder:
         if not satisfies:
             satisfies = target
 
-        if isinstance(value, str):
-            self.filters.append(f"ANY {target} IN {in_filed} SATISFIES {satisfies} {op} '{value}' END")
-        else:
-            self.filters.append(f"ANY {target} IN {in_filed} SATISFIES {satisfies} {op} {value} END")
+        self.filters.append(
+            f"ANY {self.__identifier(target)} IN {self.__identifier(in_filed)} "
+            f"SATISFIES {self.__identifier(satisfies)} {op} {self.__param(value)} END"
+        )
         return self
     
     def where_in(self, target: str, in_values: list[any]):
         """
         Add filtering conditions to the query.
         """
-        self.filters.append(f"{target} IN {in_values}")
+        self.filters.append(f"{self.__identifier(target)} IN {self.__param(list(in_values))}")
 
         return self
     
@@ -92,7 +143,7 @@ class CouchbaseQueryBuilder:
         """
         Add filtering conditions to the query.
         """
-        self.filters.append(f"ARRAY_LENGTH(ARRAY_INTERSECT({target}, {in_values})) > 0;")
+        self.filters.append(f"ARRAY_LENGTH(ARRAY_INTERSECT({self.__identifier(target)}, {self.__param(list(in_values))})) > 0")
 
         return self
 
@@ -107,7 +158,14 @@ class CouchbaseQueryBuilder:
         """
         Set an offset number.
         """
-        self.offset = skip
+        self.skip = skip
+        return self
+
+    def group_by_fields(self, fields: List[str]):
+        """
+        Group the results, to be combined with aggregates in select().
+        """
+        self.group_by = "GROUP BY " + ", ".join(f"`{field}`" for field in fields)
         return self
 
     def order_by_field(self, field: str, direction: Direction = "ASC"):
@@ -119,24 +177,41 @@ class CouchbaseQueryBuilder:
 
     def build(self):
         """
-        Build and return the final N1QL query.
+        Build and return the final N1QL query. The parameter values are set on `args`.
         """
+        args = list(self.filter_args)
+
         query = f"SELECT {self.select_fields} FROM `{self.bucket}`.`{self.scope}`.`{self.collection}`"
         
         if self.filters:
             query += " WHERE " + " AND ".join(self.filters)
+
+        if self.group_by:
+            query += f" {self.group_by}"
         
         if self.order_by:
             query += f" {self.order_by}"
         
         if self.limit:
-            query += f" LIMIT {self.limit}"
+            args.append(self.limit)
+            query += f" LIMIT ${len(args)}"
+
+        if self.skip:
+            args.append(self.skip)
+            query += f" OFFSET ${len(args)}"
 
-        if self.offset:
-            query += f" {self.offset}"
+        self.args = args
         
         return query
     
     def instance_copy(self, deep=False):
         """Return a copy of this instance."""
-        return copy.deepcopy(self) if deep else copy.copy(self)
\ No newline at end of file
+        return copy.deepcopy(self) if deep else copy.copy(self)
+
+    def count_copy(self):
+        """Return a copy of this instance counting the matching rows (no ordering or paging)."""
+        counter = self.instance_copy(deep=True).select(count=True)
+        counter.order_by = None
+        counter.limit = None
+        counter.skip = None
+        return counter
@@ -1,12 +1,13 @@
 import json
+from functools import lru_cache
 from cryptography.fernet import Fernet
 
-from shared.models.env import EnvSettings
+from shared.models.env import get_settings
 class EncryptionHandler:
     # FUNCTIONS
 
     def __init__(self) -> None:
-        settings = EnvSettings()
+        settings = get_settings()
         self.secret_key = settings.ENCRYPTION_SECRET_KET
 
     def generate_secret_key(self) -> str:
@@ -49,4 +50,9 @@ class EncryptionHandler:
         """
         fernet = Fernet(self.secret_key.encode())
         decrypted_credentials_json = fernet.decrypt(encrypted_credentials.encode())        
-        return json.loads(decrypted_credentials_json.decode())
\ No newline at end of file
+        return json.loads(decrypted_credentials_json.decode())
+
+
+@lru_cache(maxsize=1)
+def get_encryption_handler() -> EncryptionHandler:
+    return EncryptionHandler()
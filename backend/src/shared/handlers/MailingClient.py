@@ -1,10 +1,10 @@
 import resend
-from shared.models.env import EnvSettings
+from shared.models.env import get_settings
 
 class MailingClient:
     def __init__(self, sender_email:str = None):
 
-        settings = EnvSettings()
+        settings = get_settings()
 
         self.resend_api_key = settings.EMAIL_SERVICE_KEY        
         resend.api_key = self.resend_api_key
@@ -0,0 +1,71 @@
+import asyncio
+from contextvars import ContextVar, Token
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+
+class RequestContext:
+    """Values memoized for the lifetime of a single HTTP request."""
+
+    def __init__(self, user_id: str = None) -> None:
+        self.user_id = user_id
+        self.values: Dict[Hashable, Any] = {}
+        self.locks: Dict[Hashable, asyncio.Lock] = {}
+
+
+_request_context: ContextVar[Optional[RequestContext]] = ContextVar("request_context", default=None)
+
+
+class RequestContextHandler:
+    """
+    Request-scoped memoization of lookups repeated across services.
+
+    The authentication middleware starts a context for every authenticated
+    request and resets it once the response is produced. Services wrap their
+    lookups with memoize(), so within one request each key is loaded at most
+    once, even when several coroutines ask for it concurrently. Outside of a
+    request (scripts, startup tasks) memoize() simply calls the loader.
+
+    Keys are tuples whose second item is the user id the value belongs to,
+    e.g. ("passport", user_id). Writes affecting a user must call
+    invalidate_user() so later reads in the same request see the new state.
+    """
+
+    @staticmethod
+    def start(user_id: str = None) -> Token:
+        return _request_context.set(RequestContext(user_id=user_id))
+
+    @staticmethod
+    def reset(token: Token) -> None:
+        _request_context.reset(token)
+
+    @staticmethod
+    def current() -> Optional[RequestContext]:
+        return _request_context.get()
+
+    @staticmethod
+    async def memoize(key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        context = _request_context.get()
+
+        if context is None:
+            return await loader()
+
+        if key in context.values:
+            return context.values[key]
+
+        lock = context.locks.setdefault(key, asyncio.Lock())
+
+        async with lock:
+            if key not in context.values:
+                context.values[key] = await loader()
+
+        return context.values[key]
+
+    @staticmethod
+    def invalidate_user(user_id: str) -> None:
+        context = _request_context.get()
+
+        if context is None:
+            return
+
+        for key in [key for key in context.values if isinstance(key, tuple) and key[1:2] == (user_id,)]:
+            context.values.pop(key, None)
@@ -0,0 +1,33 @@
+from typing import Dict, List, Literal
+
+from pydantic import BaseModel
+
+
+class BulkOperationResult(BaseModel):
+    """Per-key outcome of a bulk repository call (upsert_many, get_many, delete_many, update_where)."""
+
+    status: Literal["success", "partial", "failed"] = "success"
+    succeeded: List[str] = []
+    missing: List[str] = []
+    failed: Dict[str, str] = {}
+    results: List[dict] = []
+
+    def add_succeeded(self, keys: List[str]) -> None:
+        self.succeeded.extend(keys)
+
+    def add_missing(self, keys: List[str]) -> None:
+        self.missing.extend(keys)
+
+    def add_failed(self, keys: List[str], error: Exception) -> None:
+        for key in keys:
+            self.failed[key] = str(error)
+
+    def finish(self) -> "BulkOperationResult":
+        if not self.failed:
+            self.status = "success"
+        elif self.succeeded or self.missing:
+            self.status = "partial"
+        else:
+            self.status = "failed"
+
+        return self
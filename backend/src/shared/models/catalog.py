@@ -1,8 +1,8 @@
 
-from typing import List, Literal, Optional
+from typing import List, Literal, Optional, Union
 from pydantic import BaseModel
 
-FileStatus = Literal["ready", "processing", "uploading", "deleted"]
+FileStatus = Literal["ready", "processing", "uploading", "deleting", "deleted"]
 
 CatalogProcessingLevelFilter = Literal["raw", "processed", "curated"]
 
@@ -11,9 +11,12 @@ FilterOperators = Literal["=",">","<", ">=", "<=", '*', "!="]
 FileCategory = Literal["structured", "unstructured"]
 
 CatalogType = Literal["files", "collections"]
+
+CatalogStatsGroup = Literal["collection", "storage_type", "processing_level", "file_status"]
 class CatalogFileBaseModel(BaseModel):
     file_name: Optional[str] = None
     file_size: Optional[int] = None
+    file_checksum: Optional[str] = None
     collection_id: Optional[str] = None
     collection_name: Optional[str] = None
     processing_level: Optional[str] = None
@@ -54,6 +57,7 @@ class CatalogFilter(BaseModel):
 class CatalogFilterPayload(BaseModel):
     filters: List[CatalogFilter]
     page_number: Optional[int] = 1
+    page_token: Optional[str] = None
     # processing_level: Optional[CatalogProcessingLevelFilter] = None
 
 class SetRecordStatusPayload(BaseModel):
@@ -63,9 +67,37 @@ class SetRecordStatusPayload(BaseModel):
 class GetFilesCatalogResponse(BaseModel):
     records: List[CouchbaseCatalogFileModel]
     next_page: Optional[int] = None
+    next_token: Optional[str] = None
     total: Optional[int] = None
 
 class GetCollectionsCatalogResponse(BaseModel):
     records: List[CouchbaseCatalogCollectionModel]
     next_page: Optional[int] = None
-    total: Optional[int] = None
\ No newline at end of file
+    next_token: Optional[str] = None
+    total: Optional[int] = None
+
+class CatalogStatsRow(BaseModel):
+    collection_id: Optional[str] = None
+    collection_name: Optional[str] = None
+    storage_type: Optional[str] = None
+    processing_level: Optional[str] = None
+    file_status: Optional[str] = None
+    file_count: int = 0
+    total_size: int = 0
+    latest_version: Optional[int] = None
+    last_inserted_at: Optional[int] = None
+
+class CatalogStatsResponse(BaseModel):
+    group_by: List[CatalogStatsGroup] = []
+    totals: CatalogStatsRow
+    groups: List[CatalogStatsRow] = []
+    computed_at: int
+
+class CatalogSearchHit(BaseModel):
+    score: float
+    record: Union[CouchbaseCatalogFileModel, CouchbaseCatalogCollectionModel]
+
+class CatalogSearchResponse(BaseModel):
+    hits: List[CatalogSearchHit]
+    next_page: Optional[int] = None
+    total: int = 0
@@ -1,17 +1,70 @@
+from functools import lru_cache
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 class EnvSettings(BaseSettings):
     BACKEND_ENV: str = None
     EMAIL_SERVICE_KEY: str = None
     PASSPORT_BROKER_SERVICE_URL: str = None
+    PASSPORT_BROKER_MAX_CONNECTIONS: int = 20
+    PASSPORT_BROKER_TIMEOUT_SECONDS: float = 10.0
+    PASSPORT_BROKER_MAX_RETRIES: int = 3
+    PASSPORT_BROKER_RETRY_BACKOFF_SECONDS: float = 0.2
+    PASSPORT_BROKER_CONCURRENCY: int = 10
+    PASSPORT_BROKER_VISA_CACHE_TTL_SECONDS: float = 30.0
     COUCHBASE_HOST: str = None
     COUCHBASE_USER: str = None
     COUCHBASE_PASSWORD: str = None
     COUCHBASE_BUCKET: str = None
+    COUCHBASE_MAX_CONNECTIONS: int = 100
+    COUCHBASE_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    COUCHBASE_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    COUCHBASE_REQUEST_TIMEOUT_SECONDS: float = 30.0
+    COUCHBASE_POOL_TIMEOUT_SECONDS: float = 10.0
+    COUCHBASE_KV_ENABLED: bool = True
+    COUCHBASE_KV_TIMEOUT_SECONDS: float = 2.5
+    COUCHBASE_KV_BATCH_CONCURRENCY: int = 32
+    COUCHBASE_BULK_CHUNK_SIZE: int = 500
+    COUCHBASE_RECONCILE_INDEXES: bool = True
+    COUCHBASE_EXPLAIN_QUERIES: bool = False
     ENCRYPTION_SECRET_KET: str = None
+    CREDENTIALS_CACHE_TTL_SECONDS: float = 300.0
+    STORAGE_CLIENT_POOL_SIZE: int = 32
+    WEBHDFS_POOL_CONNECTIONS: int = 10
+    WEBHDFS_POOL_MAXSIZE: int = 20
+    STORAGE_HTTP_TIMEOUT_SECONDS: float = 30.0
+    BLOCKING_IO_MAX_WORKERS: int = 32
+    COLLECTION_DELETE_PAGE_SIZE: int = 1000
+    COLLECTION_DELETE_CONCURRENCY: int = 8
+    UPLOAD_URL_CONCURRENCY: int = 16
+    JOB_WORKERS: int = 4
+    JOB_MAX_ATTEMPTS: int = 3
+    JOB_RETRY_DELAY_SECONDS: float = 30.0
+    UPLOAD_SESSION_PART_SIZE: int = 64 * 1024 * 1024
+    UPLOAD_SESSION_EXPIRY_SECONDS: int = 24 * 60 * 60
+    STREAM_PROXY_PART_SIZE: int = 16 * 1024 * 1024
+    STREAM_PROXY_CHUNK_SIZE: int = 1024 * 1024
+    STREAM_PROXY_MAX_UPLOADS: int = 8
+    UPLOAD_SWEEP_INTERVAL_SECONDS: float = 300.0
+    UPLOAD_SWEEP_GRACE_SECONDS: float = 3600.0
+    UPLOAD_SWEEP_BATCH_SIZE: int = 500
+    UPLOAD_SWEEP_CONCURRENCY: int = 16
+    UPLOAD_SWEEP_DELETE_STALE: bool = True
+    CATALOG_STATS_CACHE_TTL_SECONDS: float = 60.0
+    CATALOG_STATS_MAX_STALE_SECONDS: float = 600.0
+    CATALOG_STATS_CACHE_SIZE: int = 1000
+    CATALOG_SEARCH_PAGE_SIZE: int = 20
+    CATALOG_SEARCH_FUZZINESS: int = 1
+    STORAGE_EVENTS_TOKEN: Optional[str] = None
+    STORAGE_EVENTS_BATCH_SIZE: int = 500
+    STORAGE_EVENTS_FLUSH_SECONDS: float = 1.0
+    STORAGE_EVENTS_QUEUE_SIZE: int = 10000
+    STORAGE_EVENTS_SPOOL_DIR: Optional[str] = None
     AUTH_SECRET_KEY: str = None        
     REFRESH_TOKEN_KEY: str = None      
     AUTH_ALGORITHM: str = None
+    AUTH_TOKEN_CACHE_SIZE: int = 10000
     EXPIRATION_TIME_MINUTES: int = None
     FRONTEND_URL: str = None
     DOCUMENTATION_URL: str = None
@@ -21,4 +74,10 @@ class EnvSettings(BaseSettings):
     class Config:
         env_file = ".env"
         env_file_encoding = 'utf-8'
-        extra = 'allow'  # Allows extra environment variables
\ No newline at end of file
+        extra = 'allow'  # Allows extra environment variables
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> EnvSettings:
+    """Process-wide settings, read from the environment and .env once."""
+    return EnvSettings()
@@ -0,0 +1,19 @@
+from typing import List, Optional
+from pydantic import BaseModel
+
+
+class CouchbaseIndexDefinition(BaseModel):
+    name: str
+    scope: str
+    collection: str
+    keys: List[str]
+    condition: Optional[str] = None
+
+
+class CouchbaseSearchIndexDefinition(BaseModel):
+    name: str
+    scope: str
+    collection: str
+    text_fields: List[str]
+    keyword_fields: List[str] = []
+    boolean_fields: List[str] = []
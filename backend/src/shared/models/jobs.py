@@ -0,0 +1,20 @@
+from typing import Literal, Optional
+
+from pydantic import BaseModel
+
+JobStatus = Literal["pending", "running", "completed", "failed", "cancelled"]
+
+JobType = Literal["collection_delete", "user_delete", "visa_delete"]
+
+
+class JobModel(BaseModel):
+    id: str
+    job_type: JobType
+    status: JobStatus = "pending"
+    user_id: Optional[str] = None
+    payload: dict = {}
+    progress: dict = {}
+    error: Optional[str] = None
+    attempts: int = 0
+    created_at: Optional[int] = None
+    updated_at: Optional[int] = None
@@ -0,0 +1,60 @@
+from typing import Optional
+from pydantic import BaseModel
+
+
+class ConnectionPoolMetrics(BaseModel):
+    is_open: bool
+    max_connections: int
+    max_keepalive_connections: int
+    open_connections: Optional[int] = None
+    idle_connections: Optional[int] = None
+    in_flight: int
+    peak_in_flight: int
+    requests_total: int
+    errors_total: int
+    average_latency_ms: float
+
+
+class StorageClientPoolMetrics(BaseModel):
+    max_size: int
+    size: int
+    hits: int
+    misses: int
+    evictions: int
+    hdfs_session_open: bool
+
+
+class BlockingIOMetrics(BaseModel):
+    is_open: bool
+    max_workers: int
+    queued: int
+    running: int
+    peak_running: int
+    tasks_total: int
+    errors_total: int
+    average_wait_ms: float
+    average_run_ms: float
+
+
+class UploadSweeperMetrics(BaseModel):
+    is_running: bool
+    interval_seconds: float
+    runs_total: int
+    errors_total: int
+    records_checked: int
+    records_promoted: int
+    records_removed: int
+    last_run_at: Optional[int] = None
+    last_run_ms: float
+
+
+class StorageEventMetrics(BaseModel):
+    is_running: bool
+    queued: int
+    received_total: int
+    ignored_total: int
+    matched_total: int
+    unmatched_total: int
+    errors_total: int
+    batches_total: int
+    average_batch_ms: float
@@ -1,6 +1,6 @@
 from typing import List, Literal, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from shared.models.catalog import CouchbaseCatalogCollectionModel
 from shared.models.visas import VisaModel
@@ -11,6 +11,8 @@ Collections = Literal['files', 'collections']
 FileCategory = Literal["structured", "unstructured"]
 FileProcessingLevel = Literal["raw", "processed", "curated"]
 
+STORAGE_BATCH_MAX_FILES = 1000
+
 class UploadFileRequestPayload(BaseModel):
     collection_catalog_id: str 
     file_name: str 
@@ -21,9 +23,37 @@ class UploadFileRequestPayload(BaseModel):
     processing_level: Optional[FileProcessingLevel] = "raw"
     file_description: Optional[str] = None
 
+class UploadFileBatchItem(BaseModel):
+    file_name: str 
+    file_category: FileCategory
+    file_version: Optional[int] = 1
+    file_size: Optional[int] = None
+    public: Optional[bool] = False
+    processing_level: Optional[FileProcessingLevel] = "raw"
+    file_description: Optional[str] = None
+
+class CreateUploadSessionPayload(UploadFileRequestPayload):
+    file_size: int = Field(gt=0)
+    part_size: Optional[int] = Field(default=None, gt=0)
+
+class CompletedUploadPart(BaseModel):
+    part_number: int = Field(ge=1)
+    etag: str
+
+class CompleteUploadSessionPayload(BaseModel):
+    # S3 only, listed from the storage when omitted
+    parts: Optional[List[CompletedUploadPart]] = None
+
+class UploadFileBatchRequestPayload(BaseModel):
+    collection_catalog_id: str
+    files: List[UploadFileBatchItem] = Field(min_length=1, max_length=STORAGE_BATCH_MAX_FILES)
+
 class DownloadFileRequestPayload(BaseModel):
     catalog_file_id: str
 
+class DownloadFileBatchRequestPayload(BaseModel):
+    catalog_file_ids: List[str] = Field(min_length=1, max_length=STORAGE_BATCH_MAX_FILES)
+
 class CreateCollectionPayload(BaseModel):
     storage_type: Storage
     collection_name: str
@@ -42,9 +72,60 @@ class UploadFileRequestResponse(BaseModel):
     method: str
     catalog_record_id: str
 
+UploadSessionStatus = Literal["open", "completed", "aborted"]
+
+class UploadSessionModel(BaseModel):
+    id: str
+    catalog_record_id: str
+    user_id: str
+    storage_type: Storage
+    location: str
+    blob_name: str
+    file_size: int
+    part_size: int
+    part_count: int
+    upload_id: Optional[str] = None  # S3 multipart upload id
+    session_url: Optional[str] = None  # GCS resumable session uri, WebHDFS append url
+    status: UploadSessionStatus = "open"
+    created_at: int
+    expires_at: int
+
+class UploadSessionPart(BaseModel):
+    part_number: int
+    offset: int
+    size: int
+    upload_url: Optional[str] = None  # None once the part is uploaded
+    method: str
+    uploaded: bool = False
+
+class UploadSessionResponse(BaseModel):
+    session_id: str
+    catalog_record_id: str
+    storage_type: Storage
+    status: UploadSessionStatus
+    file_size: int
+    part_size: int
+    parallel: bool  # parts can be uploaded concurrently, otherwise in order
+    uploaded_bytes: int = 0
+    parts: List[UploadSessionPart] = []
+    expires_at: int
+
+class UploadFileBatchResponseItem(UploadFileRequestResponse):
+    file_name: str
+    file_version: int
+
+class UploadFileBatchRequestResponse(BaseModel):
+    files: List[UploadFileBatchResponseItem]
+
 class DownloadFileRequestResponse(BaseModel):
     download_url: str
 
+class DownloadFileBatchResponseItem(DownloadFileRequestResponse):
+    catalog_file_id: str
+
+class DownloadFileBatchRequestResponse(BaseModel):
+    files: List[DownloadFileBatchResponseItem]
+
 class StorageBucketItem(BaseModel):
     storage_type: Storage
     bucket_name: str
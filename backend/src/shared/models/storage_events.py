@@ -0,0 +1,19 @@
+from typing import Optional
+
+from pydantic import BaseModel
+
+from shared.models.storage import Storage
+
+
+class StorageEvent(BaseModel):
+    """An object written to a storage backend, whatever the notification format it came from."""
+
+    storage_type: Storage
+    bucket: str  # bucket name, or namenode for hdfs
+    blob_name: str
+    file_size: Optional[int] = None
+    file_checksum: Optional[str] = None  # "<algorithm>:<value>", e.g. "md5:9e107d9d372bb6826bd81d3542a419d6"
+
+
+class StorageEventsAccepted(BaseModel):
+    accepted: int
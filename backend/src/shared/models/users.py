@@ -59,5 +59,11 @@ class PassportUserAssertionModel(BaseModel):
 class CouchbaseUserAssertionModel(PassportUserAssertionModel):
     user_uuid: Optional[str] = None
 
+class CouchbaseUserAccessModel(BaseModel):
+    """Collections a user holds a visa for, materialized from the passport (users.collection_access, keyed by user id)."""
+    user_uuid: str
+    collection_ids: List[str] = []
+    updated_at: Optional[int] = None
+
 class AssertUserVisasPayload(BaseModel):
     visas_uuids: List[str]
\ No newline at end of file
@@ -0,0 +1,29 @@
+import os
+import sys
+
+# the application imports its modules from backend/src (see the uvicorn --app-dir in the Dockerfile)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+# settings without a default (see shared/models/env.py), the tests never reach the services behind them
+TEST_SETTINGS = {
+    "BACKEND_ENV": "test",
+    "EMAIL_SERVICE_KEY": "test",
+    "PASSPORT_BROKER_SERVICE_URL": "http://127.0.0.1:9",
+    "COUCHBASE_HOST": "127.0.0.1",
+    "COUCHBASE_USER": "test",
+    "COUCHBASE_PASSWORD": "test",
+    "COUCHBASE_BUCKET": "test",
+    "COUCHBASE_KV_ENABLED": "false",
+    "ENCRYPTION_SECRET_KET": "dGVzdC1lbmNyeXB0aW9uLWtleS0zMi1ieXRlcyEhISE=",
+    "AUTH_SECRET_KEY": "test-access-secret",
+    "REFRESH_TOKEN_KEY": "test-refresh-secret",
+    "AUTH_ALGORITHM": "HS256",
+    "EXPIRATION_TIME_MINUTES": "60",
+    "FRONTEND_URL": "http://127.0.0.1",
+    "DOCUMENTATION_URL": "http://127.0.0.1",
+    "BACKEND_DOMAIN_URL": "http://127.0.0.1",
+    "COUCHBASE_DOMAIN_URL": "http://127.0.0.1",
+}
+
+for name, value in TEST_SETTINGS.items():
+    os.environ.setdefault(name, value)
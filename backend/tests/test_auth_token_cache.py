@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+
+import services.AuthServices as auth_services_module
+from services.AuthServices import AuthServices
+from shared.models.authentication import TokenData
+
+
+@pytest.fixture(autouse=True)
+def empty_token_cache():
+    AuthServices._verified_tokens.clear()
+    yield
+    AuthServices._verified_tokens.clear()
+
+
+@pytest.fixture
+def authServices() -> AuthServices:
+    return AuthServices()
+
+
+@pytest.fixture
+def decode_calls(monkeypatch) -> list:
+    """Tokens actually verified by jose, i.e. not served from the cache."""
+    calls = []
+    decode = auth_services_module.jwt.decode
+
+    def counting_decode(token, *args, **kwargs):
+        calls.append(token)
+        return decode(token, *args, **kwargs)
+
+    monkeypatch.setattr(auth_services_module.jwt, "decode", counting_decode)
+
+    return calls
+
+
+USER = TokenData(user_id="user-1", user_email="user@example.org", user_role="user")
+
+
+def test_verified_tokens_are_served_from_the_cache(authServices, decode_calls):
+    token = authServices.create_jwt_token(data=USER)
+
+    first = authServices.decode_jwt_token(token)
+    second = authServices.decode_jwt_token(token)
+
+    assert first == second
+    assert first.user_id == "user-1" and first.sub == "user-1"
+    assert decode_calls == [token]
+
+
+def test_cached_tokens_expire_with_the_token(authServices, decode_calls, monkeypatch):
+    token = authServices.create_jwt_token(data=USER, expires_diff=timedelta(minutes=5))
+    token_data = authServices.decode_jwt_token(token)
+
+    monkeypatch.setattr(auth_services_module.time, "time", lambda: token_data.exp + 1)
+
+    with pytest.raises(HTTPException) as error:
+        authServices.decode_jwt_token(token)
+
+    assert error.value.status_code == 401
+    assert error.value.detail == "Token has expired"
+    assert AuthServices._verified_tokens == {}
+    assert decode_calls == [token]
+
+
+def test_expired_tokens_are_not_cached(authServices):
+    token = authServices.create_jwt_token(data=USER, expires_diff=timedelta(seconds=-1))
+
+    with pytest.raises(HTTPException) as error:
+        authServices.decode_jwt_token(token)
+
+    assert error.value.status_code == 401
+    assert AuthServices._verified_tokens == {}
+
+
+def test_access_tokens_are_not_accepted_as_refresh_tokens(authServices):
+    token = authServices.create_jwt_token(data=USER)
+
+    authServices.decode_jwt_token(token)
+
+    with pytest.raises(HTTPException) as error:
+        authServices.decode_jwt_token(token, refresh=True)
+
+    assert error.value.status_code == 401
+    assert error.value.detail == "Invalid token"
+
+
+def test_refresh_tokens_are_not_accepted_as_access_tokens(authServices):
+    refresh_token = authServices.create_jwt_token(data=USER, refresh_token=True)
+
+    assert authServices.decode_jwt_token(refresh_token, refresh=True).user_id == "user-1"
+
+    with pytest.raises(HTTPException) as error:
+        authServices.decode_jwt_token(refresh_token)
+
+    assert error.value.status_code == 401
+
+
+def test_returned_tokens_are_copies(authServices):
+    token = authServices.create_jwt_token(data=USER)
+
+    first = authServices.decode_jwt_token(token)
+    first.user_role = "admin"
+
+    second = authServices.decode_jwt_token(token)
+    second.user_id = "user-2"
+
+    third = authServices.decode_jwt_token(token)
+
+    assert third.user_role == "user"
+    assert third.user_id == "user-1"
+
+
+def test_cache_keeps_the_most_recently_used_tokens(authServices, decode_calls, monkeypatch):
+    monkeypatch.setattr(authServices.env_settings, "AUTH_TOKEN_CACHE_SIZE", 2)
+
+    tokens = [
+        authServices.create_jwt_token(data=TokenData(user_id=f"user-{index}"))
+        for index in range(3)
+    ]
+
+    authServices.decode_jwt_token(tokens[0])
+    authServices.decode_jwt_token(tokens[1])
+    authServices.decode_jwt_token(tokens[0])
+    authServices.decode_jwt_token(tokens[2])
+
+    decode_calls.clear()
+
+    authServices.decode_jwt_token(tokens[0])
+    authServices.decode_jwt_token(tokens[2])
+    authServices.decode_jwt_token(tokens[1])
+
+    assert len(AuthServices._verified_tokens) == 2
+    assert decode_calls == [tokens[1]]
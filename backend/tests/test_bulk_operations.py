@@ -0,0 +1,169 @@
+import asyncio
+from typing import Dict, List, Set
+
+from repositories.CouchbaseRepository import CouchbaseError, CouchbaseRepository
+
+
+class InMemoryRepository(CouchbaseRepository):
+    """
+    CouchbaseRepository over a dict of documents. Statements touching one of the failing keys
+    raise like the query service would, the bulk operations of the parent class run unchanged.
+    Only the `status` = $1 clause is understood by the WHERE-based operations.
+    """
+
+    def __init__(self, documents: Dict[str, dict], failing_keys: Set[str] = None) -> None:
+        super().__init__(scope="catalogs")
+
+        self.documents = documents
+        self.failing_keys = failing_keys if failing_keys else set()
+        self.statements: List[str] = []
+
+    def __check(self, keys: List[str]) -> None:
+        if self.failing_keys.intersection(keys):
+            raise CouchbaseError("Couchbase error: Timeout", codes=[1080])
+
+    def __matching(self, args: list) -> List[str]:
+        return [key for key, document in self.documents.items() if document.get("status") == args[0]]
+
+    async def upsert_multi(self, collection_name: str, documents: dict[str, dict]) -> dict:
+        self.__check(list(documents.keys()))
+        self.documents.update(documents)
+
+        return dict(status="success", ids=list(documents.keys()))
+
+    async def get_multi(self, collection_name: str, document_keys: list[str]) -> list[dict]:
+        self.__check(document_keys)
+
+        return [{"id": key, collection_name: self.documents[key]} for key in document_keys if key in self.documents]
+
+    async def query(self, statement: str, args: list = None) -> list[dict]:
+        return [{"id": key} for key in self.__matching(args)]
+
+    async def _CouchbaseRepository__statement_handler(self, statement: str, args: list = None, prepare: bool = True) -> dict:
+        self.statements.append(statement)
+
+        keys = args[-1]
+
+        self.__check(keys)
+
+        if statement.startswith("DELETE"):
+            matching = self.__matching(args) if " WHERE " in statement else self.documents
+            deleted = [key for key in keys if key in matching]
+
+            for key in deleted:
+                del self.documents[key]
+
+            return {"results": deleted}
+
+        if statement.startswith("UPDATE"):
+            matching = self.__matching(args)
+            updated = [key for key in keys if key in matching]
+
+            for key in updated:
+                self.documents[key]["status"] = args[1]
+
+            return {"results": updated}
+
+        raise AssertionError(f"Unexpected statement {statement}")
+
+
+def test_upsert_many_reports_failed_chunks_per_key():
+    repository = InMemoryRepository(documents={}, failing_keys={"c"})
+
+    result = asyncio.run(repository.upsert_many("files", {key: {"status": "ready"} for key in "abcde"}, chunk_size=2))
+
+    assert result.succeeded == ["a", "b", "e"]
+    assert sorted(result.failed) == ["c", "d"]
+    assert result.missing == []
+    assert result.status == "partial"
+    assert sorted(repository.documents) == ["a", "b", "e"]
+
+
+def test_upsert_many_without_failures_succeeds():
+    result = asyncio.run(InMemoryRepository(documents={}).upsert_many("files", {"a": {}, "b": {}}))
+
+    assert result.succeeded == ["a", "b"]
+    assert result.status == "success"
+
+
+def test_get_many_partitions_found_missing_and_failed_keys():
+    repository = InMemoryRepository(documents={"a": {"status": "ready"}, "c": {"status": "ready"}, "e": {}}, failing_keys={"e"})
+
+    result = asyncio.run(repository.get_many("files", ["a", "b", "a", "c", "d", "e"], chunk_size=2))
+
+    assert result.succeeded == ["a", "c"]
+    assert result.missing == ["b", "d"]
+    assert list(result.failed) == ["e"]
+    assert [row["id"] for row in result.results] == ["a", "c"]
+    assert result.status == "partial"
+
+
+def test_get_many_reports_failed_when_every_chunk_failed():
+    repository = InMemoryRepository(documents={"a": {}}, failing_keys={"a"})
+
+    result = asyncio.run(repository.get_many("files", ["a"]))
+
+    assert result.status == "failed"
+    assert "Timeout" in result.failed["a"]
+
+
+def test_delete_many_partitions_deleted_missing_and_failed_keys():
+    repository = InMemoryRepository(documents={"a": {}, "b": {}, "d": {}, "e": {}}, failing_keys={"e"})
+
+    result = asyncio.run(repository.delete_many("files", ["a", "c", "b", "b", "d", "e"], chunk_size=2))
+
+    assert result.succeeded == ["a", "b", "d"]
+    assert result.missing == ["c"]
+    assert list(result.failed) == ["e"]
+    assert sorted(repository.documents) == ["e"]
+
+
+def test_update_where_reports_documents_that_stopped_matching_as_missing():
+    repository = InMemoryRepository(documents={key: {"status": "uploading"} for key in "abcde"}, failing_keys={"e"})
+
+    # "b" is completed between the selection of the matching keys and its update
+    async def select_then_change(statement: str, args: list = None) -> list[dict]:
+        rows = [{"id": key} for key, document in repository.documents.items() if document.get("status") == args[0]]
+        repository.documents["b"]["status"] = "ready"
+
+        return rows
+
+    repository.query = select_then_change
+
+    result = asyncio.run(repository.update_where(
+        "files", values={"status": "deleted"}, where="`status` = $1", args=["uploading"], chunk_size=2
+    ))
+
+    assert result.succeeded == ["a", "c", "d"]
+    assert result.missing == ["b"]
+    assert list(result.failed) == ["e"]
+    assert repository.documents["b"]["status"] == "ready"
+    assert repository.documents["a"]["status"] == "deleted"
+
+
+def test_update_where_without_matches_runs_no_update():
+    repository = InMemoryRepository(documents={"a": {"status": "ready"}})
+
+    result = asyncio.run(repository.update_where("files", values={"status": "deleted"}, where="`status` = $1", args=["uploading"]))
+
+    assert result.succeeded == [] and result.missing == [] and result.failed == {}
+    assert result.status == "success"
+    assert repository.statements == []
+
+
+def test_delete_where_keeps_documents_that_stopped_matching():
+    repository = InMemoryRepository(documents={key: {"status": "uploading"} for key in "abc"})
+
+    async def select_then_change(statement: str, args: list = None) -> list[dict]:
+        rows = [{"id": key} for key, document in repository.documents.items() if document.get("status") == args[0]]
+        repository.documents["c"]["status"] = "ready"
+
+        return rows
+
+    repository.query = select_then_change
+
+    result = asyncio.run(repository.delete_where("files", where="`status` = $1", args=["uploading"]))
+
+    assert result.succeeded == ["a", "b"]
+    assert result.missing == ["c"]
+    assert sorted(repository.documents) == ["c"]
@@ -0,0 +1,145 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+from services.CatalogServices import CatalogServices
+from shared.models.bulk_operations import BulkOperationResult
+
+
+class FileVersionsRepository:
+    """In-memory stand-in for the counter documents of catalogs.file_versions and the stored file versions."""
+
+    def __init__(self, stored_versions: Dict[Tuple[str, str, str], int] = None) -> None:
+        self.stored_versions = stored_versions if stored_versions else {}
+        self.counters: Dict[str, dict] = {}
+        self.queries: List[list] = []
+
+    async def get_many(self, collection_name: str, document_keys: List[str], chunk_size: int = None) -> BulkOperationResult:
+        result = BulkOperationResult()
+
+        result.add_succeeded([key for key in document_keys if key in self.counters])
+        result.add_missing([key for key in document_keys if key not in self.counters])
+
+        return result.finish()
+
+    async def query(self, statement: str, args: list = None) -> List[dict]:
+        self.queries.append(args)
+
+        return [
+            dict(file_name=file_name, file_category=file_category, processing_level=processing_level, latest_version=version)
+            for (file_name, file_category, processing_level), version in self.stored_versions.items()
+        ]
+
+    async def increment_counter(
+        self, collection_name: str, key: str, field: str, delta: int = 1, minimum: int = 0, initial: int = 0, document: dict = None
+    ) -> int:
+        # let the other allocations run in between, as a round trip to the data service would
+        await asyncio.sleep(0)
+
+        if key not in self.counters:
+            self.counters[key] = {**(document if document else {}), field: max(initial + delta, minimum)}
+        else:
+            self.counters[key][field] = max(self.counters[key][field] + delta, minimum)
+
+        return self.counters[key][field]
+
+
+def catalog_services(repository: FileVersionsRepository) -> CatalogServices:
+    catalogServices = CatalogServices()
+    catalogServices.couchbaseRepo = repository
+
+    return catalogServices
+
+
+def test_new_files_start_at_version_1():
+    catalogServices = catalog_services(FileVersionsRepository())
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(
+        collection_id="c1",
+        files=[("a.csv", "tabular", "raw", None), ("b.csv", "tabular", "raw", None)]
+    ))
+
+    assert versions == [1, 1]
+
+
+def test_counters_are_seeded_from_the_stored_versions():
+    repository = FileVersionsRepository(stored_versions={("a.csv", "tabular", "raw"): 4})
+    catalogServices = catalog_services(repository)
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(
+        collection_id="c1",
+        files=[("a.csv", "tabular", "raw", None), ("a.csv", "tabular", "raw", None), ("b.csv", "tabular", "raw", None)]
+    ))
+
+    assert versions == [5, 6, 1]
+    assert len(repository.queries) == 1
+
+
+def test_seeded_counters_do_not_query_the_stored_versions_again():
+    repository = FileVersionsRepository(stored_versions={("a.csv", "tabular", "raw"): 4})
+    catalogServices = catalog_services(repository)
+
+    asyncio.run(catalogServices.allocate_file_versions(collection_id="c1", files=[("a.csv", "tabular", "raw", None)]))
+
+    # a version stored meanwhile must not move the counter back
+    repository.stored_versions = {("a.csv", "tabular", "raw"): 2}
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(collection_id="c1", files=[("a.csv", "tabular", "raw", None)]))
+
+    assert versions == [6]
+    assert len(repository.queries) == 1
+
+
+def test_concurrent_allocations_get_distinct_versions():
+    repository = FileVersionsRepository(stored_versions={("a.csv", "tabular", "raw"): 2})
+    catalogServices = catalog_services(repository)
+
+    async def allocate_concurrently() -> List[List[int]]:
+        return await asyncio.gather(*[
+            catalogServices.allocate_file_versions(collection_id="c1", files=[("a.csv", "tabular", "raw", None)] * 3)
+            for _ in range(5)
+        ])
+
+    versions = [version for allocated in asyncio.run(allocate_concurrently()) for version in allocated]
+
+    assert sorted(versions) == list(range(3, 18))
+
+
+def test_versions_are_separated_per_category_and_processing_level():
+    catalogServices = catalog_services(FileVersionsRepository())
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(
+        collection_id="c1",
+        files=[("a.csv", "tabular", "raw", None), ("a.csv", "tabular", "curated", None), ("a.csv", "tabular", "raw", None)]
+    ))
+
+    assert versions == [1, 1, 2]
+
+
+def test_explicit_versions_are_kept_and_move_the_counter_up():
+    catalogServices = catalog_services(FileVersionsRepository(stored_versions={("a.csv", "tabular", "raw"): 2}))
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(
+        collection_id="c1",
+        files=[("a.csv", "tabular", "raw", 7), ("a.csv", "tabular", "raw", None)]
+    ))
+
+    assert versions == [7, 8]
+
+
+def test_explicit_versions_below_the_counter_do_not_move_it_back():
+    catalogServices = catalog_services(FileVersionsRepository(stored_versions={("a.csv", "tabular", "raw"): 9}))
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(
+        collection_id="c1",
+        files=[("a.csv", "tabular", "raw", 3), ("a.csv", "tabular", "raw", None)]
+    ))
+
+    assert versions == [3, 10]
+
+
+def test_requested_version_1_is_allocated_like_no_version():
+    catalogServices = catalog_services(FileVersionsRepository(stored_versions={("a.csv", "tabular", "raw"): 2}))
+
+    versions = asyncio.run(catalogServices.allocate_file_versions(collection_id="c1", files=[("a.csv", "tabular", "raw", 1)]))
+
+    assert versions == [3]
@@ -0,0 +1,150 @@
+import asyncio
+import base64
+import re
+from typing import List
+
+import pytest
+from fastapi import HTTPException
+
+from services.CatalogServices import CatalogServices
+
+
+class CatalogPageRepository:
+    """
+    In-memory stand-in answering the listing statements of CatalogServices: the COUNT query,
+    and the page query with its `id` > $n keyset condition, LIMIT and OFFSET parameters.
+    """
+
+    def __init__(self, collection_name: str, record_ids: List[str]) -> None:
+        self.collection_name = collection_name
+        self.record_ids = sorted(record_ids)
+        self.statements: List[str] = []
+
+    def __parameter(self, statement: str, pattern: str, args: list):
+        match = re.search(pattern, statement)
+
+        return args[int(match.group(1)) - 1] if match else None
+
+    async def query(self, statement: str, args: list = None) -> List[dict]:
+        self.statements.append(statement)
+
+        if "COUNT(*)" in statement:
+            return [{"count": len(self.record_ids)}]
+
+        after = self.__parameter(statement, r"`id` > \$(\d+)", args)
+        limit = self.__parameter(statement, r"LIMIT \$(\d+)", args)
+        offset = self.__parameter(statement, r"OFFSET \$(\d+)", args) or 0
+
+        record_ids = [record_id for record_id in self.record_ids if after is None or record_id > after]
+
+        return [{self.collection_name: {"id": record_id}} for record_id in record_ids[offset:offset + limit]]
+
+
+def catalog_services(repository: CatalogPageRepository, page_size: int = 3) -> CatalogServices:
+    catalogServices = CatalogServices()
+    catalogServices.couchbaseRepo = repository
+    catalogServices.PAGE_SIZE = page_size
+
+    return catalogServices
+
+
+RECORD_IDS = [f"id-{index:02d}" for index in range(8)]
+
+
+def test_token_pages_walk_every_record_once():
+    repository = CatalogPageRepository("collections", RECORD_IDS)
+    catalogServices = catalog_services(repository)
+
+    page = asyncio.run(catalogServices.list_collections())
+    seen = [record.id for record in page.records]
+
+    while page.next_token:
+        page = asyncio.run(catalogServices.list_collections(page_token=page.next_token))
+        seen.extend(record.id for record in page.records)
+
+    assert seen == RECORD_IDS
+
+
+def test_token_pages_do_not_count_the_records():
+    repository = CatalogPageRepository("files", RECORD_IDS)
+    catalogServices = catalog_services(repository)
+
+    first_page = asyncio.run(catalogServices.list_files())
+    repository.statements.clear()
+
+    page = asyncio.run(catalogServices.list_files(page_token=first_page.next_token))
+
+    assert [record.id for record in page.records] == RECORD_IDS[3:6]
+    assert page.total is None
+    assert page.next_page is None
+    assert not any("COUNT(*)" in statement for statement in repository.statements)
+    assert not any("OFFSET" in statement for statement in repository.statements)
+
+
+def test_token_resumes_after_the_last_record_of_the_page():
+    catalogServices = catalog_services(CatalogPageRepository("collections", RECORD_IDS))
+
+    page = asyncio.run(catalogServices.list_collections())
+
+    assert page.records[-1].id == "id-02"
+    assert asyncio.run(catalogServices.list_collections(page_token=page.next_token)).records[0].id == "id-03"
+
+
+def test_last_token_page_has_no_next_token():
+    catalogServices = catalog_services(CatalogPageRepository("collections", RECORD_IDS), page_size=4)
+
+    page = asyncio.run(catalogServices.list_collections())
+    page = asyncio.run(catalogServices.list_collections(page_token=page.next_token))
+
+    assert [record.id for record in page.records] == RECORD_IDS[4:]
+    assert page.next_token is None
+
+
+def test_invalid_token_is_rejected():
+    catalogServices = catalog_services(CatalogPageRepository("collections", RECORD_IDS))
+
+    for page_token in ["not a token", base64.urlsafe_b64encode(b'{"before": "id-01"}').decode()]:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(catalogServices.list_collections(page_token=page_token))
+
+        assert error.value.status_code == 400
+
+
+def test_offset_pages_are_counted():
+    catalogServices = catalog_services(CatalogPageRepository("files", RECORD_IDS))
+
+    page = asyncio.run(catalogServices.list_files(page_number=2))
+
+    assert [record.id for record in page.records] == RECORD_IDS[3:6]
+    assert page.total == len(RECORD_IDS)
+    assert page.next_page == 3
+    assert page.next_token is not None
+
+
+def test_last_offset_page_has_no_next_page():
+    catalogServices = catalog_services(CatalogPageRepository("files", RECORD_IDS))
+
+    page = asyncio.run(catalogServices.list_files(page_number=3))
+
+    assert [record.id for record in page.records] == RECORD_IDS[6:]
+    assert page.next_page is None
+    assert page.next_token is None
+
+
+def test_offset_page_past_the_end_is_rejected():
+    catalogServices = catalog_services(CatalogPageRepository("files", RECORD_IDS))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(catalogServices.list_files(page_number=4))
+
+    assert error.value.status_code == 400
+
+
+def test_empty_catalog_returns_an_empty_first_page():
+    catalogServices = catalog_services(CatalogPageRepository("files", []))
+
+    page = asyncio.run(catalogServices.list_files(page_number=1))
+
+    assert page.records == []
+    assert page.total == 0
+    assert page.next_page is None
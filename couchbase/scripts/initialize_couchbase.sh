@@ -58,6 +58,12 @@ curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lake
 
 curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/catalogs/collections -d name=collections
 
+curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/catalogs/collections -d name=jobs
+
+curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/catalogs/collections -d name=upload_sessions
+
+curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/catalogs/collections -d name=file_versions
+
 curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/credentials/collections -d name=cloud
 
 curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/credentials/collections -d name=hadoop
@@ -68,6 +74,8 @@ curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lake
 
 curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/users/collections -d name=access_requests
 
+curl -u admin:admin1234 -X POST http://127.0.0.1:8091/pools/default/buckets/lakehouse/scopes/users/collections -d name=collection_access
+
 echo "Creating Indexes"
 
 #CREATING INDEXES
@@ -78,6 +86,15 @@ curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
 curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
   -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`catalogs`.`files`'
 
+curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
+  -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`catalogs`.`jobs`'
+
+curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
+  -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`catalogs`.`upload_sessions`'
+
+curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
+  -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`catalogs`.`file_versions`'
+
 curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
   -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`credentials`.`cloud`'
 
@@ -92,3 +109,6 @@ curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
 
 curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
   -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`users`.`access_requests`'
+
+curl -u admin:admin1234 -X POST http://127.0.0.1:8093/query/service \
+  -d 'statement=CREATE PRIMARY INDEX ON `lakehouse`.`users`.`collection_access`'